@@ -0,0 +1,36 @@
+# Cards per second of the bulk CardGenerator against one Card object per card.
+#
+# Usage (from the repository root):
+#   python -m benchmarks.card_generation [--count 200000]
+
+import time
+import argparse
+from classes.card import Card
+from classes.card_generator import CardGenerator
+
+
+def measure(name, generate, count):
+    start = time.perf_counter()
+    rows = generate(count)
+    elapsed = time.perf_counter() - start
+    print(f"{name:<28} {count / elapsed:>12.0f} cards/s")
+    return rows
+
+
+def per_object(count):
+    rows = []
+    for _ in range(count):
+        card = Card(checksum_type="luhn")
+        rows.append((card.number, card.pin, 0))
+    return rows
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--count', type=int, default=200000)
+    args = parser.parse_args()
+    measure('Card() per object', per_object, args.count)
+    generator = CardGenerator()
+    rows = measure('CardGenerator.generate_rows', generator.generate_rows, args.count)
+    existing = {row[0] for row in rows}
+    measure('  deduplicated vs existing', lambda count: generator.generate_rows(count, existing), args.count)
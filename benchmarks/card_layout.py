@@ -0,0 +1,80 @@
+# File size, cache coverage and number lookup latency of the text and compact card layouts.
+#
+# The same cards are stored once per layout (then VACUUMed). A number lookup walks the
+# card_open_number index and then the card table in the text layout, and only the card
+# table (clustered on the number) in the compact one. The sqlite3 module does not expose
+# the page cache hit counters, so the cache column shows how much of the pages a random
+# lookup can touch fit in a --cache-mb page cache: the hit ratio of uniformly random
+# lookups once the cache is warm.
+#
+# Usage (from the repository root):
+#   python -m benchmarks.card_layout [--cards 1000000] [--lookups 20000] [--cache-mb 8]
+
+import os
+import time
+import random
+import argparse
+import tempfile
+from classes.backup import percentile
+from classes.card_generator import CardGenerator
+from classes.database import Database
+
+
+def build(db_file, layout, rows):
+    db = Database()
+    db.db_file = db_file
+    db.layout = layout
+    db.connect()
+    for start in range(0, len(rows), 100000):
+        db.create_card_records(rows[start:start + 100000])
+    db.connection.execute("VACUUM")
+    db.disconnect()
+
+
+def get_lookup_pages(db):
+    names = ("card", "card_open_number") if db.layout == "text" else ("card",)
+    placeholders = ','.join('?' * len(names))
+    return db.connection.execute(f"SELECT COUNT(*) FROM dbstat WHERE name IN ({placeholders})", names).fetchone()[0]
+
+
+def measure(db_file, layout, numbers, lookups, cache_mb):
+    db = Database()
+    db.db_file = db_file
+    db.connect()
+    db.connection.execute(f"PRAGMA cache_size=-{cache_mb * 1024}")
+    page_size = db.connection.execute("PRAGMA page_size").fetchone()[0]
+    pages = get_lookup_pages(db)
+    coverage = min(1, cache_mb * 1024 * 1024 / page_size / pages)
+    sample = random.Random(1).choices(numbers, k=lookups)
+    for number in sample:
+        db.get_card_data_by_number(number)
+    latencies = []
+    for number in sample:
+        started = time.perf_counter()
+        db.get_card_data_by_number(number)
+        latencies.append(time.perf_counter() - started)
+    latencies.sort()
+    db.disconnect()
+    print(f"{layout:>8}  {os.path.getsize(db_file) / 1024 / 1024:>8.1f} MB  {pages:>7} lookup pages  "
+          f"{coverage:>6.1%} cached  p50 {percentile(latencies, 50) * 1e6:>6.1f}us  "
+          f"p99 {percentile(latencies, 99) * 1e6:>6.1f}us")
+
+
+def main(cards, lookups, cache_mb):
+    rows = CardGenerator().generate_rows(cards)
+    numbers = [row[0] for row in rows]
+    print(f"{cards} cards, {lookups} random number lookups, {cache_mb} MB page cache")
+    with tempfile.TemporaryDirectory() as directory:
+        for layout in ("text", "compact"):
+            db_file = os.path.join(directory, f"{layout}.s3db")
+            build(db_file, layout, rows)
+            measure(db_file, layout, numbers, lookups, cache_mb)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--cards', type=int, default=1000000)
+    parser.add_argument('--lookups', type=int, default=20000)
+    parser.add_argument('--cache-mb', type=int, default=8)
+    args = parser.parse_args()
+    main(args.cards, args.lookups, args.cache_mb)
@@ -0,0 +1,76 @@
+# Card search by the last digits of the number (plus an optional prefix): suffix index against a full scan.
+#
+# The cards are created in chunks, then searched with Database.search_cards (an equality
+# search on the card_number_suffix index) and with the LIKE query a search had to run
+# before (a scan of the whole card table).
+#
+# Usage (from the repository root):
+#   python -m benchmarks.card_search [--cards 10000000] [--searches 1000] [--layout text]
+
+import os
+import time
+import random
+import argparse
+import tempfile
+import constants
+from classes.backup import percentile
+from classes.card_generator import CardGenerator
+from classes.database import Database
+
+
+def build(db, cards, chunk_size=200000):
+    generator = CardGenerator()
+    samples = []
+    for start in range(0, cards, chunk_size):
+        rows = generator.generate_rows(min(chunk_size, cards - start))
+        db.create_card_records(rows)
+        samples.append(rows[0][0])
+    return samples
+
+
+def time_searches(search, numbers):
+    latencies = []
+    for number in numbers:
+        started = time.perf_counter()
+        found = search(number)
+        latencies.append(time.perf_counter() - started)
+        # a 4 digits suffix matches 1 card in 10000, more than the limit on big tables
+        assert found
+    latencies.sort()
+    return latencies
+
+
+def main(cards, searches, layout):
+    with tempfile.TemporaryDirectory() as directory:
+        db = Database()
+        db.db_file = os.path.join(directory, 'card.s3db')
+        db.layout = layout
+        db.connect()
+        started = time.perf_counter()
+        samples = build(db, cards)
+        print(f"{cards} cards in the {layout} layout, created in {time.perf_counter() - started:.0f}s")
+        rng = random.Random(1)
+        numbers = [rng.choice(samples) for _ in range(searches)]
+        prefix = "4" + "0" * 5
+        for name, search in (
+                ('last 4', lambda number: db.search_cards(number[-4:], limit=constants.SEARCH_MAX_LIMIT)),
+                ('IIN + last 4', lambda number: db.search_cards(number[-4:], prefix=prefix,
+                                                                limit=constants.SEARCH_MAX_LIMIT)),
+                ('IIN + 9 digits + last 4', lambda number: db.search_cards(number[-4:], prefix=number[:9]))):
+            latencies = time_searches(search, numbers)
+            print(f"{name:>24}  p50 {percentile(latencies, 50) * 1000:>7.2f}ms  "
+                  f"p99 {percentile(latencies, 99) * 1000:>7.2f}ms")
+        scan = f"SELECT id, number, balance, closed_at FROM card WHERE {db.get_number_sql()} LIKE '%' || ? LIMIT ?"
+        latencies = time_searches(lambda number: db.connection.execute(scan, (number[-4:], cards)).fetchall(),
+                                  numbers[:3])
+        print(f"{'full scan, last 4':>24}  p50 {percentile(latencies, 50) * 1000:>7.2f}ms")
+        db.disconnect()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--cards', type=int, default=10000000)
+    parser.add_argument('--searches', type=int, default=1000)
+    parser.add_argument('--layout', choices=constants.CARD_LAYOUTS, default=constants.CARD_LAYOUT)
+    args = parser.parse_args()
+    main(args.cards, args.searches, args.layout)
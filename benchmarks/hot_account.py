@@ -0,0 +1,91 @@
+# Contention on a single hot receiving card: compare-and-swap credits against balance shards.
+#
+# Several processes keep crediting 1 to the same card. Without shards each credit reads
+# the card and writes it back with Database.compare_and_swap_card_record, retrying on
+# CardVersionConflict (the menu transfer path); with shards each credit goes to a random
+# balance shard with Database.credit_hot_card and never conflicts. SQLite still runs one
+# writer at a time, so the gain comes from the conflicts and retries avoided.
+# At the end the card balance must match the number of successful credits.
+#
+# Usage (from the repository root):
+#   python -m benchmarks.hot_account [--workers 4] [--seconds 3] [--shards 16]
+
+import os
+import time
+import argparse
+import tempfile
+import multiprocessing
+from classes.card import Card
+from classes.database import Database, CardVersionConflict
+
+
+def open_database(db_file):
+    db = Database()
+    db.db_file = db_file
+    db.connect()
+    db.connection.execute("PRAGMA busy_timeout=5000")
+    return db
+
+
+def worker(db_file, sharded, seconds, results):
+    db = open_database(db_file)
+    successes = conflicts = 0
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        if sharded:
+            db.credit_hot_card(1, 1)
+            successes += 1
+            continue
+        card = Card(data=db.get_card_data_by_id(1))
+        while True:
+            old_balance = card.balance
+            card.set_balance(int(old_balance) + 1)
+            try:
+                card.mark_stored(db.compare_and_swap_card_record(card.id, card.version, card.get_changes(),
+                                                                 previous_balance=old_balance))
+                successes += 1
+                break
+            except CardVersionConflict:
+                conflicts += 1
+                card.load(db.get_card_data_by_id(card.id))
+    db.disconnect()
+    results.put((successes, conflicts))
+
+
+def run(shards, workers, seconds):
+    with tempfile.TemporaryDirectory() as directory:
+        db_file = os.path.join(directory, 'card.s3db')
+        db = open_database(db_file)
+        db.connection.execute("PRAGMA journal_mode=WAL")
+        db.create_card_record((Card(checksum_type="luhn").number, "0000", 0))
+        if shards:
+            db.set_card_balance_shards(1, shards)
+
+        results = multiprocessing.Queue()
+        processes = [multiprocessing.Process(target=worker, args=(db_file, bool(shards), seconds, results))
+                     for _ in range(workers)]
+        for process in processes:
+            process.start()
+        totals = [results.get() for _ in processes]
+        for process in processes:
+            process.join()
+
+        successes = sum(total[0] for total in totals)
+        conflicts = sum(total[1] for total in totals)
+        balance = db.get_card_data_by_id(1)[3]
+        db.disconnect()
+    attempts = successes + conflicts
+    print(f"{shards:>3} shards  {successes / seconds:>8.0f} credits/s  "
+          f"{100 * conflicts / max(attempts, 1):>6.2f}% conflicts  "
+          f"{'consistent' if balance == successes else 'LOST UPDATES'}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--seconds', type=float, default=3)
+    parser.add_argument('--shards', type=int, default=16)
+    args = parser.parse_args()
+    print(f"{args.workers} writer processes crediting one card, {args.seconds}s per run")
+    for shards in (0, args.shards):
+        run(shards, args.workers, args.seconds)
@@ -0,0 +1,84 @@
+# Login throughput under an attack-like mix, with and without the login throttle.
+#
+# Mixes legitimate logins with PIN guessing against a few target cards and card number
+# stuffing from a few attacker sessions, against a temporary SQLite database. Reports
+# logins/s, how many card lookups reached the database and the throttle memory.
+#
+# Usage (from the repository root):
+#   python -m benchmarks.login_throttle [--cards 100000] [--attempts 200000] [--attack-share 0.8]
+
+import os
+import sys
+import time
+import random
+import argparse
+import tempfile
+from classes.database import Database
+from classes.card_generator import CardGenerator
+from classes.throttle import LoginThrottle
+
+
+def get_attempts(cards, count, attack_share, seconds):
+    """Return (number, pin, session, time) login attempts: legitimate ones and attack ones."""
+    generator = CardGenerator()
+    targets = random.sample(cards, 10)
+    attempts = []
+    for index in range(count):
+        now = index * seconds / count
+        if random.random() >= attack_share:
+            number, pin = random.choice(cards)
+            attempts.append((number, pin, f"user-{random.randrange(count)}", now))
+        elif index % 2:
+            # PIN guessing against a few target cards, from rotating sessions
+            attempts.append((random.choice(targets)[0], f"{random.randrange(10000):04d}",
+                             f"guess-{random.randrange(1000)}", now))
+        else:
+            # card number stuffing from a few sessions
+            attempts.append((generator.generate_numbers(1)[0], "0000", f"stuff-{random.randrange(10)}", now))
+    return attempts
+
+
+def run(db, attempts, throttle):
+    """Replay the attempts the way main.login does; return (successes, lookups, elapsed)."""
+    successes = lookups = 0
+    start = time.perf_counter()
+    for number, pin, session, now in attempts:
+        if throttle is not None and throttle.get_wait(number, session, now) > 0:
+            continue
+        lookups += 1
+        data = db.get_card_data_by_number(number)
+        if not data or data[2] != pin:
+            if throttle is not None:
+                throttle.record_failure(number, session, now)
+            continue
+        if throttle is not None:
+            throttle.record_success(number, session)
+        successes += 1
+    return successes, lookups, time.perf_counter() - start
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--cards', type=int, default=100000)
+    parser.add_argument('--attempts', type=int, default=200000)
+    parser.add_argument('--attack-share', type=float, default=0.8)
+    parser.add_argument('--seconds', type=float, default=60, help='simulated time the attempts are spread over')
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp()
+    db = Database()
+    db.db_file = os.path.join(directory, 'card.s3db')
+    db.connect()
+    rows = CardGenerator().generate_rows(args.cards)
+    db.create_card_records(rows)
+    cards = [(number, pin) for number, pin, balance in rows]
+    attempts = get_attempts(cards, args.attempts, args.attack_share, args.seconds)
+
+    for name, throttle in (("without throttle", None), ("with throttle", LoginThrottle())):
+        successes, lookups, elapsed = run(db, attempts, throttle)
+        memory = ""
+        if throttle is not None:
+            memory = f", {len(throttle.entries)} keys tracked ({sys.getsizeof(throttle.entries) / 2 ** 20:.1f} MiB table)"
+        print(f"{name}: {args.attempts / elapsed:.0f} logins/s, {successes} successful, "
+              f"{lookups} card lookups{memory}")
+    db.disconnect()
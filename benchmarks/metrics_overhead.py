@@ -0,0 +1,79 @@
+# Overhead of the operation metrics on the transfer hot path.
+#
+# Runs the core of a menu transfer (amount check, debit and credit with compare and swap)
+# with and without the metrics decorator and outcome counter, and measures the cost of the
+# instrumentation alone on an empty function, to report it as a share of a transfer.
+#
+# Usage (from the repository root):
+#   python -m benchmarks.metrics_overhead [--backend sqlite] [--transfers 5000]
+
+import os
+import time
+import argparse
+import tempfile
+from classes.card import Card
+from classes.metrics import Metrics, get_outcome
+from classes.storage import get_backend
+import constants
+
+
+def transfer(db, sender_id, receiver_id, amount):
+    """Pay an amount the way main.transfer does, without the prompts."""
+    sender = Card(data=db.get_card_data_by_id(sender_id))
+    if int(sender.balance) < amount:
+        return constants.CARD_TRANSFER_AMOUNT_FAIL
+    sender.set_balance(int(sender.balance) - amount)
+    db.compare_and_swap_card_record(sender.id, sender.version, sender.get_changes(), reason=constants.HISTORY_TRANSFER)
+    receiver = Card(data=db.get_card_data_by_id(receiver_id))
+    receiver.set_balance(int(receiver.balance) + amount)
+    db.compare_and_swap_card_record(receiver.id, receiver.version, receiver.get_changes(),
+                                    reason=constants.HISTORY_TRANSFER)
+    return constants.CARD_TRANSFER_AMOUNT_SUCCESS
+
+
+def run(function, db, transfers):
+    """Return the seconds taken by `transfers` transfers back and forth between cards 1 and 2."""
+    start = time.perf_counter()
+    for index in range(transfers):
+        function(db, 1 + index % 2, 2 - index % 2, 1)
+    return time.perf_counter() - start
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--backend', choices=constants.STORAGE_BACKENDS, default='sqlite')
+    parser.add_argument('--transfers', type=int, default=5000)
+    parser.add_argument('--calls', type=int, default=1000000, help='calls of the empty instrumented function')
+    args = parser.parse_args()
+
+    db = get_backend(args.backend)
+    if args.backend == 'sqlite':
+        db.db_file = os.path.join(tempfile.mkdtemp(), 'card.s3db')
+    db.connect()
+    db.create_card_records([("4000000000000001", "0000", 1000000), ("4000000000000019", "0000", 1000000)])
+    metrics = Metrics()
+
+    @metrics.timed("do_transfer")
+    def instrumented(db, sender_id, receiver_id, amount):
+        message = transfer(db, sender_id, receiver_id, amount)
+        metrics.count("do_transfer", get_outcome(message))
+        return message
+
+    @metrics.timed("empty")
+    def empty():
+        metrics.count("empty", get_outcome(constants.CARD_TRANSFER_AMOUNT_SUCCESS))
+
+    run(transfer, db, args.transfers // 10)
+    plain = min(run(transfer, db, args.transfers) for _ in range(3))
+    measured = min(run(instrumented, db, args.transfers) for _ in range(3))
+
+    start = time.perf_counter()
+    for _ in range(args.calls):
+        empty()
+    cost = (time.perf_counter() - start) / args.calls
+
+    per_transfer = plain / args.transfers
+    print(f"{args.backend}: {per_transfer * 1e6:.1f}us per transfer, instrumentation {cost * 1e6:.2f}us "
+          f"({100 * cost / per_transfer:.2f}% of a transfer); "
+          f"end to end {100 * (measured - plain) / plain:+.2f}% (noise included)")
+    db.disconnect()
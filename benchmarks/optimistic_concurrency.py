@@ -0,0 +1,82 @@
+# Conflict rate against throughput of the compare-and-swap card updates.
+#
+# Several processes keep adding 1 to the balance of random cards, each one reading the card,
+# then writing it back with Database.compare_and_swap_card_record and retrying on
+# CardVersionConflict. The fewer cards share the traffic, the more often writers conflict.
+# At the end the sum of the balances must match the number of successful updates.
+#
+# Usage (from the repository root):
+#   python -m benchmarks.optimistic_concurrency [--workers 4] [--seconds 3]
+
+import os
+import time
+import random
+import argparse
+import tempfile
+import multiprocessing
+from classes.card import Card
+from classes.database import Database, CardVersionConflict
+
+
+def open_database(db_file):
+    db = Database()
+    db.db_file = db_file
+    db.connect()
+    return db
+
+
+def worker(db_file, cards_count, seconds, results):
+    db = open_database(db_file)
+    successes = conflicts = 0
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        card = Card(data=db.get_card_data_by_id(random.randint(1, cards_count)))
+        while True:
+            card.set_balance(int(card.balance) + 1)
+            try:
+                card.mark_stored(db.compare_and_swap_card_record(card.id, card.version, card.get_changes()))
+                successes += 1
+                break
+            except CardVersionConflict:
+                conflicts += 1
+                card.load(db.get_card_data_by_id(card.id))
+    db.disconnect()
+    results.put((successes, conflicts))
+
+
+def run(cards_count, workers, seconds):
+    with tempfile.TemporaryDirectory() as directory:
+        db_file = os.path.join(directory, 'card.s3db')
+        db = open_database(db_file)
+        db.connection.execute("PRAGMA journal_mode=WAL")
+        db.connection.executemany("INSERT INTO card(number,pin,balance) VALUES(?,?,0)",
+                                  [(Card(checksum_type="luhn").number, "0000") for _ in range(cards_count)])
+        db.connection.commit()
+
+        results = multiprocessing.Queue()
+        processes = [multiprocessing.Process(target=worker, args=(db_file, cards_count, seconds, results))
+                     for _ in range(workers)]
+        for process in processes:
+            process.start()
+        totals = [results.get() for _ in processes]
+        for process in processes:
+            process.join()
+
+        successes = sum(total[0] for total in totals)
+        conflicts = sum(total[1] for total in totals)
+        balance = db.connection.execute("SELECT SUM(balance) FROM card").fetchone()[0]
+        db.disconnect()
+    attempts = successes + conflicts
+    print(f"{cards_count:>8} cards  {successes / seconds:>10.0f} updates/s  "
+          f"{100 * conflicts / max(attempts, 1):>6.2f}% conflicts  "
+          f"{'consistent' if balance == successes else 'LOST UPDATES'}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--seconds', type=float, default=3)
+    args = parser.parse_args()
+    print(f"{args.workers} writer processes, {args.seconds}s per run")
+    for cards_count in (1, 10, 100, 10000):
+        run(cards_count, args.workers, args.seconds)
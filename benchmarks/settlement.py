@@ -0,0 +1,91 @@
+# Transfer throughput: one transaction per transfer against netting windows.
+#
+# The traffic is skewed like real payments: most transfers go between a small set of busy
+# cards (merchants, payroll), the rest between random cards. Each transfer is first paid as
+# a single-leg Database.do_batch_transfer (its own transaction, 2 card row writes), then the
+# same transfers are settled with NettingEngine in windows of --window transfers, which
+# writes each touched card once per window. Both runs start from the same balances and
+# must end with the same total.
+#
+# Usage (from the repository root):
+#   python -m benchmarks.settlement [--cards 10000] [--transfers 50000] [--window 5000]
+
+import os
+import time
+import random
+import argparse
+import tempfile
+from classes.card_generator import CardGenerator
+from classes.database import Database
+from classes.settlement import NettingEngine
+
+
+def open_database(db_file, rows):
+    db = Database()
+    db.db_file = db_file
+    db.connect()
+    db.create_card_records(rows)
+    return db
+
+
+def get_traffic(numbers, count, busy_share, seed=1):
+    rng = random.Random(seed)
+    busy = numbers[:max(2, len(numbers) // 100)]
+    traffic = []
+    for _ in range(count):
+        pool = busy if rng.random() < busy_share else numbers
+        sender, receiver = rng.sample(pool, 2)
+        traffic.append((sender, receiver, str(rng.randint(1, 50))))
+    return traffic
+
+
+def get_total(db):
+    return sum(card[3] for card in db.iter_cards(closed=False))
+
+
+def run_per_transfer(db, traffic):
+    card_ids = db.get_card_ids_by_numbers(number for transfer in traffic for number in transfer[:2])
+    paid = 0
+    started = time.perf_counter()
+    for sender, receiver, amount in traffic:
+        (_, _, message), = db.do_batch_transfer(card_ids[sender], [(receiver, amount)])
+        paid += message == '\nSuccess!\n'
+    return paid, 2 * paid, time.perf_counter() - started
+
+
+def run_netting(db, traffic, window):
+    engine = NettingEngine(db, max_transfers=window)
+    started = time.perf_counter()
+    for transfer in traffic:
+        engine.submit(*transfer)
+        if engine.is_due():
+            engine.settle()
+    if engine.pending:
+        engine.settle()
+    return engine.transfers, engine.row_writes, time.perf_counter() - started
+
+
+def main(cards, transfers, window, busy_share):
+    rows = [(number, pin, 1000) for number, pin, _ in CardGenerator().generate_rows(cards)]
+    traffic = get_traffic([row[0] for row in rows], transfers, busy_share)
+    print(f"{cards} cards, {transfers} transfers, {busy_share:.0%} between the 1% busiest cards")
+    with tempfile.TemporaryDirectory() as directory:
+        runs = (('per transfer', run_per_transfer),
+                (f'netting {window}', lambda db, traffic: run_netting(db, traffic, window)))
+        for index, (name, run) in enumerate(runs):
+            db = open_database(os.path.join(directory, f'card{index}.s3db'), rows)
+            paid, writes, seconds = run(db, traffic)
+            consistent = get_total(db) == 1000 * cards
+            db.disconnect()
+            print(f"{name:>14}  {paid:>6} paid  {paid / seconds:>9.0f} transfers/s  {writes:>7} card row writes  "
+                  f"{'consistent' if consistent else 'TOTAL CHANGED'}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--cards', type=int, default=10000)
+    parser.add_argument('--transfers', type=int, default=50000)
+    parser.add_argument('--window', type=int, default=5000)
+    parser.add_argument('--busy-share', type=float, default=0.8)
+    args = parser.parse_args()
+    main(args.cards, args.transfers, args.window, args.busy_share)
@@ -0,0 +1,89 @@
+# Statements per second of generate_statements for 1..N worker processes, against a naive per-card loop.
+#
+# Every card gets a few history entries before and during the month. The naive loop reads
+# each card with Database.get_card_data_by_id and pages through Database.get_card_history,
+# as a script built on the storage methods would, and writes the same files; it runs on a
+# sample of the cards. Creating a file costs from ~10us on tmpfs to several 100us on slow
+# disks, so pass --output to choose where the statements go. On a machine with a single
+# core, more workers can't go faster.
+#
+# Usage (from the repository root):
+#   python -m benchmarks.statements [--cards 200000] [--entries 8] [--workers 4] [--output /dev/shm]
+
+import os
+import time
+import random
+import argparse
+import calendar
+import tempfile
+import constants
+from classes.card_generator import CardGenerator
+from classes.database import Database
+from classes.statements import generate_statements, format_statement
+
+
+def build(db, cards, entries, period_start, period_end):
+    rng = random.Random(1)
+    for start in range(0, cards, 100000):
+        db.create_card_records(CardGenerator().generate_rows(min(100000, cards - start)))
+    history = []
+    for card_id in range(1, cards + 1):
+        for _ in range(entries):
+            history.append((card_id, rng.randrange(period_start - 86400 * 30, period_end), rng.randint(-50, 100),
+                            constants.HISTORY_TRANSFER, None))
+        if len(history) >= 100000:
+            db.connection.executemany(db.get_insert_card_history_sql(), history)
+            history = []
+    db.connection.executemany(db.get_insert_card_history_sql(), history)
+    db.connection.commit()
+
+
+def naive(db, card_ids, period_start, period_end, output_dir):
+    os.makedirs(output_dir)
+    started = time.perf_counter()
+    for card_id in card_ids:
+        card = db.get_card_data_by_id(card_id)
+        entries = []
+        before = None
+        while True:
+            page = db.get_card_history(card_id, before=before, limit=constants.HISTORY_MAX_PAGE_SIZE)
+            entries.extend(page)
+            if len(page) < constants.HISTORY_MAX_PAGE_SIZE:
+                break
+            before = (page[-1][1], page[-1][0])
+        opening = sum(entry[2] for entry in entries if entry[1] < period_start)
+        movements = sorted((entry[1], entry[2], entry[3], entry[4]) for entry in entries
+                           if period_start <= entry[1] < period_end)
+        with open(os.path.join(output_dir, f"{card_id:010d}-{card[1]}.txt"), 'w') as output:
+            output.write(format_statement(card[1], period_start, period_end, opening, movements))
+    return len(card_ids) / (time.perf_counter() - started)
+
+
+def main(cards, entries, max_workers, output):
+    period_start, period_end = calendar.timegm((2026, 9, 1, 0, 0, 0)), calendar.timegm((2026, 10, 1, 0, 0, 0))
+    with tempfile.TemporaryDirectory() as directory, tempfile.TemporaryDirectory(dir=output) as output_dir:
+        db = Database()
+        db.db_file = os.path.join(directory, 'card.s3db')
+        db.connect()
+        build(db, cards, entries, period_start, period_end)
+        print(f"{cards} cards, {entries} history entries each, {os.cpu_count()} cores")
+        sample = range(1, min(cards, 20000) + 1)
+        print(f"{'naive loop':>12}  {naive(db, sample, period_start, period_end, os.path.join(output_dir, 'naive')):>9.0f} "
+              f"statements/s ({len(sample)} cards sample)")
+        db.disconnect()
+        workers = 1
+        while workers <= max_workers:
+            result = generate_statements(db.db_file, os.path.join(output_dir, f"statements-{workers}"), period_start,
+                                         period_end, workers=workers)
+            print(f"{workers:>4} workers  {result['statements_per_second']:>9} statements/s")
+            workers *= 2
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--cards', type=int, default=200000)
+    parser.add_argument('--entries', type=int, default=8)
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--output', help='where the statement files are written (default: the temporary directory)')
+    args = parser.parse_args()
+    main(args.cards, args.entries, args.workers, args.output)
@@ -0,0 +1,33 @@
+# Throughput and memory of the sliding window velocity limits.
+#
+# Simulates operations spread over many cards (plus one runaway card hammering the system)
+# and reports checks/s, the rejected share and the memory held by the counters.
+#
+# Usage (from the repository root):
+#   python -m benchmarks.velocity_limits [--cards 1000000] [--operations 2000000]
+
+import time
+import random
+import argparse
+from classes.velocity import VelocityLimiter
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--cards', type=int, default=1000000)
+    parser.add_argument('--operations', type=int, default=2000000)
+    parser.add_argument('--seconds', type=float, default=2, help='simulated time the operations are spread over')
+    args = parser.parse_args()
+
+    limiter = VelocityLimiter(global_limit=args.operations)
+    card_ids = [random.randint(1, args.cards) if index % 10 else 0 for index in range(args.operations)]
+    step = args.seconds / args.operations
+    rejected = 0
+    start = time.perf_counter()
+    for index, card_id in enumerate(card_ids):
+        if not limiter.allow(card_id, now=index * step):
+            rejected += 1
+    elapsed = time.perf_counter() - start
+    print(f"{args.operations / elapsed:.0f} checks/s, {100 * rejected / args.operations:.1f}% rejected "
+          f"(card 0 gets 10% of the traffic), {limiter.cards.get_key_count()} cards tracked, "
+          f"{limiter.memory_usage() / 2 ** 20:.1f} MiB")
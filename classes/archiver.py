@@ -0,0 +1,57 @@
+import time
+import constants
+
+
+class Archiver:
+    """Move closed cards to the archive table and give the freed space back in small steps.
+
+    Each batch is its own short transaction and at most `vacuum_pages` pages are released
+    after it (PRAGMA incremental_vacuum), with a pause in between, so the writer lock is
+    only ever held briefly and a full VACUUM is never needed.
+
+    Arguments:
+        db -- the connected database
+
+    Keyword arguments:
+        archive_after -- how long (in seconds) a closed card stays in the card table
+        batch_size -- the maximum number of cards archived per transaction
+        vacuum_pages -- the maximum number of pages released per step
+        pause -- the pause (in seconds) between two steps
+    """
+    def __init__(self, db, archive_after=constants.ARCHIVE_AFTER_SECONDS, batch_size=constants.ARCHIVE_BATCH_SIZE,
+                 vacuum_pages=constants.VACUUM_PAGES_PER_STEP, pause=constants.ARCHIVE_PAUSE_SECONDS):
+        self.db = db
+        self.archive_after = archive_after
+        self.batch_size = batch_size
+        self.vacuum_pages = vacuum_pages
+        self.pause = pause
+
+    def run_once(self):
+        """Archive every card closed long enough ago, then release the free pages.
+
+        Returns:
+            The number of archived cards
+        """
+        closed_before = int(time.time()) - self.archive_after
+        archived = 0
+        while True:
+            count = self.db.archive_closed_cards(closed_before, self.batch_size)
+            archived += count
+            self.db.incremental_vacuum(self.vacuum_pages)
+            if count < self.batch_size:
+                break
+            time.sleep(self.pause)
+        while self.db.incremental_vacuum(self.vacuum_pages) > 0:
+            time.sleep(self.pause)
+        return archived
+
+    def run(self, interval=constants.ARCHIVE_INTERVAL_SECONDS, report=print):
+        """Archive closed cards forever, every `interval` seconds.
+
+        Keyword arguments:
+            interval -- the time (in seconds) between two archiving runs
+            report -- called with the number of cards archived by every run
+        """
+        while True:
+            report(self.run_once())
+            time.sleep(interval)
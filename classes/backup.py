@@ -0,0 +1,85 @@
+import time
+import random
+import threading
+import constants
+
+
+class BackupTask:
+    """Take an online backup (see Database.backup) in a background thread and track its progress.
+
+    Arguments:
+        db -- the connected database
+        target_file -- the backup file
+
+    Keyword arguments:
+        pages -- the number of pages copied per step
+        sleep -- the pause (in seconds) between two steps
+    """
+    def __init__(self, db, target_file, pages=constants.BACKUP_PAGES_PER_STEP, sleep=constants.BACKUP_SLEEP_SECONDS):
+        self.db = db
+        self.target_file = target_file
+        self.pages = pages
+        self.sleep = sleep
+        self.copied = 0
+        self.total = 0
+        self.restarts = 0
+        self.error = None
+        self.started_at = None
+        self.finished_at = None
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def start(self):
+        """Start the backup thread."""
+        self.started_at = time.monotonic()
+        self.thread.start()
+
+    def run(self):
+        """Run the backup, keeping any failure in `error`: an exception would only end the thread."""
+        try:
+            self.restarts = self.db.backup(self.target_file, self.pages, self.sleep, progress=self.on_progress)
+        except Exception as e:
+            self.error = e
+        finally:
+            self.finished_at = time.monotonic()
+
+    def on_progress(self, copied, total):
+        self.copied = copied
+        self.total = total
+
+    def is_running(self):
+        """Return if the backup is still running."""
+        return self.thread.is_alive()
+
+    def join(self):
+        """Wait for the backup to finish."""
+        self.thread.join()
+
+
+def probe_latency(db, numbers, keep_going, interval=constants.BACKUP_PROBE_INTERVAL_SECONDS):
+    """Time card lookups (the login query) while `keep_going()` returns True.
+
+    Arguments:
+        db -- the connected database
+        numbers -- the card numbers to look up
+        keep_going -- called before every lookup; the probe stops once it returns False
+
+    Keyword arguments:
+        interval -- the pause (in seconds) between two lookups
+
+    Returns:
+        The sorted lookup latencies, in seconds
+    """
+    latencies = []
+    while keep_going():
+        start = time.perf_counter()
+        db.get_card_data_by_number(random.choice(numbers))
+        latencies.append(time.perf_counter() - start)
+        time.sleep(interval)
+    return sorted(latencies)
+
+
+def percentile(latencies, share):
+    """Return the given percentile (0 to 100) of sorted latencies, or 0 if there are none."""
+    if not latencies:
+        return 0
+    return latencies[min(len(latencies) - 1, int(len(latencies) * share / 100))]
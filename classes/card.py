@@ -11,7 +11,7 @@ class Card:
     iin -- Issuer Identification Number: who issued the card (default 00000)
     card_number_len -- Customer Account Number card length; it counts the `mii` & `iin` as well (default 16)
     checksum -- Used to validate the credit card number using the Luhn algorithm (default "any")
-    data -- Used when passing an existing card
+    data -- Used when passing an existing card (id, number, pin, balance and optionally the row version)
 
     """
     def __init__(self, mii=4, iin="00000", card_number_len=16, checksum_type="any", data=()):
@@ -31,10 +31,29 @@ class Card:
             self.balance = ""
             self.set_balance()
         else:
-            self.set_id(data[0])
-            self.set_number(data[1])
-            self.set_pin(data[2])
-            self.set_balance(data[3])
+            self.load(data)
+
+    def load(self, data):
+        """Set the card details from an existing card record and remember them as stored.
+
+        Arguments:
+            data -- the card record (id, number, pin, balance and optionally the row version)
+        """
+        self.set_id(data[0])
+        self.set_number(data[1])
+        self.set_pin(data[2])
+        self.set_balance(data[3])
+        self.mark_stored(data[4] if len(data) > 4 else None)
+
+    def mark_stored(self, version):
+        """Remember the current card details as the ones stored with the given row version."""
+        self.version = version
+        self.stored = {"number": self.number, "pin": self.pin, "balance": self.balance}
+
+    def get_changes(self):
+        """Return a dict with the card details changed since the card was loaded or stored."""
+        current = {"number": self.number, "pin": self.pin, "balance": self.balance}
+        return {column: value for column, value in current.items() if self.stored.get(column) != value}
 
     def luhn_algo(self, to_check=None):
         """Set the card digits based on the Luhn algorithm or check a given number.
@@ -80,6 +99,9 @@ class Card:
         Keyword arguments:
             number -- the card number (used for a pre-existing card)
         """
+        if isinstance(number, int):
+            # the compact card table layout stores numbers as integers
+            number = str(number)
         if not number:
             self.set_checksum()
             number = self.mii + self.iin + self.ain + self.checksum
@@ -92,6 +114,9 @@ class Card:
         Keyword arguments:
             pin -- the card pin (used for a pre-existing card)
         """
+        if isinstance(pin, int):
+            # the compact card table layout stores PINs as integers, without their leading zeros
+            pin = str(pin).zfill(4)
         if not pin:
             pin_number = random.randint(0, 9999)
             pin = (str(pin_number)).zfill(4)
@@ -141,4 +166,44 @@ class Card:
             self.pin,
             self.balance
             )
-        
\ No newline at end of file
+        
+
+
+def is_valid_number(number, number_length=16):
+    """Return if a given card number has the expected length and a valid Luhn check digit.
+
+    Arguments:
+        number -- the card number to check
+
+    Keyword arguments:
+        number_length -- the card number digits count
+    """
+    if not number.isdigit() or len(number) != number_length:
+        return False
+    fake_card = Card(data=(-1, number, "0000", 0))
+    return number[-1] == fake_card.luhn_algo(number[:-1])
+
+
+def get_typo_candidates(number, number_length=16):
+    """Return the Luhn valid numbers one typo away from a given card number.
+
+    A typo is a single wrong digit or two swapped adjacent digits, the two most common
+    mistakes when typing a card number.
+
+    Arguments:
+        number -- the mistyped card number
+
+    Keyword arguments:
+        number_length -- the card number digits count
+    """
+    if not number.isdigit() or len(number) != number_length:
+        return []
+    candidates = []
+    for index, digit in enumerate(number):
+        for replacement in "0123456789":
+            if replacement != digit:
+                candidates.append(number[:index] + replacement + number[index + 1:])
+    for index in range(len(number) - 1):
+        if number[index] != number[index + 1]:
+            candidates.append(number[:index] + number[index + 1] + number[index] + number[index + 2:])
+    return [candidate for candidate in dict.fromkeys(candidates) if is_valid_number(candidate, number_length)]
@@ -0,0 +1,72 @@
+import time
+import constants
+from classes.card_generator import CardGenerator
+
+
+class CardNumberPool:
+    """Keep the card number pool filled, so issuing a card never generates or checks a number.
+
+    Once the pool depth drops below `low_watermark`, it is refilled up to `target` with
+    unique, Luhn valid numbers (and PINs) from a CardGenerator, in batches of `batch_size`
+    written in a single transaction each.
+
+    Arguments:
+        db -- the connected storage engine
+
+    Keyword arguments:
+        low_watermark -- the pool depth under which the pool is refilled
+        target -- the pool depth a refill stops at
+        batch_size -- the maximum number of card numbers added per transaction
+    """
+    def __init__(self, db, low_watermark=constants.CARD_POOL_LOW_WATERMARK, target=constants.CARD_POOL_TARGET_SIZE,
+                 batch_size=constants.CARD_POOL_BATCH_SIZE):
+        self.db = db
+        self.low_watermark = low_watermark
+        self.target = target
+        self.batch_size = batch_size
+        self.generator = CardGenerator()
+        self.refills = 0
+        self.added = 0
+        self.last_refill_seconds = 0
+
+    def refill(self):
+        """Refill the pool up to `target` if it is below the low watermark; return how many numbers were added."""
+        depth = self.db.get_card_number_pool_size()
+        if depth >= self.low_watermark:
+            return 0
+        started = time.monotonic()
+        added = 0
+        while depth < self.target:
+            rows = self.generator.generate_rows(min(self.batch_size, self.target - depth))
+            count = self.db.fill_card_number_pool(row[:2] for row in rows)
+            if count == 0:
+                break
+            depth += count
+            added += count
+        self.refills += 1
+        self.added += added
+        self.last_refill_seconds = time.monotonic() - started
+        return added
+
+    def get_metrics(self):
+        """Return the pool depth, its thresholds and the refill counters as a dict."""
+        return {
+            "depth": self.db.get_card_number_pool_size(),
+            "low_watermark": self.low_watermark,
+            "target": self.target,
+            "refills": self.refills,
+            "added": self.added,
+            "last_refill_seconds": round(self.last_refill_seconds, 3),
+        }
+
+    def run(self, interval=constants.CARD_POOL_CHECK_INTERVAL_SECONDS, report=print):
+        """Check the pool depth forever, every `interval` seconds, refilling it when needed.
+
+        Keyword arguments:
+            interval -- the time (in seconds) between two depth checks
+            report -- called with the metrics (see get_metrics) after every refill
+        """
+        while True:
+            if self.refill():
+                report(self.get_metrics())
+            time.sleep(interval)
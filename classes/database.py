@@ -95,16 +95,33 @@
 #
 # Bye!
 
+import os
+import sys
+import time
+import json
+import random
+import threading
 import constants
 import sqlite3
 from sqlite3 import Error
+from classes.storage import StorageBackend, CardVersionConflict, check_batch_legs, pay_scheduled_runs
 
-class Database:
+class Database(StorageBackend):
     def __init__(self):
         self.message_delimiter = "--------------------------------------------------------------------"
         self.db_file = constants.DATABASE_FILE
         self.connection = None
         self.verbose = False
+        self.idempotent_saves = 0
+        self.in_memory = False
+        self.checkpoint_interval = constants.CHECKPOINT_INTERVAL_SECONDS
+        self.checkpoint_thread = None
+        self.checkpoint_stop = threading.Event()
+        self.checkpoint_lock = threading.Lock()
+        self.last_checkpoint_at = None
+        self.last_checkpoint_duration = 0
+        self.auto_migrate = True
+        self.layout = constants.CARD_LAYOUT
 
     def print_version_message(self):
         """Print the SQLite version on a successful connection to the database file."""
@@ -125,8 +142,11 @@ class Database:
     def create_connection(self):
         """Create a database connection to a SQLite database."""
         try:
-            self.connection = sqlite3.connect(self.db_file)
-        
+            if self.in_memory:
+                self.connection = self.load_into_memory()
+            else:
+                self.connection = sqlite3.connect(self.db_file)
+
             if self.verbose:
                 self.print_version_message()
         except Error as e:
@@ -136,46 +156,547 @@ class Database:
         """Create a table if the connection is successful."""
         self.create_connection()
         if self.connection is not None:
+            self.set_auto_vacuum()
             self.create_card_table()
+            self.layout = self.get_card_layout()
+            self.create_card_archive_table()
+            self.create_idempotency_key_table()
+            self.create_schedule_table()
+            self.create_batch_job_tables()
+            self.create_card_number_pool_table()
+            self.create_card_history_table()
+            self.create_schema_version_table()
+            if self.auto_migrate:
+                # imported here: the migrations module builds on this one
+                from classes.migrations import Migrator
+                Migrator(self).run_fast()
+                # the indexes need the migrated card columns
+                self.create_card_number_index()
         else:
             print("Error: cannot create the database connection.")
 
     def disconnect(self):
-        """Disconnects from a database connection."""
+        """Disconnects from a database connection (after a last checkpoint when running in memory)."""
         if self.connection:
+            if self.in_memory:
+                self.stop_checkpoints()
+                self.connection.commit()
+                self.checkpoint()
             self.connection.close()
 
+    def load_into_memory(self):
+        """Load the database file into an in-memory database and start the periodic checkpoints.
+
+        The in-memory database uses the `memdb` VFS, so the checkpoint thread can open its
+        own connection to it and always copies a committed, consistent state.
+
+        Returns:
+            The connection to the in-memory database
+        """
+        self.memory_uri = f"file:/{os.path.basename(self.db_file)}-{id(self)}?vfs=memdb"
+        connection = sqlite3.connect(self.memory_uri, uri=True)
+        disk = sqlite3.connect(self.db_file)
+        disk.backup(connection)
+        disk.close()
+        self.last_checkpoint_at = time.time()
+        self.start_checkpoints()
+        return connection
+
+    def checkpoint(self):
+        """Copy the in-memory database to the database file.
+
+        The committed state is first copied to a private in-memory snapshot, which only
+        blocks writers for a memory copy, then the snapshot is written to the file, so a
+        crash during the write leaves the previous checkpoint intact.
+        """
+        with self.checkpoint_lock:
+            started = time.monotonic()
+            snapshot = sqlite3.connect(':memory:')
+            source = sqlite3.connect(self.memory_uri, uri=True)
+            while True:
+                try:
+                    source.backup(snapshot)
+                    break
+                except sqlite3.OperationalError:
+                    # a write transaction is open, try again once it is committed
+                    time.sleep(constants.CHECKPOINT_RETRY_SECONDS)
+            source.close()
+            disk = sqlite3.connect(self.db_file)
+            snapshot.backup(disk)
+            disk.close()
+            snapshot.close()
+            self.last_checkpoint_at = time.time()
+            self.last_checkpoint_duration = time.monotonic() - started
+
+    def run_checkpoints(self):
+        """Checkpoint every `checkpoint_interval` seconds until stopped."""
+        while not self.checkpoint_stop.wait(self.checkpoint_interval):
+            try:
+                self.checkpoint()
+            except Error as e:
+                print(e, file=sys.stderr)
+
+    def start_checkpoints(self):
+        """Start the background checkpoint thread."""
+        self.checkpoint_stop.clear()
+        self.checkpoint_thread = threading.Thread(target=self.run_checkpoints, daemon=True)
+        self.checkpoint_thread.start()
+
+    def stop_checkpoints(self):
+        """Stop the background checkpoint thread."""
+        self.checkpoint_stop.set()
+        if self.checkpoint_thread:
+            self.checkpoint_thread.join()
+            self.checkpoint_thread = None
+
+    def backup(self, target_file, pages=constants.BACKUP_PAGES_PER_STEP, sleep=constants.BACKUP_SLEEP_SECONDS,
+               progress=None):
+        """Copy a consistent snapshot of the database to another file without stalling live traffic.
+
+        The copy runs on its own connection, `pages` pages per step with a `sleep` between steps,
+        so the source is only locked for one short step at a time. A write from another
+        connection makes SQLite restart the copy; after BACKUP_MAX_RESTARTS restarts the
+        step size is multiplied by 4 so the backup still finishes under heavy write traffic.
+
+        Arguments:
+            target_file -- the backup file
+
+        Keyword arguments:
+            pages -- the number of pages copied per step
+            sleep -- the pause (in seconds) between two steps
+            progress -- called with (copied pages, total pages) after every step
+
+        Returns:
+            The number of restarts caused by concurrent writes
+        """
+        class Restarted(Exception):
+            pass
+
+        restarts = 0
+        while True:
+            state = {"remaining": None, "restarts": 0}
+
+            def on_progress(status, remaining, total):
+                if state["remaining"] is not None and remaining > state["remaining"]:
+                    state["restarts"] += 1
+                    if state["restarts"] > constants.BACKUP_MAX_RESTARTS:
+                        raise Restarted()
+                state["remaining"] = remaining
+                if progress:
+                    progress(total - remaining, total)
+
+            if self.in_memory:
+                source = sqlite3.connect(self.memory_uri, uri=True)
+            else:
+                source = sqlite3.connect(self.db_file)
+            target = sqlite3.connect(target_file)
+            try:
+                source.backup(target, pages=pages, progress=on_progress, sleep=sleep)
+                return restarts + state["restarts"]
+            except Restarted:
+                restarts += state["restarts"]
+                pages = pages * 4 if pages > 0 else pages
+            finally:
+                target.close()
+                source.close()
+
+    def get_data_loss_window(self):
+        """Return the longest time (in seconds) a committed change can be lost by a crash when running in memory.
+
+        A change committed right after a checkpoint started only reaches the file at the end
+        of the next one: one interval plus one checkpoint duration later. Without the
+        in-memory mode every commit is durable and the window is 0.
+        """
+        if not self.in_memory:
+            return 0
+        return self.checkpoint_interval + self.last_checkpoint_duration
+
+    def set_auto_vacuum(self):
+        """Use incremental auto vacuum, so space freed by archiving can be released in small steps.
+
+        The setting only takes effect on a new database file; an existing file keeps its mode
+        until enable_incremental_vacuum runs a full VACUUM once.
+        """
+        self.connection.execute("PRAGMA auto_vacuum = INCREMENTAL")
+
+    def enable_incremental_vacuum(self):
+        """Switch an existing database file to incremental auto vacuum (runs a full, blocking VACUUM)."""
+        self.set_auto_vacuum()
+        self.connection.execute("VACUUM")
+
     def get_create_default_card_table_sql(self):
         """Return the default SQL to create the card table."""
         return ''' CREATE TABLE IF NOT EXISTS card (
                                     id integer PRIMARY KEY,
                                     number text NOT NULL,
                                     pin text NOT NULL,
-                                    balance integer default 0
+                                    balance integer default 0,
+                                    closed_at integer,
+                                    version integer NOT NULL DEFAULT 0
                                 ); '''
 
+    def get_create_compact_card_table_sql(self, table="card"):
+        """Return the SQL to create the compact card table.
+
+        Numbers and PINs are stored as integers (8 and 2 bytes instead of 16 and 4 characters)
+        and the rows are clustered on the number, so a number lookup is a single B-tree
+        search without a separate number index. Ids are looked up through a unique index.
+
+        Keyword arguments:
+            table -- the table name
+        """
+        return f''' CREATE TABLE IF NOT EXISTS {table} (
+                                    number integer NOT NULL,
+                                    id integer NOT NULL,
+                                    pin integer NOT NULL,
+                                    balance integer default 0,
+                                    closed_at integer,
+                                    version integer NOT NULL DEFAULT 0,
+                                    balance_shards integer NOT NULL DEFAULT 0,
+                                    PRIMARY KEY (number, id)
+                                ) WITHOUT ROWID;
+                CREATE UNIQUE INDEX IF NOT EXISTS card_id ON {table}(id); '''
+
     def create_card_table(self, create_card_table_sql=""):
-        """Create the card table.
+        """Create the card table, in the `layout` layout if it does not exist yet.
 
         Arguments:
             create_card_table_sql -- a create table statement
         """
         try:
-            cur = self.connection.cursor()
             if create_card_table_sql == "":
-                create_card_table_sql = self.get_create_default_card_table_sql()
-            cur.execute(create_card_table_sql)
+                if self.layout == "compact":
+                    create_card_table_sql = self.get_create_compact_card_table_sql()
+                else:
+                    create_card_table_sql = self.get_create_default_card_table_sql()
+            self.connection.executescript(create_card_table_sql)
         
             if self.verbose:
                 self.print_table_create_success_message("card")
         except Error as e:
             print(e)
 
+    def get_card_layout(self):
+        """Return the layout of the existing card table: compact (WITHOUT ROWID) or text."""
+        row = self.connection.execute("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'card'").fetchone()
+        return "compact" if row and "WITHOUT ROWID" in row[0].upper() else "text"
+
+    def get_number_sql(self):
+        """Return the SQL expression reading a card number as text, whatever the layout."""
+        return "CAST(number AS TEXT)" if self.layout == "compact" else "number"
+
+    def get_pin_sql(self):
+        """Return the SQL expression reading a PIN as 4 digits text, whatever the layout."""
+        return "printf('%04d', pin)" if self.layout == "compact" else "pin"
+
+    def count_layout_blockers(self, layout):
+        """Return the number of cards whose number or PIN can't be stored in the given layout.
+
+        The compact layout stores numbers and PINs as integers, so a number must fit in
+        18 digits without a leading zero and a PIN must be 4 digits.
+        """
+        if layout != "compact":
+            return 0
+        return self.connection.execute(''' SELECT COUNT(*) FROM card
+                WHERE NOT (number GLOB '[1-9]*' AND number NOT GLOB '*[^0-9]*' AND length(number) <= 18
+                           AND pin GLOB '[0-9][0-9][0-9][0-9]') ''').fetchone()[0]
+
+    def convert_card_layout(self, layout):
+        """Rebuild the card table in the given layout, in one immediate transaction.
+
+        The rows are copied to a new table, which then replaces the card table; writers
+        wait for the copy (readers of a WAL database don't). Columns added by migrations
+        are carried over as they are.
+
+        Arguments:
+            layout -- the target layout (see constants.CARD_LAYOUTS)
+
+        Returns:
+            True if the card table is in the given layout, False if some cards can't be
+            stored in it (see count_layout_blockers), in which case nothing changed
+        """
+        if layout == self.layout:
+            return True
+        self.connection.execute("BEGIN IMMEDIATE")
+        with self.connection:
+            cur = self.connection.cursor()
+            if self.count_layout_blockers(layout):
+                return False
+            cur.execute("DROP TABLE IF EXISTS card_converted")
+            if layout == "compact":
+                create_sql = self.get_create_compact_card_table_sql("card_converted")
+            else:
+                create_sql = self.get_create_default_card_table_sql().replace("card (", "card_converted (", 1)
+            for statement in create_sql.split(";"):
+                if statement.strip():
+                    cur.execute(statement)
+            targets = [row[1] for row in cur.execute("PRAGMA table_info(card_converted)")]
+            columns = []
+            for _, name, column_type, not_null, default, _ in cur.execute("PRAGMA table_info(card)").fetchall():
+                if name not in targets:
+                    constraints = (" NOT NULL" if not_null else "") + (f" DEFAULT {default}" if default is not None else "")
+                    cur.execute(f"ALTER TABLE card_converted ADD COLUMN {name} {column_type}{constraints}")
+                columns.append(name)
+            # integer columns take the text numbers and PINs as they are; the way back needs the PIN leading zeros
+            values = {"number": "CAST(number AS TEXT)", "pin": "printf('%04d', pin)"} if layout == "text" else {}
+            cur.execute(f''' INSERT INTO card_converted({', '.join(columns)})
+                    SELECT {', '.join(values.get(column, column) for column in columns)} FROM card ''')
+            cur.execute("DROP TABLE card")
+            cur.execute("ALTER TABLE card_converted RENAME TO card")
+            self.layout = layout
+            for statement in self.get_create_card_number_index_sql().split(";"):
+                if statement.strip():
+                    cur.execute(statement)
+        return True
+
+    def get_create_schema_version_table_sql(self):
+        """Return the SQL to create the table of applied schema migrations."""
+        return ''' CREATE TABLE IF NOT EXISTS schema_version (
+                                    version integer PRIMARY KEY,
+                                    name text NOT NULL,
+                                    applied_at integer NOT NULL
+                                ); '''
+
+    def create_schema_version_table(self):
+        """Create the schema version table."""
+        try:
+            cur = self.connection.cursor()
+            cur.execute(self.get_create_schema_version_table_sql())
+
+            if self.verbose:
+                self.print_table_create_success_message("schema_version")
+        except Error as e:
+            print(e)
+
+    def get_schema_version(self):
+        """Return the version of the last applied migration, or 0 if there is none."""
+        return self.connection.execute("SELECT IFNULL(MAX(version), 0) FROM schema_version").fetchone()[0]
+
+    def get_applied_migrations(self):
+        """Return the set of applied migration versions."""
+        return {row[0] for row in self.connection.execute("SELECT version FROM schema_version")}
+
+    def apply_schema_change(self, apply=None, version=None, name=None):
+        """Apply a schema change and record the migration version, in one immediate transaction.
+
+        The immediate transaction takes the write lock first, so when several processes
+        start at once only one of them applies a given migration.
+
+        Keyword arguments:
+            apply -- a callable taking a cursor and changing the schema; it must be safe to run twice
+            version -- the migration version to record, or None to record nothing
+            name -- the migration name
+
+        Returns:
+            False if the version was already recorded, True otherwise
+        """
+        self.connection.execute("BEGIN IMMEDIATE")
+        with self.connection:
+            cur = self.connection.cursor()
+            if version is not None:
+                cur.execute("SELECT 1 FROM schema_version WHERE version = ?", (version,))
+                if cur.fetchone():
+                    return False
+            if apply is not None:
+                apply(cur)
+            if version is not None:
+                cur.execute("INSERT INTO schema_version(version, name, applied_at) VALUES(?,?,?)",
+                            (version, name, int(time.time())))
+        return True
+
+    def get_create_card_number_index_sql(self):
+        """Return the SQL of the partial indexes on open card numbers and on closed cards."""
+        if self.layout == "compact":
+            # the compact card table is clustered on the number already
+            return f''' CREATE INDEX IF NOT EXISTS card_closed_at ON card(closed_at) WHERE closed_at IS NOT NULL;
+                CREATE INDEX IF NOT EXISTS card_number_suffix ON card({self.get_number_suffix_sql()}, number); '''
+        return f''' DROP INDEX IF EXISTS card_number;
+                CREATE INDEX IF NOT EXISTS card_open_number ON card(number) WHERE closed_at IS NULL;
+                CREATE INDEX IF NOT EXISTS card_closed_at ON card(closed_at) WHERE closed_at IS NOT NULL;
+                CREATE INDEX IF NOT EXISTS card_number_suffix ON card({self.get_number_suffix_sql()}, number); '''
+
+    def get_number_suffix_sql(self):
+        """Return the SQL expression of the last SEARCH_SUFFIX_DIGITS digits of a card number, as indexed by card_number_suffix."""
+        if self.layout == "compact":
+            return f"number % {pow(10, constants.SEARCH_SUFFIX_DIGITS)}"
+        return f"substr(number, -{constants.SEARCH_SUFFIX_DIGITS})"
+
+    def create_card_number_index(self):
+        """Create the card number indexes, used by logins, receiver lookups and the archiver."""
+        try:
+            self.connection.executescript(self.get_create_card_number_index_sql())
+        except Error as e:
+            print(e)
+
+    def get_create_card_archive_table_sql(self):
+        """Return the SQL to create the table holding archived (closed) cards."""
+        return ''' CREATE TABLE IF NOT EXISTS card_archive (
+                                    id integer PRIMARY KEY,
+                                    number text NOT NULL,
+                                    pin text NOT NULL,
+                                    balance integer default 0,
+                                    closed_at integer NOT NULL,
+                                    archived_at integer NOT NULL
+                                ); '''
+
+    def create_card_archive_table(self):
+        """Create the card archive table."""
+        try:
+            cur = self.connection.cursor()
+            cur.execute(self.get_create_card_archive_table_sql())
+
+            if self.verbose:
+                self.print_table_create_success_message("card_archive")
+        except Error as e:
+            print(e)
+
+    def get_create_idempotency_key_table_sql(self):
+        """Return the SQL to create the idempotency key table and its retention index."""
+        return ''' CREATE TABLE IF NOT EXISTS idempotency_key (
+                                    card_id integer NOT NULL,
+                                    key text NOT NULL,
+                                    created_at integer NOT NULL,
+                                    result text NOT NULL,
+                                    PRIMARY KEY (card_id, key)
+                                ) WITHOUT ROWID;
+                CREATE INDEX IF NOT EXISTS idempotency_key_created_at ON idempotency_key(created_at); '''
+
+    def create_idempotency_key_table(self):
+        """Create the table remembering the results of operations sent with an idempotency key."""
+        try:
+            self.connection.executescript(self.get_create_idempotency_key_table_sql())
+
+            if self.verbose:
+                self.print_table_create_success_message("idempotency_key")
+        except Error as e:
+            print(e)
+
+    def get_create_schedule_table_sql(self):
+        """Return the SQL to create the standing order table and its next run index."""
+        return ''' CREATE TABLE IF NOT EXISTS schedule (
+                                    id integer PRIMARY KEY,
+                                    card_id integer NOT NULL,
+                                    receiver text NOT NULL,
+                                    amount integer NOT NULL,
+                                    interval_seconds integer NOT NULL,
+                                    next_run_at integer NOT NULL,
+                                    active integer NOT NULL DEFAULT 1
+                                );
+                CREATE INDEX IF NOT EXISTS schedule_next_run_at ON schedule(next_run_at) WHERE active = 1; '''
+
+    def create_schedule_table(self):
+        """Create the standing order (scheduled, recurring transfer) table."""
+        try:
+            self.connection.executescript(self.get_create_schedule_table_sql())
+
+            if self.verbose:
+                self.print_table_create_success_message("schedule")
+        except Error as e:
+            print(e)
+
+    def get_create_batch_job_tables_sql(self):
+        """Return the SQL to create the batch job progress table and the balance adjustment ledger."""
+        return ''' CREATE TABLE IF NOT EXISTS batch_job (
+                                    job_id text PRIMARY KEY,
+                                    last_id integer NOT NULL DEFAULT 0,
+                                    max_id integer NOT NULL,
+                                    finished_at integer
+                                );
+                CREATE TABLE IF NOT EXISTS ledger (
+                                    id integer PRIMARY KEY,
+                                    card_id integer NOT NULL,
+                                    amount integer NOT NULL,
+                                    reason text NOT NULL,
+                                    created_at integer NOT NULL
+                                );
+                CREATE INDEX IF NOT EXISTS ledger_card_id ON ledger(card_id); '''
+
+    def create_batch_job_tables(self):
+        """Create the batch job progress and ledger tables."""
+        try:
+            self.connection.executescript(self.get_create_batch_job_tables_sql())
+
+            if self.verbose:
+                self.print_table_create_success_message("batch_job")
+                self.print_table_create_success_message("ledger")
+        except Error as e:
+            print(e)
+
+    def get_create_card_number_pool_table_sql(self):
+        """Return the SQL to create the table of pre-generated card numbers waiting to be issued."""
+        return ''' CREATE TABLE IF NOT EXISTS card_number_pool (
+                                    id integer PRIMARY KEY,
+                                    number text NOT NULL UNIQUE,
+                                    pin text NOT NULL
+                                ); '''
+
+    def create_card_number_pool_table(self):
+        """Create the card number pool table."""
+        try:
+            cur = self.connection.cursor()
+            cur.execute(self.get_create_card_number_pool_table_sql())
+
+            if self.verbose:
+                self.print_table_create_success_message("card_number_pool")
+        except Error as e:
+            print(e)
+
+    def get_create_card_history_table_sql(self):
+        """Return the SQL to create the card history table and its covering (card id, time) index."""
+        return ''' CREATE TABLE IF NOT EXISTS card_history (
+                                    id integer PRIMARY KEY,
+                                    card_id integer NOT NULL,
+                                    created_at integer NOT NULL,
+                                    amount integer NOT NULL,
+                                    reason text NOT NULL,
+                                    counterparty text
+                                );
+                CREATE INDEX IF NOT EXISTS card_history_card_created_at
+                    ON card_history(card_id, created_at, id, amount, reason, counterparty); '''
+
+    def create_card_history_table(self):
+        """Create the table recording every balance change of every card."""
+        try:
+            self.connection.executescript(self.get_create_card_history_table_sql())
+
+            if self.verbose:
+                self.print_table_create_success_message("card_history")
+        except Error as e:
+            print(e)
+
+    def get_insert_card_history_sql(self):
+        """Return the SQL to add a (card id, created at, amount, reason, counterparty) card history entry."""
+        return ''' INSERT INTO card_history(card_id, created_at, amount, reason, counterparty)
+                VALUES(?,?,?,?,?) '''
+
+    def get_total_balance_sql(self):
+        """Return the SQL expression of a card balance: the card row balance plus, for a hot card, its balance shards."""
+        return ''' balance + CASE WHEN balance_shards > 0
+                THEN (SELECT IFNULL(SUM(balance), 0) FROM card_balance_shard WHERE card_id = card.id)
+                ELSE 0 END '''
+
     def get_default_insert_card_sql(self):
         """Return the default SQL to insert a new card into the card table."""
+        if self.layout == "compact":
+            # without a rowid, the next id is taken from the card id index
+            return ''' INSERT INTO card(id,number,pin,balance)
+                VALUES((SELECT IFNULL(MAX(id), 0) + 1 FROM card),?,?,?) '''
         return ''' INSERT INTO card(number,pin,balance)
                 VALUES(?,?,?) '''
 
+    def insert_card(self, cur, data, insert_card_sql=""):
+        """Insert a card with the cursor of the calling transaction and return its id.
+
+        Arguments:
+            cur -- the cursor of the calling transaction
+            data -- the (number, pin, balance) card data
+            insert_card_sql -- an insert into table statement
+        """
+        cur.execute(insert_card_sql or self.get_default_insert_card_sql(), data)
+        if self.layout == "compact":
+            return cur.execute("SELECT MAX(id) FROM card").fetchone()[0]
+        return cur.lastrowid
+
     def create_card_record(self, data, insert_card_sql=""):
         """Create a database card record.
 
@@ -186,18 +707,82 @@ class Database:
         if insert_card_sql == "":
             insert_card_sql = self.get_default_insert_card_sql()
         cur = self.connection.cursor()
-        cur.execute(insert_card_sql, data)
+        card_id = self.insert_card(cur, data, insert_card_sql)
         self.connection.commit()
         
         if self.verbose:
-            self.print_record_add_success_message(cur.lastrowid, "card")
+            self.print_record_add_success_message(card_id, "card")
+
+    def create_card_records(self, rows, insert_card_sql=""):
+        """Create many database card records in a single transaction.
+
+        Arguments:
+            rows -- an iterable of (number, pin, balance) card data
+            insert_card_sql -- an insert into table statement
+        """
+        if insert_card_sql == "":
+            insert_card_sql = self.get_default_insert_card_sql()
+        with self.connection:
+            self.connection.executemany(insert_card_sql, rows)
+
+    def fill_card_number_pool(self, rows):
+        """Add card numbers to the pool in a single transaction.
+
+        Numbers already in the pool or used by an open card are skipped. Cards created
+        without the pool can still take a pooled number later, so issue_pool_cards checks
+        the numbers again when it pops them.
+
+        Arguments:
+            rows -- an iterable of (number, pin) pairs
+
+        Returns:
+            The number of pooled numbers added
+        """
+        with self.connection:
+            cur = self.connection.cursor()
+            cur.executemany(''' INSERT OR IGNORE INTO card_number_pool(number, pin)
+                SELECT ?1, ?2 WHERE NOT EXISTS (SELECT 1 FROM card WHERE number = ?1 AND closed_at IS NULL) ''', rows)
+            return cur.rowcount
+
+    def get_card_number_pool_size(self):
+        """Return the number of pooled card numbers left."""
+        return self.connection.execute("SELECT COUNT(*) FROM card_number_pool").fetchone()[0]
+
+    def issue_pool_cards(self, count=1):
+        """Pop card numbers from the pool and create their cards in the same transaction.
+
+        The numbers are popped (oldest first) with a single DELETE ... RETURNING statement,
+        so concurrent issuers never get the same number. A popped number taken by an open
+        card since it was pooled (issued without the pool) is dropped and another one popped.
+
+        Keyword arguments:
+            count -- the maximum number of cards to issue
+
+        Returns:
+            A list of (id, number, pin, balance) card data; shorter than `count` if the pool ran dry
+        """
+        with self.connection:
+            cur = self.connection.cursor()
+            cards = []
+            while len(cards) < count:
+                popped = cur.execute(''' DELETE FROM card_number_pool
+                    WHERE id IN (SELECT id FROM card_number_pool ORDER BY id LIMIT ?)
+                    RETURNING number, pin ''', (count - len(cards),)).fetchall()
+                if not popped:
+                    break
+                taken = self.get_card_ids_by_numbers(number for number, pin in popped)
+                for number, pin in popped:
+                    if number not in taken:
+                        cards.append((self.insert_card(cur, (number, pin, 0)), number, pin, 0))
+        return cards
 
     def get_update_card_sql(self):
         """Return the default SQL to update a card into the card table."""
         return ''' UPDATE card
                 SET number = ? ,
                     pin = ? ,
-                    balance = ?
+                    balance = ? ,
+                    version = version + 1
                 WHERE id = ?'''
 
     def update_card_record(self, data, update_card_sql=""):
@@ -213,6 +798,54 @@ class Database:
         cur.execute(update_card_sql, data)
         self.connection.commit()
 
+    def compare_and_swap_card_record(self, card_id, version, changes, reason=constants.HISTORY_UPDATE, counterparty=None,
+                                     previous_balance=None):
+        """Update only the changed columns of a card record, if nobody else changed it since it was read.
+
+        A balance change is recorded in the card history, in the same transaction. With
+        `previous_balance`, the balance moves by the difference instead of being overwritten:
+        this is required for hot cards, whose balance shards take credits without changing
+        the card version.
+
+        Arguments:
+            card_id -- the card record id
+            version -- the row version the changes are based on
+            changes -- a dict with the changed columns (number, pin, balance) and their new values
+
+        Keyword arguments:
+            reason -- the card history reason of a balance change
+            counterparty -- the other card number of a transfer, if any
+            previous_balance -- the balance the new balance was computed from
+
+        Returns:
+            The new row version
+
+        Raises:
+            CardVersionConflict -- if the card record is no longer at the given version
+        """
+        columns = [column for column in changes if column in ("number", "pin", "balance")]
+        values = [changes[column] for column in columns]
+        assignments = [f"{column} = ?" for column in columns]
+        if "balance" in columns and previous_balance is not None:
+            index = columns.index("balance")
+            assignments[index] = "balance = balance + ?"
+            values[index] = int(changes["balance"]) - int(previous_balance)
+        with self.connection:
+            cur = self.connection.cursor()
+            if "balance" in columns:
+                # the amount is taken from the row about to be swapped, so a conflict leaves no entry behind
+                previous = "balance" if previous_balance is None else str(int(previous_balance))
+                cur.execute(f''' INSERT INTO card_history(card_id, created_at, amount, reason, counterparty)
+                        SELECT id, ?, ? - {previous}, ?, ? FROM card
+                        WHERE id = ? AND version = ? AND closed_at IS NULL AND {previous} != ? ''',
+                            (int(time.time()), int(changes["balance"]), reason, counterparty, card_id, version,
+                             int(changes["balance"])))
+            cur.execute(f"UPDATE card SET {''.join(f'{assignment}, ' for assignment in assignments)}version = version + 1 "
+                        "WHERE id = ? AND version = ? AND closed_at IS NULL", (*values, card_id, version))
+            if cur.rowcount != 1:
+                raise CardVersionConflict(card_id, version)
+        return version + 1
+
     def get_delete_card_sql(self):
         """Return the default SQL to delete a card from the card table by card id."""
         return 'DELETE FROM card WHERE id=?'
@@ -230,6 +863,186 @@ class Database:
         cur.execute(delete_card_sql, (card_id,))
         self.connection.commit()
 
+    def get_close_card_sql(self):
+        """Return the default SQL to close (tombstone) a card by card id."""
+        return 'UPDATE card SET closed_at=? WHERE id=? AND closed_at IS NULL'
+
+    def close_card_record(self, card_id, close_card_sql=""):
+        """Close a card: keep the record (and its history) but hide it from every lookup.
+
+        The standing orders sent by the card are deactivated as well.
+
+        Arguments:
+            card_id -- the card record id
+            close_card_sql -- an update table statement
+        """
+        if close_card_sql == "":
+            close_card_sql = self.get_close_card_sql()
+        with self.connection:
+            cur = self.connection.cursor()
+            self.fold_balance_shards(cur, card_id, 0)
+            cur.execute(close_card_sql, (int(time.time()), card_id))
+            cur.execute("UPDATE schedule SET active = 0 WHERE card_id=?", (card_id,))
+
+    def fold_balance_shards(self, cur, card_id, shards):
+        """Move the balance shards of a card back into its row, then give it `shards` empty shards.
+
+        Arguments:
+            cur -- the cursor of the calling transaction
+            card_id -- the card id
+            shards -- the new number of shards (0 makes it a regular card again)
+
+        Returns:
+            If the open card was found
+        """
+        cur.execute(''' UPDATE card SET version = version + 1, balance_shards = ?,
+                balance = balance + (SELECT IFNULL(SUM(balance), 0) FROM card_balance_shard WHERE card_id = card.id)
+                WHERE id = ? AND closed_at IS NULL ''', (shards, card_id))
+        found = cur.rowcount == 1
+        cur.execute("DELETE FROM card_balance_shard WHERE card_id = ?", (card_id,))
+        if found and shards:
+            cur.executemany("INSERT INTO card_balance_shard(card_id, slot) VALUES(?,?)",
+                            [(card_id, slot) for slot in range(shards)])
+        return found
+
+    def set_card_balance_shards(self, card_id, shards):
+        """Mark a card as hot, splitting its future credits over `shards` balance shards (0 makes it regular again).
+
+        Arguments:
+            card_id -- the card id
+            shards -- the number of shards, at most HOT_CARD_MAX_SHARDS
+
+        Returns:
+            If the open card was found
+        """
+        with self.connection:
+            return self.fold_balance_shards(self.connection.cursor(), card_id, min(shards, constants.HOT_CARD_MAX_SHARDS))
+
+    def credit_balance_shard(self, cur, card_id, amount):
+        """Add an amount to a random balance shard of an open hot card.
+
+        The card row is not written at all, so credits never conflict with the card version.
+
+        Arguments:
+            cur -- the cursor of the calling transaction
+            card_id -- the card id
+            amount -- the amount
+
+        Returns:
+            False without changing anything if the card is not an open hot card, True otherwise
+        """
+        # for a regular card the slot is NULL (x % 0), so no shard matches
+        cur.execute(''' UPDATE card_balance_shard SET balance = balance + ?
+                WHERE card_id = ? AND slot = ? % (SELECT balance_shards FROM card WHERE id = ? AND closed_at IS NULL) ''',
+                    (amount, card_id, random.randrange(constants.HOT_CARD_MAX_SHARDS), card_id))
+        return cur.rowcount == 1
+
+    def credit_card(self, cur, card_id, amount):
+        """Add an amount to an open card, in a balance shard if the card is hot (see credit_balance_shard).
+
+        Arguments:
+            cur -- the cursor of the calling transaction
+            card_id -- the card id
+            amount -- the amount
+
+        Returns:
+            If the open card was found
+        """
+        if self.credit_balance_shard(cur, card_id, amount):
+            return True
+        cur.execute("UPDATE card SET version = version + 1, balance = balance + ? WHERE id = ? AND closed_at IS NULL",
+                    (amount, card_id))
+        return cur.rowcount == 1
+
+    def credit_cards(self, cur, credits):
+        """Add amounts to open cards: one executemany for the regular cards, a balance shard credit per hot card.
+
+        Arguments:
+            cur -- the cursor of the calling transaction
+            credits -- a list of (amount, card id) pairs
+
+        Returns:
+            The number of credits applied; lower than len(credits) if some card was not found
+        """
+        card_ids = list({card_id for amount, card_id in credits})
+        hot = set()
+        for start in range(0, len(card_ids), constants.SQL_MAX_VARIABLES):
+            chunk = card_ids[start:start + constants.SQL_MAX_VARIABLES]
+            cur.execute(f"SELECT id FROM card WHERE id IN ({','.join('?' * len(chunk))}) AND balance_shards > 0", chunk)
+            hot.update(row[0] for row in cur.fetchall())
+        applied = sum(self.credit_balance_shard(cur, card_id, amount) for amount, card_id in credits if card_id in hot)
+        regular = [(amount, card_id) for amount, card_id in credits if card_id not in hot]
+        if regular:
+            cur.executemany("UPDATE card SET version = version + 1, balance = balance + ? WHERE id = ? AND closed_at IS NULL",
+                            regular)
+            applied += cur.rowcount
+        return applied
+
+    def credit_hot_card(self, card_id, amount, reason=constants.HISTORY_UPDATE, counterparty=None):
+        """Add an amount to a hot card, in a random balance shard, with its card history entry.
+
+        Arguments:
+            card_id -- the card id
+            amount -- the amount
+
+        Keyword arguments:
+            reason -- the card history reason
+            counterparty -- the other card number of a transfer, if any
+
+        Returns:
+            False without changing anything if the card is not an open hot card, True otherwise
+        """
+        with self.connection:
+            cur = self.connection.cursor()
+            if not self.credit_balance_shard(cur, card_id, int(amount)):
+                return False
+            cur.execute(self.get_insert_card_history_sql(), (card_id, int(time.time()), int(amount), reason, counterparty))
+        return True
+
+    def archive_closed_cards(self, closed_before, batch_size=constants.ARCHIVE_BATCH_SIZE):
+        """Move one batch of cards closed before the given time to the card archive table.
+
+        The card with the highest id is never archived, so its id can't be handed out again.
+
+        Arguments:
+            closed_before -- a UNIX timestamp
+
+        Keyword arguments:
+            batch_size -- the maximum number of cards moved
+
+        Returns:
+            The number of archived cards
+        """
+        with self.connection:
+            cur = self.connection.cursor()
+            cur.execute(''' SELECT id FROM card
+                    WHERE closed_at IS NOT NULL AND closed_at < ? AND id < (SELECT MAX(id) FROM card)
+                    ORDER BY closed_at
+                    LIMIT ? ''', (closed_before, min(batch_size, constants.SQL_MAX_VARIABLES)))
+            ids = [row[0] for row in cur.fetchall()]
+            if ids:
+                placeholders = ','.join('?' * len(ids))
+                cur.execute(f''' INSERT INTO card_archive(id, number, pin, balance, closed_at, archived_at)
+                        SELECT id, {self.get_number_sql()}, {self.get_pin_sql()}, balance, closed_at, ? FROM card
+                        WHERE id IN ({placeholders}) ''',
+                            (int(time.time()), *ids))
+                cur.execute(f"DELETE FROM card WHERE id IN ({placeholders})", ids)
+        return len(ids)
+
+    def incremental_vacuum(self, pages=constants.VACUUM_PAGES_PER_STEP):
+        """Release at most the given number of free pages back to the file system.
+
+        Keyword arguments:
+            pages -- the maximum number of pages released
+
+        Returns:
+            The number of free pages left in the database file (0 without incremental auto vacuum)
+        """
+        if self.connection.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+            return 0
+        self.connection.execute(f"PRAGMA incremental_vacuum({int(pages)})").fetchall()
+        return self.connection.execute("PRAGMA freelist_count").fetchone()[0]
+
     def get_card_data_by_number(self, number):
         """Return the card data based on the given card number.
 
@@ -240,7 +1053,8 @@ class Database:
             The card data if number found, or None
         """
         cur = self.connection.cursor()
-        cur.execute("SELECT * FROM card WHERE number=?", (number,))
+        cur.execute(f''' SELECT id, {self.get_number_sql()}, {self.get_pin_sql()}, {self.get_total_balance_sql()}, version
+                FROM card WHERE number=? AND closed_at IS NULL ''', (number,))
         return cur.fetchone()
 
     def get_card_data_by_id(self, card_id):
@@ -253,5 +1067,537 @@ class Database:
             The card data if the id exists, or None
         """
         cur = self.connection.cursor()
-        cur.execute("SELECT * FROM card WHERE id=?", (card_id,))
-        return cur.fetchone()
\ No newline at end of file
+        cur.execute(f''' SELECT id, {self.get_number_sql()}, {self.get_pin_sql()}, {self.get_total_balance_sql()}, version
+                FROM card WHERE id=? AND closed_at IS NULL ''', (card_id,))
+        return cur.fetchone()
+
+    def get_list_cards_sql(self, iin_prefix=None, min_balance=None, max_balance=None, closed=None):
+        """Return the SQL to read one keyset page of cards, ordered by id.
+
+        Keyword arguments:
+            iin_prefix -- only cards whose number starts with this prefix
+            min_balance -- only cards with at least this balance
+            max_balance -- only cards with at most this balance
+            closed -- only closed cards if True, only open cards if False
+        """
+        conditions = ["id > ?"]
+        if closed is not None:
+            conditions.append("closed_at IS NOT NULL" if closed else "closed_at IS NULL")
+        if iin_prefix is not None:
+            conditions.append("number LIKE ? || '%'")
+        if min_balance is not None:
+            conditions.append(f"{self.get_total_balance_sql()} >= ?")
+        if max_balance is not None:
+            conditions.append(f"{self.get_total_balance_sql()} <= ?")
+        return f''' SELECT id, {self.get_number_sql()}, {self.get_pin_sql()}, {self.get_total_balance_sql()} FROM card
+                WHERE {' AND '.join(conditions)}
+                ORDER BY id
+                LIMIT ? '''
+
+    def iter_cards(self, iin_prefix=None, min_balance=None, max_balance=None, closed=None,
+                   chunk_size=constants.LIST_CHUNK_SIZE, page_size=constants.LIST_PAGE_SIZE):
+        """Stream the card data (id, number, pin, balance) matching the given filters.
+
+        Pages are read with keyset pagination on `id`, so every page is an index seek
+        no matter how deep into the table it starts, and each page query is finished
+        before the next one starts (no read transaction stays open for the whole scan).
+        Rows are pulled from the cursor with `fetchmany`, so at most `chunk_size` rows
+        are held in memory at once.
+
+        Keyword arguments:
+            iin_prefix -- only cards whose number starts with this prefix
+            min_balance -- only cards with at least this balance
+            max_balance -- only cards with at most this balance
+            closed -- only closed cards if True, only open cards if False
+            chunk_size -- the number of rows fetched from the cursor at once
+            page_size -- the number of rows read by a single keyset query
+        """
+        list_cards_sql = self.get_list_cards_sql(iin_prefix, min_balance, max_balance, closed)
+        filters = [value for value in (iin_prefix, min_balance, max_balance) if value is not None]
+        last_id = 0
+        while True:
+            cur = self.connection.cursor()
+            cur.execute(list_cards_sql, (last_id, *filters, page_size))
+            page_rows = 0
+            rows = cur.fetchmany(chunk_size)
+            while rows:
+                for row in rows:
+                    yield row
+                page_rows += len(rows)
+                last_id = rows[-1][0]
+                rows = cur.fetchmany(chunk_size)
+            cur.close()
+            if page_rows < page_size:
+                return
+
+    def search_cards(self, suffix, prefix=None, closed=None, limit=constants.SEARCH_LIMIT):
+        """Find cards by the last digits of their number, and optionally its first digits.
+
+        The last SEARCH_SUFFIX_DIGITS digits are an equality search on the card_number_suffix
+        expression index, which also holds the number: the prefix and the rest of a longer
+        suffix are checked in the index, and only the matching cards are read. The index
+        only changes with the card number, so balance updates don't maintain it.
+
+        Arguments:
+            suffix -- the last digits of the card number, at least SEARCH_SUFFIX_DIGITS of them
+
+        Keyword arguments:
+            prefix -- the first digits of the card number, e.g. the MII and IIN
+            closed -- only closed cards if True, only open cards if False
+            limit -- the maximum number of cards returned
+
+        Returns:
+            A list of (id, number, balance, closed at) tuples, ordered by number
+        """
+        last_digits = suffix[-constants.SEARCH_SUFFIX_DIGITS:]
+        conditions = [f"{self.get_number_suffix_sql()} = ?"]
+        values = [int(last_digits) if self.layout == "compact" else last_digits]
+        if len(suffix) > constants.SEARCH_SUFFIX_DIGITS:
+            conditions.append(f"{self.get_number_sql()} LIKE '%' || ?")
+            values.append(suffix)
+        if prefix:
+            conditions.append(f"{self.get_number_sql()} LIKE ? || '%'")
+            values.append(prefix)
+        if closed is not None:
+            conditions.append("closed_at IS NOT NULL" if closed else "closed_at IS NULL")
+        cur = self.connection.cursor()
+        cur.execute(f''' SELECT id, {self.get_number_sql()}, {self.get_total_balance_sql()}, closed_at FROM card
+                WHERE {' AND '.join(conditions)}
+                ORDER BY number
+                LIMIT ? ''', (*values, max(1, min(limit, constants.SEARCH_MAX_LIMIT))))
+        return cur.fetchall()
+
+    def get_card_ids_by_numbers(self, numbers):
+        """Return the ids of the cards with the given numbers, looked up with set-based queries.
+
+        Arguments:
+            numbers -- an iterable of card numbers
+
+        Returns:
+            A dict mapping each existing card number to its card id
+        """
+        numbers = list(set(numbers))
+        found = {}
+        cur = self.connection.cursor()
+        for start in range(0, len(numbers), constants.SQL_MAX_VARIABLES):
+            chunk = numbers[start:start + constants.SQL_MAX_VARIABLES]
+            placeholders = ','.join('?' * len(chunk))
+            cur.execute(f"SELECT {self.get_number_sql()}, id FROM card WHERE number IN ({placeholders}) AND closed_at IS NULL",
+                        chunk)
+            found.update(cur.fetchall())
+        return found
+
+    def get_card_balances(self, card_ids):
+        """Return the balances of the open cards with the given ids, looked up with set-based queries.
+
+        Arguments:
+            card_ids -- an iterable of card ids
+
+        Returns:
+            A dict mapping each open card id to its balance
+        """
+        card_ids = list(set(card_ids))
+        found = {}
+        cur = self.connection.cursor()
+        for start in range(0, len(card_ids), constants.SQL_MAX_VARIABLES):
+            chunk = card_ids[start:start + constants.SQL_MAX_VARIABLES]
+            placeholders = ','.join('?' * len(chunk))
+            cur.execute(f"SELECT id, {self.get_total_balance_sql()} FROM card WHERE id IN ({placeholders}) AND closed_at IS NULL",
+                        chunk)
+            found.update(cur.fetchall())
+        return found
+
+    def apply_net_transfers(self, deltas, entries):
+        """Apply netted transfers: one balance update per card and one history entry per transfer leg, in one transaction.
+
+        Every debit is guarded against overdrafts, so if a balance dropped (or a card was
+        closed) since the net positions were checked, nothing is applied.
+
+        Arguments:
+            deltas -- a dict mapping card ids to their net balance change
+            entries -- a list of (card id, amount, counterparty number) history entries
+
+        Returns:
+            True if everything was applied, False if nothing was
+        """
+        changes = [(delta, card_id, delta, delta) for card_id, delta in deltas.items() if delta != 0]
+        now = int(time.time())
+        with self.connection:
+            cur = self.connection.cursor()
+            cur.executemany(f''' UPDATE card SET version = version + 1, balance = balance + ?
+                    WHERE id = ? AND closed_at IS NULL AND (? >= 0 OR {self.get_total_balance_sql()} + ? >= 0) ''', changes)
+            if cur.rowcount != len(changes):
+                self.connection.rollback()
+                return False
+            cur.executemany(self.get_insert_card_history_sql(),
+                            [(card_id, now, amount, constants.HISTORY_TRANSFER, counterparty)
+                             for card_id, amount, counterparty in entries])
+        return True
+
+    def get_idempotent_result(self, card_id, key):
+        """Return the stored result of an operation sent with the given idempotency key.
+
+        Arguments:
+            card_id -- the card id that sent the operation
+            key -- the idempotency key
+
+        Returns:
+            The original result if the key was used within the retention window, or None
+        """
+        cur = self.connection.cursor()
+        cur.execute("SELECT result FROM idempotency_key WHERE card_id=? AND key=? AND created_at>=?",
+                    (card_id, key, int(time.time()) - constants.IDEMPOTENCY_RETENTION_SECONDS))
+        row = cur.fetchone()
+        return json.loads(row[0]) if row else None
+
+    def save_idempotent_result(self, cur, card_id, key, result):
+        """Store the result of an operation under its idempotency key, inside the operation transaction.
+
+        An expired key is reused; a live key means a concurrent replay already stored
+        its result, so IntegrityError is raised to roll the operation back.
+
+        Arguments:
+            cur -- the cursor of the operation transaction
+            card_id -- the card id that sent the operation
+            key -- the idempotency key
+            result -- the JSON serializable operation result
+        """
+        now = int(time.time())
+        cur.execute(''' INSERT INTO idempotency_key(card_id, key, created_at, result)
+                VALUES(?,?,?,?)
+                ON CONFLICT(card_id, key) DO UPDATE
+                    SET created_at = excluded.created_at, result = excluded.result
+                    WHERE idempotency_key.created_at < ? ''',
+                    (card_id, key, now, json.dumps(result), now - constants.IDEMPOTENCY_RETENTION_SECONDS))
+        if cur.rowcount == 0:
+            raise sqlite3.IntegrityError(f"idempotency key `{key}` is already in use")
+        self.idempotent_saves += 1
+
+    def run_idempotent(self, card_id, key, operation):
+        """Run an operation at most once per idempotency key and return its result.
+
+        Arguments:
+            card_id -- the card id that sent the operation
+            key -- the idempotency key, or None to always run the operation
+            operation -- a callable taking a cursor, applying its changes and returning the result
+        """
+        if key is not None:
+            replayed = self.get_idempotent_result(card_id, key)
+            if replayed is not None:
+                return replayed
+        try:
+            # the write lock is taken first, so what the operation reads can't change before it writes
+            self.connection.execute("BEGIN IMMEDIATE")
+            with self.connection:
+                cur = self.connection.cursor()
+                result = operation(cur)
+                if key is not None:
+                    self.save_idempotent_result(cur, card_id, key, result)
+        except sqlite3.IntegrityError:
+            replayed = self.get_idempotent_result(card_id, key) if key is not None else None
+            if replayed is None:
+                raise
+            return replayed
+        if key is not None and self.idempotent_saves % constants.IDEMPOTENCY_PRUNE_EVERY == 0:
+            self.prune_idempotency_keys(max_batches=1)
+        return result
+
+    def prune_idempotency_keys(self, batch_size=constants.IDEMPOTENCY_PRUNE_BATCH_SIZE,
+                               max_batches=constants.IDEMPOTENCY_PRUNE_MAX_BATCHES):
+        """Delete expired idempotency keys in bounded batches, committing after each one.
+
+        Keyword arguments:
+            batch_size -- the maximum number of keys deleted per batch
+            max_batches -- the maximum number of batches run by this call
+
+        Returns:
+            The number of deleted keys
+        """
+        cutoff = int(time.time()) - constants.IDEMPOTENCY_RETENTION_SECONDS
+        deleted = 0
+        cur = self.connection.cursor()
+        for _ in range(max_batches):
+            cur.execute(''' DELETE FROM idempotency_key
+                    WHERE (card_id, key) IN (
+                        SELECT card_id, key FROM idempotency_key WHERE created_at < ? LIMIT ?
+                    ) ''', (cutoff, batch_size))
+            self.connection.commit()
+            deleted += cur.rowcount
+            if cur.rowcount < batch_size:
+                break
+        return deleted
+
+    def add_income(self, card_id, amount, idempotency_key=None):
+        """Add income to a card.
+
+        Arguments:
+            card_id -- the card id
+            amount -- the income amount
+
+        Keyword arguments:
+            idempotency_key -- a client chosen key; replaying it returns the original result
+
+        Returns:
+            The result message
+        """
+        def apply(cur):
+            if not str(amount).isdigit():
+                return constants.POSITIVE_INTEGER_FAIL
+            balance = self.get_card_balances([card_id]).get(card_id)
+            if balance is None or int(amount) > constants.MAX_BALANCE - balance:
+                return constants.CARD_ADD_INCOME_FAIL
+            if not self.credit_card(cur, card_id, int(amount)):
+                return constants.CARD_ADD_INCOME_FAIL
+            cur.execute(self.get_insert_card_history_sql(),
+                        (card_id, int(time.time()), int(amount), constants.HISTORY_INCOME, None))
+            return constants.CARD_ADD_INCOME_SUCCESS
+
+        return self.run_idempotent(card_id, idempotency_key, apply)
+
+    def do_batch_transfer(self, card_id, legs, idempotency_key=None):
+        """Transfer money from one card to many receivers in a single transaction.
+
+        Every leg is validated first (amount, Luhn check, own card), all receivers are
+        looked up at once and the total is checked against the sender balance once.
+        The debit and all credits are then applied together, so either every valid leg
+        is paid or none is.
+
+        Arguments:
+            card_id -- the sender card id
+            legs -- a list of (receiver card number, amount) pairs
+
+        Keyword arguments:
+            idempotency_key -- a client chosen key; replaying it returns the original result
+
+        Returns:
+            A list with one (receiver card number, amount, result message) tuple per leg
+        """
+        def apply(cur):
+            return self.apply_batch_transfer(cur, card_id, legs)
+
+        return [tuple(leg) for leg in self.run_idempotent(card_id, idempotency_key, apply)]
+
+    def apply_batch_transfer(self, cur, card_id, legs):
+        """Validate and apply the legs of a batch transfer (see do_batch_transfer).
+
+        Arguments:
+            cur -- the cursor of the transfer transaction
+            card_id -- the sender card id
+            legs -- a list of (receiver card number, amount) pairs
+        """
+        sender = self.get_card_data_by_id(card_id)
+        if not sender:
+            return [(number, amount, constants.CARD_TRANSFER_NUMBER_NONEXISTENT) for number, amount in legs]
+
+        results, credits = check_batch_legs(sender[1], legs, self.get_card_ids_by_numbers)
+        total = sum(amount for index, amount, receiver_id in credits)
+        outcome = constants.CARD_TRANSFER_AMOUNT_FAIL
+        closed = set()
+        if credits and total <= int(sender[3]):
+            cur.execute("SAVEPOINT batch_transfer")
+            # the balance guard keeps the debit safe if the balance changed since it was read
+            cur.execute(f"UPDATE card SET version = version + 1, balance = balance - ? WHERE id = ? AND {self.get_total_balance_sql()} >= ? AND closed_at IS NULL",
+                        (total, card_id, total))
+            debited = cur.rowcount == 1
+            if debited and self.credit_cards(cur, [(amount, receiver_id) for index, amount, receiver_id in credits]) == len(credits):
+                now = int(time.time())
+                entries = []
+                for index, amount, receiver_id in credits:
+                    entries.append((card_id, now, -amount, constants.HISTORY_TRANSFER, str(legs[index][0])))
+                    entries.append((receiver_id, now, amount, constants.HISTORY_TRANSFER, sender[1]))
+                cur.executemany(self.get_insert_card_history_sql(), entries)
+                outcome = constants.CARD_TRANSFER_AMOUNT_SUCCESS
+            elif debited:
+                # a receiver was closed since it was looked up: the debit is undone and nobody is paid
+                cur.execute("ROLLBACK TO batch_transfer")
+                receiver_ids = {receiver_id for index, amount, receiver_id in credits}
+                closed = receiver_ids - set(self.get_card_balances(receiver_ids))
+            cur.execute("RELEASE batch_transfer")
+        for index, amount, receiver_id in credits:
+            results[index] = constants.CARD_TRANSFER_NUMBER_NONEXISTENT if receiver_id in closed else outcome
+
+        return [(number, amount, results[index]) for index, (number, amount) in enumerate(legs)]
+
+    def create_schedule_record(self, data):
+        """Create a standing order record.
+
+        Arguments:
+            data -- the standing order data (card id, receiver number, amount, interval seconds, next run at)
+
+        Returns:
+            The standing order id
+        """
+        cur = self.connection.cursor()
+        cur.execute(''' INSERT INTO schedule(card_id,receiver,amount,interval_seconds,next_run_at)
+                VALUES(?,?,?,?,?) ''', data)
+        self.connection.commit()
+        return cur.lastrowid
+
+    def get_schedules_due_before(self, until):
+        """Return the active standing orders due before the given time, using the next run index.
+
+        Arguments:
+            until -- a UNIX timestamp
+
+        Returns:
+            A list of (next run at, id, card id, receiver number, amount, interval seconds) tuples
+        """
+        cur = self.connection.cursor()
+        cur.execute(''' SELECT next_run_at, id, card_id, receiver, amount, interval_seconds FROM schedule
+                WHERE active = 1 AND next_run_at < ?
+                ORDER BY next_run_at ''', (until,))
+        return cur.fetchall()
+
+    def do_scheduled_transfer(self, card_id, orders):
+        """Pay the due runs of the standing orders of one card, each run as a transfer of its own.
+
+        Every run is paid within its own savepoint (see apply_batch_transfer), so a run the
+        card can't afford doesn't fail the others; see pay_scheduled_runs for the runs left
+        due. The new next run times are written in the same transaction as the transfers,
+        so a crash can neither skip a run nor pay it twice.
+
+        Arguments:
+            card_id -- the sender card id
+            orders -- a list of (standing order id, receiver card number, amount, due run times, next run at) tuples
+
+        Returns:
+            A (results, next runs) tuple: one (standing order id, receiver card number, amount,
+            result message) tuple per attempted run and the stored (next run at, standing order id) pairs
+        """
+        def apply(cur):
+            results, next_runs = pay_scheduled_runs(
+                orders, lambda receiver, amount: self.apply_batch_transfer(cur, card_id, [(receiver, amount)])[0][2])
+            cur.executemany("UPDATE schedule SET next_run_at = ? WHERE id = ?", next_runs)
+            return results, next_runs
+
+        return self.run_idempotent(card_id, None, apply)
+
+    def get_card_history(self, card_id, before=None, limit=constants.HISTORY_PAGE_SIZE):
+        """Return a page of the history of a card, newest entries first.
+
+        Pages are read with keyset pagination on the covering (card id, created at, id) index:
+        the next page starts right after the last entry of the previous one, so every page
+        costs the same however deep it is.
+
+        Arguments:
+            card_id -- the card id
+
+        Keyword arguments:
+            before -- the (created at, id) of the last entry of the previous page, or None for the first page
+            limit -- the maximum number of entries
+
+        Returns:
+            A list of (id, created at, amount, reason, counterparty) entries
+        """
+        where, values = "card_id = ?", [card_id]
+        if before is not None:
+            where += " AND (created_at, id) < (?, ?)"
+            values += [int(before[0]), int(before[1])]
+        cur = self.connection.cursor()
+        cur.execute(f''' SELECT id, created_at, amount, reason, counterparty FROM card_history
+                WHERE {where} ORDER BY created_at DESC, id DESC LIMIT ? ''', (*values, limit))
+        return cur.fetchall()
+
+    def get_max_card_id(self):
+        """Return the highest card id, or 0 if there are no cards."""
+        return self.connection.execute("SELECT IFNULL(MAX(id), 0) FROM card").fetchone()[0]
+
+    def get_batch_job(self, job_id):
+        """Return the (last processed card id, last card id, finished at) progress of a batch job.
+
+        A new job covers the cards existing when it is first requested.
+
+        Arguments:
+            job_id -- the batch job id
+        """
+        with self.connection:
+            self.connection.execute(''' INSERT OR IGNORE INTO batch_job(job_id, max_id)
+                    VALUES(?, (SELECT IFNULL(MAX(id), 0) FROM card)) ''', (job_id,))
+        cur = self.connection.cursor()
+        cur.execute("SELECT last_id, max_id, finished_at FROM batch_job WHERE job_id=?", (job_id,))
+        return cur.fetchone()
+
+    def find_batch_job(self, job_id):
+        """Return the (last processed card id, last card id, finished at) progress of a batch job, or None if it never ran."""
+        cur = self.connection.cursor()
+        cur.execute("SELECT last_id, max_id, finished_at FROM batch_job WHERE job_id=?", (job_id,))
+        return cur.fetchone()
+
+    def finish_batch_job(self, job_id):
+        """Mark a batch job as finished."""
+        with self.connection:
+            self.connection.execute("UPDATE batch_job SET finished_at=? WHERE job_id=?", (int(time.time()), job_id))
+
+    def backfill_cards(self, job_id, backfill_sql, start_id, end_id):
+        """Run a backfill statement on the card ids in [start_id, end_id] and store the job progress, as one transaction.
+
+        Arguments:
+            job_id -- the batch job id of the backfill
+            backfill_sql -- a statement using the :start, :end and :now parameters
+            start_id -- the first card id of the chunk
+            end_id -- the last card id of the chunk
+
+        Returns:
+            The number of rows the statement changed
+        """
+        values = {"start": start_id, "end": end_id, "now": int(time.time()), "job": job_id}
+        with self.connection:
+            cur = self.connection.cursor()
+            cur.execute(backfill_sql, values)
+            changed = cur.rowcount
+            cur.execute("UPDATE batch_job SET last_id = :end WHERE job_id = :job", values)
+        return changed
+
+    def time_backfill_cards(self, backfill_sql, start_id, end_id, prepare=None):
+        """Return how many seconds a backfill statement takes on the card ids in [start_id, end_id], rolling it back.
+
+        Keyword arguments:
+            prepare -- a callable taking a cursor, run first in the same (rolled back) transaction
+        """
+        try:
+            self.connection.execute("BEGIN")
+            if prepare is not None:
+                prepare(self.connection.cursor())
+            started = time.perf_counter()
+            self.connection.execute(backfill_sql, {"start": start_id, "end": end_id, "now": int(time.time())})
+            return time.perf_counter() - started
+        finally:
+            self.connection.rollback()
+
+    def adjust_balances(self, job_id, start_id, end_id, rate_bp, fee):
+        """Apply interest and a fee to the open cards with ids in [start_id, end_id], as one transaction.
+
+        The interest is `rate_bp` basis points of the balance (rounded down) and the fee never
+        takes a balance below 0. Every change is written to the ledger and the job progress
+        moves to `end_id` in the same transaction, so a resumed job never applies a chunk twice.
+
+        Arguments:
+            job_id -- the batch job id, also used as the ledger reason
+            start_id -- the first card id of the chunk
+            end_id -- the last card id of the chunk
+            rate_bp -- the interest rate in basis points (1/100 of a percent)
+            fee -- the flat fee
+
+        Returns:
+            A (changed cards, sum of the changes) tuple
+        """
+        delta = "(balance * :rate / 10000 - MIN(:fee, balance + balance * :rate / 10000))"
+        chunk = "id BETWEEN :start AND :end AND closed_at IS NULL"
+        values = {"rate": rate_bp, "fee": fee, "start": start_id, "end": end_id, "job": job_id,
+                  "now": int(time.time())}
+        with self.connection:
+            cur = self.connection.cursor()
+            # interest is computed on the whole balance of hot cards
+            for (hot_card_id, shards) in cur.execute(f"SELECT id, balance_shards FROM card WHERE {chunk} AND balance_shards > 0",
+                                                     values).fetchall():
+                self.fold_balance_shards(cur, hot_card_id, shards)
+            cur.execute(f"SELECT COUNT(*), IFNULL(SUM({delta}), 0) FROM card WHERE {chunk} AND {delta} != 0", values)
+            changed = cur.fetchone()
+            cur.execute(f''' INSERT INTO ledger(card_id, amount, reason, created_at)
+                    SELECT id, {delta}, :job, :now FROM card WHERE {chunk} AND {delta} != 0 ''', values)
+            cur.execute(f''' INSERT INTO card_history(card_id, created_at, amount, reason)
+                    SELECT id, :now, {delta}, :job FROM card WHERE {chunk} AND {delta} != 0 ''', values)
+            cur.execute(f"UPDATE card SET version = version + 1, balance = balance + {delta} WHERE {chunk} AND {delta} != 0",
+                        values)
+            cur.execute("UPDATE batch_job SET last_id = :end WHERE job_id = :job", values)
+        return changed
@@ -0,0 +1,60 @@
+import time
+import constants
+
+
+class BalanceAdjustmentJob:
+    """Apply monthly interest and fees to every open card, chunk by chunk.
+
+    Each chunk of `chunk_size` card ids is one short transaction of set-based statements
+    (see Database.adjust_balances), so the writer lock is only held briefly. The last
+    finished chunk is stored with the job id: running the same job again resumes after it,
+    and a finished job is never applied twice.
+
+    Arguments:
+        db -- the connected database
+        job_id -- the job id, e.g. `interest-2026-10`; it is also the ledger reason
+
+    Keyword arguments:
+        rate_bp -- the interest rate in basis points (1/100 of a percent)
+        fee -- the flat fee charged to every card
+        chunk_size -- the number of card ids per transaction
+        time_budget -- the number of seconds after which the job stops (to be resumed later)
+        pause -- the pause (in seconds) between two chunks, leaving room to other writers
+    """
+    def __init__(self, db, job_id, rate_bp=0, fee=0, chunk_size=constants.ADJUSTMENT_CHUNK_SIZE,
+                 time_budget=constants.ADJUSTMENT_TIME_BUDGET_SECONDS, pause=constants.ADJUSTMENT_PAUSE_SECONDS):
+        self.db = db
+        self.job_id = job_id
+        self.rate_bp = rate_bp
+        self.fee = fee
+        self.chunk_size = chunk_size
+        self.time_budget = time_budget
+        self.pause = pause
+
+    def run(self, report=None):
+        """Run the job until it is finished or out of time.
+
+        Keyword arguments:
+            report -- called with (last card id, max card id, changed cards, sum of changes) after every chunk
+
+        Returns:
+            A (finished, changed cards, sum of changes) tuple for this run
+        """
+        last_id, max_id, finished_at = self.db.get_batch_job(self.job_id)
+        if finished_at is not None:
+            return True, 0, 0
+        deadline = time.monotonic() + self.time_budget
+        changed = total = 0
+        while last_id < max_id:
+            end_id = min(last_id + self.chunk_size, max_id)
+            count, amount = self.db.adjust_balances(self.job_id, last_id + 1, end_id, self.rate_bp, self.fee)
+            changed += count
+            total += amount
+            last_id = end_id
+            if report:
+                report(last_id, max_id, count, amount)
+            if time.monotonic() >= deadline:
+                return False, changed, total
+            time.sleep(self.pause)
+        self.db.finish_batch_job(self.job_id)
+        return True, changed, total
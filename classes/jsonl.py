@@ -0,0 +1,238 @@
+import json
+import math
+import codecs
+import sqlite3
+import time
+import constants
+from classes.card import Card
+from classes.metrics import get_outcome
+
+
+class JsonLinesServer:
+    """Serve the banking operations as a JSON lines protocol: one command object per input line,
+    one result object per output line, in the same order.
+
+    Every command but `create` carries the card `number` and `pin`, checked with the same
+    login throttle as the interactive menu; `income` and `transfer` go through the velocity
+    limits (checked before any SQL, counted once logged in) and the storage engine operations (with an optional idempotency `key`).
+    A command may carry a `ref`, echoed in its result, and a `session` used for throttling.
+
+        {"op": "create"}
+        {"op": "balance", "number": "4000...", "pin": "1234"}
+        {"op": "income", "number": "4000...", "pin": "1234", "amount": 100, "key": "pay-1"}
+        {"op": "transfer", "number": "4000...", "pin": "1234", "to": "4000...", "amount": 50}
+        {"op": "close", "number": "4000...", "pin": "1234"}
+        {"op": "history", "number": "4000...", "pin": "1234", "before": [1760000000, 42], "limit": 100}
+
+    Results are {"ok": true, ...} or {"ok": false, "error": "..."}. The input is read in
+    chunks of whatever was sent, and the results of a chunk are written at once (or every
+    `flush_lines` results), so a client pipelining many commands gets a few large writes. With
+    `metrics`, every command is timed and counted under the operation names of the menu.
+
+    Arguments:
+        db -- the connected storage engine
+        velocity -- the VelocityLimiter of the income and transfer commands, or None for no limits
+        throttle -- the LoginThrottle shared with the interactive menu
+
+    Keyword arguments:
+        flush_lines -- the maximum number of buffered results
+        metrics -- the Metrics recording the commands, if any
+    """
+    # metrics operation names of the commands
+    OPERATIONS = {"create": "create_card", "balance": "balance", "income": "add_income", "transfer": "do_transfer",
+                  "close": "close_card", "history": "history"}
+
+    def __init__(self, db, velocity, throttle, flush_lines=constants.JSONL_FLUSH_LINES, metrics=None):
+        self.db = db
+        self.velocity = velocity
+        self.throttle = throttle
+        self.flush_lines = flush_lines
+        self.metrics = metrics
+        self.operations = {
+            "create": self.create,
+            "balance": self.balance,
+            "income": self.income,
+            "transfer": self.transfer,
+            "close": self.close,
+            "history": self.history,
+        }
+
+    @staticmethod
+    def failure(message):
+        """Return a failed result with a constants message, without its blank lines."""
+        return {"ok": False, "error": message.strip()}
+
+    def login(self, command):
+        """Return the (id, number, pin, balance, version) data of the command card, or a failed result."""
+        number, session = str(command.get("number", "")), str(command.get("session", ""))
+        wait = self.throttle.get_wait(number, session)
+        if wait > 0:
+            failed = self.failure(constants.LOGIN_THROTTLED_MSG.format(math.ceil(wait)))
+            failed["retry_after"] = math.ceil(wait)
+            return None, failed
+        response = self.db.get_card_data_by_number(number)
+        if not response or response[2] != str(command.get("pin", "")):
+            self.throttle.record_failure(number, session)
+            return None, self.failure(constants.LOGIN_FAIL_MSG)
+        self.throttle.record_success(number, session)
+        return response, None
+
+    def limit(self, command):
+        """Return a failed result if the velocity limits reject a balance operation of the command card, else None.
+
+        Nothing is counted yet: a request with a wrong PIN must not use up the budget of
+        the card it names, so the operation is counted (see `count`) after the login.
+        """
+        if self.velocity is not None and not self.velocity.check(str(command.get("number", ""))):
+            return self.failure(constants.CARD_VELOCITY_LIMIT_MSG)
+        return None
+
+    def count(self, response):
+        """Count a balance operation of a logged in card in the velocity limits."""
+        if self.velocity is not None:
+            self.velocity.record(response[1])
+
+    def create(self, command):
+        issued = self.db.issue_pool_cards(1)
+        if issued:
+            return {"ok": True, "number": issued[0][1], "pin": issued[0][2]}
+        card = Card(checksum_type="luhn")
+        self.db.create_card_record(card.get_data())
+        return {"ok": True, "number": card.number, "pin": card.pin}
+
+    def balance(self, command):
+        response, failed = self.login(command)
+        return failed or {"ok": True, "balance": response[3]}
+
+    def income(self, command):
+        limited = self.limit(command)
+        if limited:
+            return limited
+        response, failed = self.login(command)
+        if failed:
+            return failed
+        self.count(response)
+        message = self.db.add_income(response[0], command.get("amount"), idempotency_key=command.get("key"))
+        if message != constants.CARD_ADD_INCOME_SUCCESS:
+            return self.failure(message)
+        return {"ok": True}
+
+    def transfer(self, command):
+        limited = self.limit(command)
+        if limited:
+            return limited
+        response, failed = self.login(command)
+        if failed:
+            return failed
+        self.count(response)
+        # a single leg batch transfer: same checks and a single transaction for both cards
+        leg = (str(command.get("to", "")), command.get("amount"))
+        [(number, amount, message)] = self.db.do_batch_transfer(response[0], [leg], idempotency_key=command.get("key"))
+        if message != constants.CARD_TRANSFER_AMOUNT_SUCCESS:
+            return self.failure(message)
+        return {"ok": True}
+
+    def close(self, command):
+        response, failed = self.login(command)
+        if failed:
+            return failed
+        self.db.close_card_record(response[0])
+        return {"ok": True}
+
+    def history(self, command):
+        response, failed = self.login(command)
+        if failed:
+            return failed
+        before = command.get("before")
+        limit = min(max(int(command.get("limit", constants.HISTORY_PAGE_SIZE)), 1), constants.HISTORY_MAX_PAGE_SIZE)
+        entries = self.db.get_card_history(response[0], before=before, limit=limit)
+        fields = ("id", "created_at", "amount", "reason", "counterparty")
+        result = {"ok": True, "entries": [dict(zip(fields, entry)) for entry in entries]}
+        # pass `next` back as `before` to get the following page
+        result["next"] = [entries[-1][1], entries[-1][0]] if len(entries) == limit else None
+        return result
+
+    def execute(self, line):
+        """Run the command on one input line and return its result object."""
+        try:
+            command = json.loads(line)
+        except ValueError as e:
+            return {"ok": False, "error": f"invalid JSON: {e}"}
+        if not isinstance(command, dict):
+            return {"ok": False, "error": "a command must be a JSON object"}
+        op = command.get("op")
+        # an unhashable op (a list or an object) can't be looked up in the operations
+        operation = self.operations.get(op) if isinstance(op, str) else None
+        started = time.perf_counter()
+        try:
+            result = operation(command) if operation else self.failure(constants.MENU_UNSUPPORTED_OPTION_MSG)
+        except (TypeError, ValueError, OverflowError) as e:
+            result = {"ok": False, "error": f"invalid command: {e}"}
+        except sqlite3.Error as e:
+            # the server keeps serving the next commands
+            result = {"ok": False, "error": f"storage error: {e}"}
+        if self.metrics is not None and operation:
+            self.record(op, result, time.perf_counter() - started)
+        if "ref" in command:
+            result["ref"] = command["ref"]
+        return result
+
+    def record(self, op, result, seconds):
+        """Record the duration and the outcome of a command in the metrics."""
+        name = self.OPERATIONS[op]
+        self.metrics.observe(name, seconds)
+        if result["ok"]:
+            outcome = "success"
+        elif "retry_after" in result:
+            outcome = "throttled"
+        else:
+            outcome = get_outcome(result["error"])
+        self.metrics.count(name, outcome)
+
+    @staticmethod
+    def read_chunks(stream):
+        """Yield the text of the stream as it arrives, one chunk per read of whatever input is available.
+
+        Text streams over a binary buffer (like sys.stdin) are read with `read1`, which returns
+        the bytes already sent instead of waiting for a full line or a full chunk.
+        """
+        raw = getattr(stream, "buffer", None)
+        if raw is not None and hasattr(raw, "read1"):
+            decoder = codecs.getincrementaldecoder(stream.encoding or "utf-8")(errors="replace")
+            for data in iter(lambda: raw.read1(constants.JSONL_READ_SIZE), b''):
+                yield decoder.decode(data)
+            yield decoder.decode(b'', final=True)
+        else:
+            yield from iter(lambda: stream.read(constants.JSONL_READ_SIZE), '')
+
+    def flush(self, buffer, output_stream):
+        """Write the buffered results at once."""
+        if buffer:
+            output_stream.write(''.join(buffer))
+            output_stream.flush()
+            buffer.clear()
+
+    def run(self, input_stream, output_stream):
+        """Serve every command line of the input stream until it ends; return the number of commands."""
+        served = 0
+        buffer = []
+        partial = ''
+        try:
+            for chunk in self.read_chunks(input_stream):
+                *lines, partial = (partial + chunk).split('\n')
+                for line in lines:
+                    if line.strip():
+                        buffer.append(json.dumps(self.execute(line)) + '\n')
+                        served += 1
+                        if len(buffer) >= self.flush_lines:
+                            self.flush(buffer, output_stream)
+                # the whole chunk is served: its results go out together
+                self.flush(buffer, output_stream)
+            if partial.strip():
+                # the last line may have no line break
+                buffer.append(json.dumps(self.execute(partial)) + '\n')
+                served += 1
+        finally:
+            # the results already buffered (e.g. a created card number and PIN) are never lost
+            self.flush(buffer, output_stream)
+        return served
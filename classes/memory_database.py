@@ -0,0 +1,318 @@
+import time
+import bisect
+import threading
+import constants
+from classes.storage import StorageBackend, CardVersionConflict, check_batch_legs, pay_scheduled_runs
+
+
+class MemoryDatabase(StorageBackend):
+    """A storage engine keeping everything in dicts, for tests, simulations and benchmarks.
+
+    Cards are indexed both by id and by number, so every lookup is a dict access.
+    Nothing is persisted: the data is gone once the process exits.
+    """
+    # card record fields, mirroring the columns of the SQLite card table
+    ID, NUMBER, PIN, BALANCE, CLOSED_AT, VERSION = range(6)
+
+    def __init__(self):
+        self.cards = {}
+        self.open_numbers = {}
+        self.archive = {}
+        self.idempotency_keys = {}
+        self.schedules = {}
+        self.number_pool = {}
+        # card id -> (created at, id, amount, reason, counterparty) entries, oldest first
+        self.history = {}
+        self.last_history_id = 0
+        self.last_card_id = 0
+        self.last_schedule_id = 0
+        self.lock = threading.RLock()
+
+    def connect(self):
+        """Nothing to open: the engine is ready once created."""
+
+    def disconnect(self):
+        """Nothing to close: the data stays until the object is dropped."""
+
+    def get_open_card(self, card_id):
+        """Return the mutable record of the open card with the given id, or None."""
+        card = self.cards.get(card_id)
+        return card if card is not None and card[self.CLOSED_AT] is None else None
+
+    def create_card_record(self, data):
+        with self.lock:
+            self.last_card_id += 1
+            number, pin, balance = data[:3]
+            self.cards[self.last_card_id] = [self.last_card_id, str(number), str(pin), int(balance or 0), None, 0]
+            self.open_numbers[str(number)] = self.last_card_id
+
+    def create_card_records(self, rows):
+        with self.lock:
+            for row in rows:
+                self.create_card_record(row)
+
+    def fill_card_number_pool(self, rows):
+        with self.lock:
+            added = 0
+            for number, pin in rows:
+                number = str(number)
+                if number not in self.number_pool and number not in self.open_numbers:
+                    self.number_pool[number] = str(pin)
+                    added += 1
+            return added
+
+    def get_card_number_pool_size(self):
+        return len(self.number_pool)
+
+    def issue_pool_cards(self, count=1):
+        with self.lock:
+            cards = []
+            # the pool dict keeps insertion order, so the oldest numbers are issued first
+            while len(cards) < count and self.number_pool:
+                number = next(iter(self.number_pool))
+                pin = self.number_pool.pop(number)
+                # dropped if an open card took the number since it was pooled
+                if number not in self.open_numbers:
+                    self.create_card_record((number, pin, 0))
+                    cards.append((self.last_card_id, number, pin, 0))
+            return cards
+
+    def update_card_record(self, data):
+        with self.lock:
+            number, pin, balance, card_id = data[:4]
+            card = self.cards.get(card_id)
+            if card is None:
+                return
+            self.move_number(card, str(number))
+            card[self.PIN] = str(pin)
+            card[self.BALANCE] = int(balance)
+            card[self.VERSION] += 1
+
+    def move_number(self, card, number):
+        """Change the number of a card, keeping the number index in sync."""
+        if card[self.CLOSED_AT] is None:
+            if self.open_numbers.get(card[self.NUMBER]) == card[self.ID]:
+                del self.open_numbers[card[self.NUMBER]]
+            self.open_numbers[number] = card[self.ID]
+        card[self.NUMBER] = number
+
+    def compare_and_swap_card_record(self, card_id, version, changes, reason=constants.HISTORY_UPDATE, counterparty=None,
+                                     previous_balance=None):
+        with self.lock:
+            card = self.get_open_card(card_id)
+            if card is None or card[self.VERSION] != version:
+                raise CardVersionConflict(card_id, version)
+            if "balance" in changes and int(changes["balance"]) != card[self.BALANCE]:
+                self.add_history(card_id, int(changes["balance"]) - card[self.BALANCE], reason, counterparty)
+            if "number" in changes:
+                self.move_number(card, str(changes["number"]))
+            if "pin" in changes:
+                card[self.PIN] = str(changes["pin"])
+            if "balance" in changes:
+                card[self.BALANCE] = int(changes["balance"])
+            card[self.VERSION] += 1
+            return card[self.VERSION]
+
+    def set_card_balance_shards(self, card_id, shards):
+        """Nothing to split: updates never contend in memory, so a card is only checked to be open."""
+        return self.get_open_card(card_id) is not None
+
+    def credit_hot_card(self, card_id, amount, reason=constants.HISTORY_UPDATE, counterparty=None):
+        return False
+
+    def add_history(self, card_id, amount, reason, counterparty=None):
+        """Record a balance change of a card in its history."""
+        self.last_history_id += 1
+        self.history.setdefault(card_id, []).append((int(time.time()), self.last_history_id, amount, reason, counterparty))
+
+    def get_card_history(self, card_id, before=None, limit=constants.HISTORY_PAGE_SIZE):
+        entries = self.history.get(card_id, [])
+        end = len(entries) if before is None else bisect.bisect_left(entries, tuple(before))
+        return [(entry_id, created_at, amount, reason, counterparty)
+                for created_at, entry_id, amount, reason, counterparty in reversed(entries[max(0, end - limit):end])]
+
+    def delete_card_record(self, card_id):
+        with self.lock:
+            card = self.cards.pop(card_id, None)
+            if card is not None and self.open_numbers.get(card[self.NUMBER]) == card_id:
+                del self.open_numbers[card[self.NUMBER]]
+
+    def close_card_record(self, card_id):
+        with self.lock:
+            card = self.get_open_card(card_id)
+            if card is None:
+                return
+            card[self.CLOSED_AT] = int(time.time())
+            if self.open_numbers.get(card[self.NUMBER]) == card_id:
+                del self.open_numbers[card[self.NUMBER]]
+            for schedule in self.schedules.values():
+                if schedule[1] == card_id:
+                    schedule[6] = 0
+
+    def archive_closed_cards(self, closed_before, batch_size=constants.ARCHIVE_BATCH_SIZE):
+        with self.lock:
+            newest = max(self.cards, default=0)
+            closed = [card for card in self.cards.values()
+                      if card[self.CLOSED_AT] is not None and card[self.CLOSED_AT] < closed_before
+                      and card[self.ID] < newest]
+            closed.sort(key=lambda card: card[self.CLOSED_AT])
+            archived_at = int(time.time())
+            for card in closed[:batch_size]:
+                del self.cards[card[self.ID]]
+                self.archive[card[self.ID]] = card[:self.VERSION] + [archived_at]
+            return min(len(closed), batch_size)
+
+    def enable_incremental_vacuum(self):
+        """Nothing to prepare: freed memory goes back to Python right away."""
+
+    def incremental_vacuum(self, pages=constants.VACUUM_PAGES_PER_STEP):
+        return 0
+
+    def get_card_data(self, card):
+        """Return the (id, number, pin, balance, version) data of a card record."""
+        return (card[self.ID], card[self.NUMBER], card[self.PIN], card[self.BALANCE], card[self.VERSION])
+
+    def get_card_data_by_number(self, number):
+        card_id = self.open_numbers.get(number)
+        return self.get_card_data(self.cards[card_id]) if card_id is not None else None
+
+    def get_card_data_by_id(self, card_id):
+        card = self.get_open_card(card_id)
+        return self.get_card_data(card) if card is not None else None
+
+    def iter_cards(self, iin_prefix=None, min_balance=None, max_balance=None, closed=None,
+                   chunk_size=constants.LIST_CHUNK_SIZE, page_size=constants.LIST_PAGE_SIZE):
+        # cards are added with increasing ids, so the dict is already in id order
+        for card in list(self.cards.values()):
+            if iin_prefix is not None and not card[self.NUMBER].startswith(iin_prefix):
+                continue
+            if min_balance is not None and card[self.BALANCE] < min_balance:
+                continue
+            if max_balance is not None and card[self.BALANCE] > max_balance:
+                continue
+            if closed is not None and (card[self.CLOSED_AT] is not None) != closed:
+                continue
+            yield (card[self.ID], card[self.NUMBER], card[self.PIN], card[self.BALANCE])
+
+    def search_cards(self, suffix, prefix=None, closed=None, limit=constants.SEARCH_LIMIT):
+        found = [(card[self.ID], card[self.NUMBER], card[self.BALANCE], card[self.CLOSED_AT])
+                 for card in self.cards.values()
+                 if card[self.NUMBER].endswith(suffix) and card[self.NUMBER].startswith(prefix or "")
+                 and (closed is None or (card[self.CLOSED_AT] is not None) == closed)]
+        return sorted(found, key=lambda card: card[1])[:max(1, min(limit, constants.SEARCH_MAX_LIMIT))]
+
+    def get_card_ids_by_numbers(self, numbers):
+        open_numbers = self.open_numbers
+        return {number: open_numbers[number] for number in numbers if number in open_numbers}
+
+    def get_card_balances(self, card_ids):
+        balances = {}
+        for card_id in card_ids:
+            card = self.get_open_card(card_id)
+            if card is not None:
+                balances[card_id] = card[self.BALANCE]
+        return balances
+
+    def apply_net_transfers(self, deltas, entries):
+        with self.lock:
+            cards = {card_id: self.get_open_card(card_id) for card_id, delta in deltas.items() if delta != 0}
+            for card_id, card in cards.items():
+                if card is None or (deltas[card_id] < 0 and card[self.BALANCE] + deltas[card_id] < 0):
+                    return False
+            for card_id, card in cards.items():
+                card[self.BALANCE] += deltas[card_id]
+                card[self.VERSION] += 1
+            for card_id, amount, counterparty in entries:
+                self.add_history(card_id, amount, constants.HISTORY_TRANSFER, counterparty)
+            return True
+
+    def run_idempotent(self, card_id, key, operation):
+        """Run an operation at most once per idempotency key (see Database.run_idempotent)."""
+        with self.lock:
+            now = int(time.time())
+            if key is not None:
+                stored = self.idempotency_keys.get((card_id, key))
+                if stored is not None and stored[0] >= now - constants.IDEMPOTENCY_RETENTION_SECONDS:
+                    return stored[1]
+            result = operation()
+            if key is not None:
+                # re-inserted keys move to the end, so the dict stays ordered by creation time
+                self.idempotency_keys.pop((card_id, key), None)
+                self.idempotency_keys[(card_id, key)] = (now, result)
+            return result
+
+    def prune_idempotency_keys(self, batch_size=constants.IDEMPOTENCY_PRUNE_BATCH_SIZE,
+                               max_batches=constants.IDEMPOTENCY_PRUNE_MAX_BATCHES):
+        with self.lock:
+            cutoff = int(time.time()) - constants.IDEMPOTENCY_RETENTION_SECONDS
+            expired = []
+            for key, (created_at, result) in self.idempotency_keys.items():
+                if created_at >= cutoff or len(expired) == batch_size * max_batches:
+                    break
+                expired.append(key)
+            for key in expired:
+                del self.idempotency_keys[key]
+            return len(expired)
+
+    def add_income(self, card_id, amount, idempotency_key=None):
+        def apply():
+            if not str(amount).isdigit():
+                return constants.POSITIVE_INTEGER_FAIL
+            card = self.get_open_card(card_id)
+            if card is None or int(amount) > constants.MAX_BALANCE - card[self.BALANCE]:
+                return constants.CARD_ADD_INCOME_FAIL
+            card[self.BALANCE] += int(amount)
+            card[self.VERSION] += 1
+            self.add_history(card_id, int(amount), constants.HISTORY_INCOME)
+            return constants.CARD_ADD_INCOME_SUCCESS
+
+        return self.run_idempotent(card_id, idempotency_key, apply)
+
+    def do_batch_transfer(self, card_id, legs, idempotency_key=None):
+        return self.run_idempotent(card_id, idempotency_key, lambda: self.apply_batch_transfer(card_id, legs))
+
+    def apply_batch_transfer(self, card_id, legs):
+        """Validate and apply the legs of a batch transfer (see Database.do_batch_transfer)."""
+        sender = self.get_open_card(card_id)
+        if sender is None:
+            return [(number, amount, constants.CARD_TRANSFER_NUMBER_NONEXISTENT) for number, amount in legs]
+
+        results, credits = check_batch_legs(sender[self.NUMBER], legs, self.get_card_ids_by_numbers)
+        total = sum(amount for index, amount, receiver_id in credits)
+        outcome = constants.CARD_TRANSFER_AMOUNT_FAIL
+        if credits and total <= sender[self.BALANCE]:
+            sender[self.BALANCE] -= total
+            sender[self.VERSION] += 1
+            for index, amount, receiver_id in credits:
+                receiver = self.cards[receiver_id]
+                receiver[self.BALANCE] += amount
+                receiver[self.VERSION] += 1
+                self.add_history(card_id, -amount, constants.HISTORY_TRANSFER, str(legs[index][0]))
+                self.add_history(receiver_id, amount, constants.HISTORY_TRANSFER, sender[self.NUMBER])
+            outcome = constants.CARD_TRANSFER_AMOUNT_SUCCESS
+        for index, amount, receiver_id in credits:
+            results[index] = outcome
+
+        return [(number, amount, results[index]) for index, (number, amount) in enumerate(legs)]
+
+    def create_schedule_record(self, data):
+        with self.lock:
+            self.last_schedule_id += 1
+            card_id, receiver, amount, interval_seconds, next_run_at = data
+            # same field order as the SQLite schedule table
+            self.schedules[self.last_schedule_id] = [self.last_schedule_id, card_id, receiver, int(amount),
+                                                     int(interval_seconds), int(next_run_at), 1]
+            return self.last_schedule_id
+
+    def get_schedules_due_before(self, until):
+        due = [(schedule[5], schedule[0], schedule[1], schedule[2], schedule[3], schedule[4])
+               for schedule in self.schedules.values() if schedule[6] and schedule[5] < until]
+        return sorted(due)
+
+    def do_scheduled_transfer(self, card_id, orders):
+        with self.lock:
+            results, next_runs = pay_scheduled_runs(
+                orders, lambda receiver, amount: self.apply_batch_transfer(card_id, [(receiver, amount)])[0][2])
+            for next_run_at, schedule_id in next_runs:
+                self.schedules[schedule_id][5] = next_run_at
+            return results, next_runs
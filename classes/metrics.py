@@ -0,0 +1,129 @@
+import os
+import time
+import bisect
+import functools
+import threading
+import constants
+
+
+def get_outcome(message):
+    """Return the metrics label of an outcome message from constants (see METRICS_OUTCOMES), or 'other'."""
+    return constants.METRICS_OUTCOMES.get(message.strip(), "other")
+
+
+class Histogram:
+    """Count observed durations in fixed buckets, Prometheus style (each bound is an upper bound, in seconds).
+
+    Keyword arguments:
+        buckets -- the sorted bucket upper bounds; slower observations land in an extra +Inf bucket
+    """
+    def __init__(self, buckets=constants.METRICS_LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+
+    def observe(self, seconds):
+        """Count one observed duration."""
+        self.counts[bisect.bisect_left(self.buckets, seconds)] += 1
+        self.sum += seconds
+
+    def get_count(self):
+        """Return the number of observed durations."""
+        return sum(self.counts)
+
+
+class Metrics:
+    """Latency histograms and outcome counters of the banking operations, exported in the Prometheus text format.
+
+    Recording costs two perf_counter calls, a bisect and a few increments per operation;
+    the export runs in a background thread and writes a file for the node exporter
+    textfile collector (or any scraper reading files).
+
+    Keyword arguments:
+        prefix -- the metric names prefix
+    """
+    def __init__(self, prefix=constants.METRICS_PREFIX):
+        self.prefix = prefix
+        self.latencies = {}
+        self.outcomes = {}
+        self.export_thread = None
+        self.export_stop = threading.Event()
+
+    def observe(self, operation, seconds):
+        """Record the duration of one operation."""
+        histogram = self.latencies.get(operation)
+        if histogram is None:
+            histogram = self.latencies[operation] = Histogram()
+        histogram.observe(seconds)
+
+    def count(self, operation, outcome):
+        """Count one outcome (a label such as 'success' or 'not_enough_money') of an operation."""
+        key = (operation, outcome)
+        self.outcomes[key] = self.outcomes.get(key, 0) + 1
+
+    def timed(self, operation):
+        """Return a decorator recording the duration of every call of a function as the given operation."""
+        def decorator(function):
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                started = time.perf_counter()
+                try:
+                    return function(*args, **kwargs)
+                finally:
+                    self.observe(operation, time.perf_counter() - started)
+            return wrapper
+        return decorator
+
+    def get_text(self):
+        """Return every metric in the Prometheus text exposition format."""
+        duration = f"{self.prefix}_operation_duration_seconds"
+        outcomes = f"{self.prefix}_operation_outcomes_total"
+        lines = [f"# HELP {duration} Duration of the banking operations.", f"# TYPE {duration} histogram"]
+        for operation, histogram in sorted(dict(self.latencies).items()):
+            counts = list(histogram.counts)
+            cumulative = 0
+            for bound, count in zip([*histogram.buckets, "+Inf"], counts):
+                cumulative += count
+                lines.append(f'{duration}_bucket{{operation="{operation}",le="{bound}"}} {cumulative}')
+            lines.append(f'{duration}_sum{{operation="{operation}"}} {histogram.sum:.6f}')
+            lines.append(f'{duration}_count{{operation="{operation}"}} {cumulative}')
+        lines += [f"# HELP {outcomes} Outcomes of the banking operations.", f"# TYPE {outcomes} counter"]
+        for (operation, outcome), count in sorted(dict(self.outcomes).items()):
+            lines.append(f'{outcomes}{{operation="{operation}",outcome="{outcome}"}} {count}')
+        return '\n'.join(lines) + '\n'
+
+    def write(self, path):
+        """Write the metrics to a file, atomically so a scraper never reads half a file."""
+        temporary = f"{path}.tmp"
+        with open(temporary, 'w') as metrics_file:
+            metrics_file.write(self.get_text())
+        os.replace(temporary, path)
+
+    def run_export(self, path, interval):
+        """Write the metrics file every `interval` seconds until stop_export is called."""
+        while not self.export_stop.wait(interval):
+            try:
+                self.write(path)
+            except OSError as e:
+                print(e)
+
+    def start_export(self, path, interval=constants.METRICS_EXPORT_INTERVAL_SECONDS):
+        """Start writing the metrics file in a background thread.
+
+        Arguments:
+            path -- the metrics file
+
+        Keyword arguments:
+            interval -- the time (in seconds) between two writes
+        """
+        self.export_stop.clear()
+        self.export_thread = threading.Thread(target=self.run_export, args=(path, interval), daemon=True)
+        self.export_thread.start()
+
+    def stop_export(self, path):
+        """Stop the background export and write the final metrics file."""
+        if self.export_thread is not None:
+            self.export_stop.set()
+            self.export_thread.join()
+            self.export_thread = None
+        self.write(path)
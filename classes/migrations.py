@@ -0,0 +1,191 @@
+import math
+import time
+import constants
+
+
+def create_table(create_table_sql):
+    """Return a schema change running a CREATE TABLE IF NOT EXISTS (or any idempotent) statement."""
+    def apply(cur):
+        cur.execute(create_table_sql)
+    return apply
+
+
+def add_column(table, column, definition):
+    """Return a schema change adding a column to a table, doing nothing if the column is already there."""
+    def apply(cur):
+        columns = [row[1] for row in cur.execute(f"PRAGMA table_info({table})")]
+        if column not in columns:
+            cur.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+    return apply
+
+
+class Migration:
+    """One ordered schema migration: a schema change, a chunked card table backfill, or both.
+
+    Arguments:
+        version -- the migration number; migrations are applied in increasing order
+        name -- what the migration does
+
+    Keyword arguments:
+        apply -- a callable (or a tuple of callables) taking a cursor and changing the schema;
+                 it must be safe to run twice
+        backfill -- a statement updating the card ids between :start and :end (with :now the current time);
+                    it must be safe to run twice on the same ids
+    """
+    def __init__(self, version, name, apply=None, backfill=None):
+        self.version = version
+        self.name = name
+        self.apply = apply
+        self.backfill = backfill
+
+    def apply_schema_change(self, cur):
+        """Run the schema change of the migration."""
+        for apply in (self.apply if isinstance(self.apply, tuple) else (self.apply,)):
+            if apply is not None:
+                apply(cur)
+
+    def get_job_id(self):
+        """Return the batch job id storing the backfill progress."""
+        return f"migration-{self.version}"
+
+
+MIGRATIONS = (
+    Migration(1, "add the card closed_at column", apply=add_column("card", "closed_at", "integer")),
+    Migration(2, "add the card version column", apply=add_column("card", "version", "integer NOT NULL DEFAULT 0")),
+    # the balance includes the balance shards of the hot cards (migration 4), which can exist before this backfill runs;
+    # the opening entry is dated just before the first recorded entry, so the history adds up at any point in time
+    Migration(3, "record the balances older than the card history as opening entries", backfill=f'''
+        INSERT INTO card_history(card_id, created_at, amount, reason)
+        SELECT id, first_entry_at - 1, balance - recorded, '{constants.HISTORY_OPENING}' FROM (
+            SELECT id, balance + CASE WHEN balance_shards > 0
+                THEN (SELECT IFNULL(SUM(balance), 0) FROM card_balance_shard WHERE card_id = card.id) ELSE 0 END AS balance,
+                IFNULL((SELECT SUM(amount) FROM card_history WHERE card_id = card.id), 0) AS recorded,
+                IFNULL((SELECT MIN(created_at) FROM card_history WHERE card_id = card.id), :now) AS first_entry_at
+            FROM card WHERE id BETWEEN :start AND :end
+        ) WHERE balance != recorded '''),
+    Migration(4, "add the hot card balance shards", apply=(
+        add_column("card", "balance_shards", "integer NOT NULL DEFAULT 0"),
+        create_table(''' CREATE TABLE IF NOT EXISTS card_balance_shard (
+                              card_id integer NOT NULL,
+                              slot integer NOT NULL,
+                              balance integer NOT NULL DEFAULT 0,
+                              PRIMARY KEY (card_id, slot)
+                          ) WITHOUT ROWID '''),
+    )),
+)
+
+
+class Migrator:
+    """Bring the database schema to the last migration, without stopping the traffic.
+
+    Schema changes run in one short transaction each, in version order. Backfills run in
+    chunks of `chunk_size` card ids, one transaction per chunk with a pause in between, and
+    store their progress with each chunk (see Database.backfill_cards), so an interrupted
+    migration resumes where it stopped. A migration is recorded in the schema_version
+    table once its backfill is complete, and never before the migrations under it, so the
+    schema version only names migrations complete with every earlier one. Code may rely
+    on the schema changes of every migration as soon as the database is connected, but
+    not on pending backfills.
+
+    Arguments:
+        db -- the connected database
+
+    Keyword arguments:
+        migrations -- the migrations, ordered by version
+        chunk_size -- the number of card ids per backfill transaction
+        pause -- the pause (in seconds) between two chunks, leaving room to other writers
+    """
+    def __init__(self, db, migrations=MIGRATIONS, chunk_size=constants.MIGRATION_CHUNK_SIZE,
+                 pause=constants.MIGRATION_PAUSE_SECONDS):
+        self.db = db
+        self.migrations = migrations
+        self.chunk_size = chunk_size
+        self.pause = pause
+
+    def get_pending(self):
+        """Return the migrations not applied yet, in order."""
+        applied = self.db.get_applied_migrations()
+        return [migration for migration in self.migrations if migration.version not in applied]
+
+    def apply_pending_schema_changes(self, cur):
+        """Run the schema changes of every pending migration with the cursor of the calling transaction."""
+        for migration in self.get_pending():
+            migration.apply_schema_change(cur)
+
+    def run_fast(self):
+        """Apply the schema changes of every pending migration, leaving the backfills to `run`.
+
+        Only the migrations up to the first one with a backfill are recorded; the ones after
+        it are recorded by `run`, once that backfill is complete. Without any card (a new
+        database) a backfill has nothing to do, so every migration is recorded.
+
+        Returns:
+            The migrations recorded
+        """
+        self.db.apply_schema_change(self.apply_pending_schema_changes)
+        applied = []
+        for migration in self.get_pending():
+            if migration.backfill is not None and self.db.get_max_card_id():
+                break
+            self.db.apply_schema_change(version=migration.version, name=migration.name)
+            applied.append(migration)
+        return applied
+
+    def run(self, report=None):
+        """Apply every pending migration, backfills included.
+
+        Keyword arguments:
+            report -- called with (migration, last card id, max card id) after every backfill chunk
+                      and with (migration, None, None) once a migration is recorded
+
+        Returns:
+            The applied migrations
+        """
+        # a backfill may read the columns and tables of later migrations
+        self.db.apply_schema_change(self.apply_pending_schema_changes)
+        applied = []
+        for migration in self.get_pending():
+            if migration.backfill is not None:
+                self.backfill(migration, report)
+            self.db.apply_schema_change(version=migration.version, name=migration.name)
+            applied.append(migration)
+            if report:
+                report(migration, None, None)
+        return applied
+
+    def backfill(self, migration, report=None):
+        """Run the backfill of a migration chunk by chunk, resuming after the last stored chunk."""
+        last_id, max_id, finished_at = self.db.get_batch_job(migration.get_job_id())
+        while last_id < max_id:
+            end_id = min(last_id + self.chunk_size, max_id)
+            self.db.backfill_cards(migration.get_job_id(), migration.backfill, last_id + 1, end_id)
+            last_id = end_id
+            if report:
+                report(migration, last_id, max_id)
+            time.sleep(self.pause)
+        self.db.finish_batch_job(migration.get_job_id())
+
+    def estimate(self):
+        """Estimate the pending migrations without changing anything.
+
+        The duration of a backfill is extrapolated from one sample chunk, run (after the
+        pending schema changes) and rolled back.
+
+        Returns:
+            A list of dicts with the version, name, card ids left, chunks and estimated seconds of every pending migration
+        """
+        estimates = []
+        for migration in self.get_pending():
+            estimate = {"version": migration.version, "name": migration.name, "ids": 0, "chunks": 0, "seconds": 0}
+            if migration.backfill is not None:
+                progress = self.db.find_batch_job(migration.get_job_id())
+                last_id, max_id = progress[:2] if progress else (0, self.db.get_max_card_id())
+                chunks = math.ceil((max_id - last_id) / self.chunk_size)
+                if chunks:
+                    sample = self.db.time_backfill_cards(migration.backfill, last_id + 1,
+                                                         min(last_id + self.chunk_size, max_id),
+                                                         prepare=self.apply_pending_schema_changes)
+                    estimate.update(ids=max_id - last_id, chunks=chunks,
+                                    seconds=round(chunks * (sample + self.pause), 1))
+            estimates.append(estimate)
+        return estimates
@@ -0,0 +1,105 @@
+import os
+import sqlite3
+import constants
+from concurrent.futures import ProcessPoolExecutor
+from classes.card import is_valid_number
+from classes.card_generator import CardGenerator
+
+
+def get_id_ranges(max_id, chunk_size):
+    """Split the card ids 1 to `max_id` into (first id, last id) ranges of `chunk_size` ids."""
+    return [(start, min(start + chunk_size - 1, max_id)) for start in range(1, max_id + 1, chunk_size)]
+
+
+def connect_read_only(db_file):
+    """Return a read-only connection to a database file."""
+    return sqlite3.connect(f"file:{os.path.abspath(db_file)}?mode=ro", uri=True)
+
+
+def check_card_range(db_file, start_id, end_id, max_anomalies=constants.RECONCILE_MAX_ANOMALIES):
+    """Check the card rows with ids in [start_id, end_id]; runs in a worker process.
+
+    Arguments:
+        db_file -- the database file
+        start_id -- the first card id of the range
+        end_id -- the last card id of the range
+
+    Keyword arguments:
+        max_anomalies -- the maximum number of anomalies reported for the range
+
+    Returns:
+        A dict with the rows count, the balances sum, the anomalies count and the first anomalies
+    """
+    generator = CardGenerator()
+    connection = connect_read_only(db_file)
+    cur = connection.cursor()
+    # hot cards hold part of their balance in balance shards
+    cur.execute(''' SELECT id, number, pin, balance + CASE WHEN balance_shards > 0
+            THEN (SELECT IFNULL(SUM(balance), 0) FROM card_balance_shard WHERE card_id = card.id) ELSE 0 END
+            FROM card WHERE id BETWEEN ? AND ? ''', (start_id, end_id))
+    rows = balance = anomalies_count = 0
+    anomalies = []
+    batch = cur.fetchmany(constants.LIST_CHUNK_SIZE)
+    while batch:
+        for card_id, number, pin, amount in batch:
+            rows += 1
+            balance += amount
+            problems = []
+            number = str(number)
+            if isinstance(pin, int) and 0 <= pin < 10000:
+                # the compact card table layout stores PINs as integers
+                pin = f"{pin:04d}"
+            if not (generator.is_valid(number) or is_valid_number(number)):
+                problems.append("invalid card number")
+            if not (isinstance(pin, str) and len(pin) == 4 and pin.isdigit()):
+                problems.append("invalid PIN")
+            if amount < 0:
+                problems.append("negative balance")
+            if problems:
+                anomalies_count += 1
+                if len(anomalies) < max_anomalies:
+                    anomalies.append({"id": card_id, "problems": problems})
+        batch = cur.fetchmany(constants.LIST_CHUNK_SIZE)
+    connection.close()
+    return {"rows": rows, "balance": balance, "anomalies_count": anomalies_count, "anomalies": anomalies}
+
+
+def reconcile(db_file, chunk_size=constants.RECONCILE_CHUNK_SIZE, workers=None, expected_total=None):
+    """Check every card row in parallel id ranges and merge the results into one report.
+
+    The ranges and the archive are read by different connections at different times,
+    so the file must not change during the check: pass a backup copy of a live database.
+
+    Arguments:
+        db_file -- the database file
+
+    Keyword arguments:
+        chunk_size -- the number of card ids per range
+        workers -- the number of worker processes (default: one per core)
+        expected_total -- the total money the bank should hold, if known
+
+    Returns:
+        The report dict; `balanced` tells if the total matches `expected_total`
+    """
+    connection = connect_read_only(db_file)
+    max_id = connection.execute("SELECT IFNULL(MAX(id), 0) FROM card").fetchone()[0]
+    archived = connection.execute("SELECT IFNULL(SUM(balance), 0) FROM card_archive").fetchone()[0]
+    connection.close()
+
+    ranges = get_id_ranges(max_id, chunk_size)
+    report = {"rows": 0, "balance": 0, "archived_balance": archived, "anomalies_count": 0, "anomalies": [],
+              "chunks": len(ranges)}
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(check_card_range, db_file, start_id, end_id) for start_id, end_id in ranges]
+        for future in futures:
+            chunk = future.result()
+            report["rows"] += chunk["rows"]
+            report["balance"] += chunk["balance"]
+            report["anomalies_count"] += chunk["anomalies_count"]
+            room = constants.RECONCILE_MAX_ANOMALIES - len(report["anomalies"])
+            report["anomalies"].extend(chunk["anomalies"][:room])
+    report["total"] = report["balance"] + report["archived_balance"]
+    if expected_total is not None:
+        report["expected_total"] = expected_total
+        report["balanced"] = report["total"] == expected_total
+    return report
@@ -0,0 +1,126 @@
+import time
+import heapq
+import constants
+
+
+class Scheduler:
+    """Run standing orders (recurring transfers) when they are due.
+
+    Only the standing orders due within the next `horizon` seconds are kept, in a heap
+    ordered by next run time; they are read with a range scan on the next run index,
+    which also picks up runs missed while the scheduler was down. The scheduler sleeps
+    until the earliest job is due (or until the next refresh, which picks up new
+    standing orders) and pays the due jobs of each sender card in one transaction, every
+    run as a transfer of its own. A run the card can't afford stays due and is retried
+    after the next refresh.
+
+    Arguments:
+        db -- the connected database
+
+    Keyword arguments:
+        horizon -- how far ahead (in seconds) standing orders are loaded into the heap
+        refresh -- how often (in seconds) the heap is reloaded from the database
+        batch_size -- the maximum number of due jobs executed per round
+        max_catch_up -- the maximum number of missed runs paid for a single standing order
+    """
+    def __init__(self, db, horizon=constants.SCHEDULER_HORIZON_SECONDS, refresh=constants.SCHEDULER_REFRESH_SECONDS,
+                 batch_size=constants.SCHEDULER_BATCH_SIZE, max_catch_up=constants.SCHEDULER_MAX_CATCH_UP_RUNS):
+        self.db = db
+        self.horizon = horizon
+        self.refresh = refresh
+        self.batch_size = batch_size
+        self.max_catch_up = max_catch_up
+        self.heap = []
+        self.refresh_at = 0
+
+    def load(self, now):
+        """Reload the heap with the standing orders due before `now + horizon`.
+
+        Arguments:
+            now -- the current UNIX timestamp
+        """
+        # a standing order without a positive interval could never be rescheduled, so it is never run
+        self.heap = [job for job in self.db.get_schedules_due_before(int(now) + self.horizon) if job[5] > 0]
+        heapq.heapify(self.heap)
+        self.refresh_at = now + self.refresh
+
+    def pop_due(self, now):
+        """Pop at most `batch_size` jobs due at the given time from the heap.
+
+        Arguments:
+            now -- the current UNIX timestamp
+        """
+        due = []
+        while self.heap and self.heap[0][0] <= now and len(due) < self.batch_size:
+            due.append(heapq.heappop(self.heap))
+        return due
+
+    def get_next_run(self, next_run_at, interval, now):
+        """Return how many runs of a job are paid now and when it runs next.
+
+        Arguments:
+            next_run_at -- the (possibly missed) scheduled run time
+            interval -- the standing order interval in seconds
+            now -- the current UNIX timestamp
+
+        Returns:
+            A (paid runs, next run at) tuple; runs missed beyond `max_catch_up` are skipped
+        """
+        missed = int((now - next_run_at) // interval) + 1
+        runs = min(missed, self.max_catch_up)
+        return runs, next_run_at + missed * interval
+
+    def execute(self, due, now):
+        """Pay the due jobs in one transaction per sender card, every run as a transfer of its own.
+
+        Arguments:
+            due -- the due jobs popped from the heap
+            now -- the current UNIX timestamp
+
+        Returns:
+            A list of (standing order id, receiver card number, amount, result message) tuples
+        """
+        by_card = {}
+        jobs = {}
+        for next_run_at, schedule_id, card_id, receiver, amount, interval in due:
+            runs, next_run = self.get_next_run(next_run_at, interval, now)
+            # the paid runs are the last `runs` missed ones
+            run_times = [next_run - (runs - run) * interval for run in range(runs)]
+            by_card.setdefault(card_id, []).append((schedule_id, receiver, amount, run_times, next_run))
+            jobs[schedule_id] = (card_id, receiver, amount, interval)
+
+        results = []
+        for card_id, orders in by_card.items():
+            paid, next_runs = self.db.do_scheduled_transfer(card_id, orders)
+            results.extend(paid)
+            for next_run, schedule_id in next_runs:
+                # a run left unpaid for lack of money is still due: it is retried once the heap is reloaded
+                if now < next_run < now + self.horizon:
+                    heapq.heappush(self.heap, (next_run, schedule_id, *jobs[schedule_id]))
+        return results
+
+    def run_pending(self, now=None):
+        """Execute every job due now and return the results (see execute)."""
+        now = time.time() if now is None else now
+        if now >= self.refresh_at:
+            self.load(now)
+        results = []
+        due = self.pop_due(now)
+        while due:
+            results.extend(self.execute(due, now))
+            due = self.pop_due(now)
+        return results
+
+    def run(self, report=print):
+        """Run the scheduler forever, sleeping until the next job is due or the next refresh.
+
+        Keyword arguments:
+            report -- called with every (standing order id, receiver, amount, result message) tuple
+        """
+        while True:
+            for result in self.run_pending():
+                report(result)
+            wake_at = self.refresh_at
+            if self.heap:
+                wake_at = min(wake_at, self.heap[0][0])
+            time.sleep(max(0, wake_at - time.time()))
@@ -0,0 +1,137 @@
+import time
+import constants
+from classes.card import is_valid_number
+
+
+class NettingEngine:
+    """Collect transfers over a settlement window and settle them as net balance changes.
+
+    The transfers of a window are netted per card in memory: a card sending 10 and
+    receiving 10 in the same window does not change at all. Overdrafts are checked against
+    the net positions; while a card would end below 0, its latest outgoing transfers are
+    rejected. The net changes are then applied with one update per touched card, together
+    with one card history entry per transfer leg, in a single transaction.
+
+    Arguments:
+        db -- the connected storage engine
+
+    Keyword arguments:
+        window -- how long (in seconds) transfers are collected before they are settled
+        max_transfers -- the number of collected transfers that settles the window early
+        retries -- how many times a window is settled again after a concurrent balance change
+    """
+    def __init__(self, db, window=constants.SETTLEMENT_WINDOW_SECONDS,
+                 max_transfers=constants.SETTLEMENT_MAX_TRANSFERS, retries=constants.CAS_MAX_RETRIES):
+        self.db = db
+        self.window = window
+        self.max_transfers = max_transfers
+        self.retries = retries
+        self.pending = []
+        self.opened_at = None
+        self.transfers = 0
+        self.row_writes = 0
+
+    def submit(self, sender, receiver, amount):
+        """Collect a (sender card number, receiver card number, amount) transfer for the next settlement."""
+        if not self.pending:
+            self.opened_at = time.monotonic()
+        self.pending.append((str(sender), str(receiver), str(amount)))
+
+    def is_due(self, now=None):
+        """Return if the collected transfers should be settled now."""
+        if not self.pending:
+            return False
+        now = time.monotonic() if now is None else now
+        return len(self.pending) >= self.max_transfers or now - self.opened_at >= self.window
+
+    def check(self, transfers):
+        """Validate the transfers and resolve their card numbers.
+
+        Returns:
+            A (results, accepted) tuple: the failure message of every transfer (None if
+            valid) and a list of (index, sender id, receiver id, amount) for the valid ones
+        """
+        card_ids = self.db.get_card_ids_by_numbers(number for transfer in transfers for number in transfer[:2])
+        results = [None] * len(transfers)
+        accepted = []
+        for index, (sender, receiver, amount) in enumerate(transfers):
+            if not amount.isdigit():
+                results[index] = constants.POSITIVE_INTEGER_FAIL
+            elif not is_valid_number(receiver):
+                results[index] = constants.CARD_TRANSFER_NUMBER_FAIL
+            elif sender == receiver:
+                results[index] = constants.CARD_TRANSFER_NUMBER_OWN
+            elif sender not in card_ids or receiver not in card_ids:
+                results[index] = constants.CARD_TRANSFER_NUMBER_NONEXISTENT
+            else:
+                accepted.append((index, card_ids[sender], card_ids[receiver], int(amount)))
+        return results, accepted
+
+    def net(self, accepted, balances, results):
+        """Net the accepted transfers per card, rejecting the latest debits of cards that would end below 0.
+
+        Arguments:
+            accepted -- the (index, sender id, receiver id, amount) valid transfers, in submission order
+            balances -- a dict mapping the card ids to their balances
+            results -- the results list, where rejected transfers get their failure message
+
+        Returns:
+            A (net changes by card id, transfers kept) tuple
+        """
+        while True:
+            deltas = {}
+            for index, sender_id, receiver_id, amount in accepted:
+                deltas[sender_id] = deltas.get(sender_id, 0) - amount
+                deltas[receiver_id] = deltas.get(receiver_id, 0) + amount
+            rejected = False
+            # dropping a debit can overdraw its receiver in turn, hence the outer loop
+            for position in range(len(accepted) - 1, -1, -1):
+                index, sender_id, receiver_id, amount = accepted[position]
+                if balances[sender_id] + deltas[sender_id] < 0:
+                    results[index] = constants.CARD_TRANSFER_AMOUNT_FAIL
+                    deltas[sender_id] += amount
+                    deltas[receiver_id] -= amount
+                    del accepted[position]
+                    rejected = True
+            if not rejected:
+                return deltas, accepted
+
+    def settle(self):
+        """Settle the collected transfers.
+
+        Returns:
+            A list with one (sender card number, receiver card number, amount, result message) tuple per transfer
+        """
+        transfers, self.pending = self.pending, []
+        results, accepted = self.check(transfers)
+        for attempt in range(self.retries + 1):
+            outcome = list(results)
+            balances = self.db.get_card_balances(card_id for transfer in accepted for card_id in transfer[1:3])
+            kept = []
+            for transfer in accepted:
+                if transfer[1] in balances and transfer[2] in balances:
+                    kept.append(transfer)
+                else:
+                    # closed since the numbers were resolved
+                    outcome[transfer[0]] = constants.CARD_TRANSFER_NUMBER_NONEXISTENT
+            deltas, kept = self.net(kept, balances, outcome)
+            entries = []
+            for index, sender_id, receiver_id, amount in kept:
+                entries.append((sender_id, -amount, transfers[index][1]))
+                entries.append((receiver_id, amount, transfers[index][0]))
+            if self.db.apply_net_transfers(deltas, entries):
+                for index, sender_id, receiver_id, amount in kept:
+                    outcome[index] = constants.CARD_TRANSFER_AMOUNT_SUCCESS
+                self.transfers += len(kept)
+                self.row_writes += sum(1 for delta in deltas.values() if delta != 0)
+                break
+        else:
+            # balances kept changing under the window: nothing was applied
+            outcome = [message or constants.CARD_TRANSFER_AMOUNT_FAIL for message in outcome]
+        return [(*transfer, message) for transfer, message in zip(transfers, outcome)]
+
+    def get_write_reduction(self):
+        """Return the share of card row writes saved by netting (each settled transfer would write 2 rows)."""
+        if not self.transfers:
+            return 0
+        return 1 - self.row_writes / (2 * self.transfers)
@@ -0,0 +1,153 @@
+import os
+import time
+import constants
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from classes.reconciliation import get_id_ranges, connect_read_only
+
+
+def get_chunk_directory(output_dir, start_id, end_id):
+    """Return the directory holding the statements of the card ids in [start_id, end_id]."""
+    return os.path.join(output_dir, f"{start_id:010d}-{end_id:010d}")
+
+
+def is_chunk_done(output_dir, start_id, end_id):
+    """Return if the statements of a card id range were all written by an earlier run."""
+    return os.path.exists(os.path.join(get_chunk_directory(output_dir, start_id, end_id), constants.STATEMENT_DONE_FILE))
+
+
+def format_statement(number, period_start, period_end, opening, movements):
+    """Return the text of a card statement.
+
+    Arguments:
+        number -- the card number
+        period_start -- the UNIX time the period starts at
+        period_end -- the UNIX time the period ends at (excluded)
+        opening -- the balance at the start of the period
+        movements -- the (created at, amount, reason, counterparty) history entries of the period, oldest first
+    """
+    def format_time(timestamp):
+        return time.strftime(constants.STATEMENT_TIME_FORMAT, time.gmtime(timestamp))
+
+    lines = [f"Statement of card {number}",
+             f"Period: {format_time(period_start)} to {format_time(period_end)} UTC",
+             f"Opening balance: {opening}"]
+    closing = opening
+    for created_at, amount, reason, counterparty in movements:
+        closing += amount
+        lines.append(f"{format_time(created_at)}  {reason:<10} {amount:>12}  {counterparty or ''}".rstrip())
+    lines.append(f"Closing balance: {closing}")
+    return "\n".join(lines) + "\n"
+
+
+def write_statement_range(db_file, output_dir, start_id, end_id, period_start, period_end):
+    """Write the statements of the card ids in [start_id, end_id]; runs in a worker process.
+
+    The opening balances are summed from the card history before the period and the
+    movements are read for the whole range at once, both from the covering card history
+    index. Each statement is built in memory and written with a single write call; the
+    file is named after the card id and number, since a closed card and the card later
+    issued with its number can both have a statement. The `done` file written last is
+    the checkpoint of the range.
+
+    Arguments:
+        db_file -- the database file
+        output_dir -- the statements directory
+        start_id -- the first card id of the range
+        end_id -- the last card id of the range
+        period_start -- the UNIX time the period starts at
+        period_end -- the UNIX time the period ends at (excluded)
+
+    Returns:
+        The number of statements written
+    """
+    connection = connect_read_only(db_file)
+    cur = connection.cursor()
+    # cards closed before the period have nothing to report
+    cur.execute(''' SELECT id, CAST(number AS TEXT) FROM card
+            WHERE id BETWEEN ? AND ? AND (closed_at IS NULL OR closed_at >= ?) ORDER BY id ''',
+                (start_id, end_id, period_start))
+    cards = cur.fetchall()
+    cur.execute(''' SELECT card_id, SUM(amount) FROM card_history
+            WHERE card_id BETWEEN ? AND ? AND created_at < ? GROUP BY card_id ''', (start_id, end_id, period_start))
+    openings = dict(cur.fetchall())
+    cur.execute(''' SELECT card_id, created_at, amount, reason, counterparty FROM card_history
+            WHERE card_id BETWEEN ? AND ? AND created_at >= ? AND created_at < ?
+            ORDER BY card_id, created_at, id ''', (start_id, end_id, period_start, period_end))
+    movements = {}
+    for card_id, *entry in cur.fetchall():
+        movements.setdefault(card_id, []).append(entry)
+    connection.close()
+
+    directory = get_chunk_directory(output_dir, start_id, end_id)
+    os.makedirs(directory, exist_ok=True)
+    for card_id, number in cards:
+        statement = format_statement(number, period_start, period_end, openings.get(card_id, 0),
+                                     movements.get(card_id, ()))
+        with open(os.path.join(directory, f"{card_id:010d}-{number}.txt"), 'w') as output:
+            output.write(statement)
+    done_file = os.path.join(directory, constants.STATEMENT_DONE_FILE)
+    with open(done_file + '.tmp', 'w') as output:
+        output.write(f"{len(cards)}\n")
+    os.replace(done_file + '.tmp', done_file)
+    return len(cards)
+
+
+def get_max_card_id(db_file, output_dir):
+    """Return the last card id of the statements run in the output directory, read by its first run.
+
+    The card id ranges are cut from that id, so a resumed run finds the same ranges and
+    the checkpoints of the finished ones, even after new cards were added.
+    """
+    max_id_file = os.path.join(output_dir, constants.STATEMENT_MAX_ID_FILE)
+    if os.path.exists(max_id_file):
+        with open(max_id_file) as stored:
+            return int(stored.read())
+    connection = connect_read_only(db_file)
+    max_id = connection.execute("SELECT IFNULL(MAX(id), 0) FROM card").fetchone()[0]
+    connection.close()
+    os.makedirs(output_dir, exist_ok=True)
+    with open(max_id_file + '.tmp', 'w') as output:
+        output.write(f"{max_id}\n")
+    os.replace(max_id_file + '.tmp', max_id_file)
+    return max_id
+
+
+def generate_statements(db_file, output_dir, period_start, period_end, chunk_size=constants.STATEMENT_CHUNK_SIZE,
+                        workers=None, report=None):
+    """Write one statement file per card for a period, in parallel card id ranges.
+
+    Every range is handled by a worker process with its own read-only connection and its
+    own directory. Ranges finished by an earlier run (the checkpoint is their `done` file)
+    are skipped, so an interrupted run resumes where it stopped, over the cards that
+    existed when the run started; history entries of a past period don't change, so the
+    resumed statements match. The opening entries of the cards
+    older than the card history must be recorded first (migration STATEMENT_MIGRATION).
+
+    Arguments:
+        db_file -- the database file
+        output_dir -- the statements directory
+        period_start -- the UNIX time the period starts at
+        period_end -- the UNIX time the period ends at (excluded)
+
+    Keyword arguments:
+        chunk_size -- the number of card ids per range
+        workers -- the number of worker processes (default: one per core)
+        report -- called with (statements written so far, ranges done, ranges) after every range
+
+    Returns:
+        A dict with the statements written, the ranges, the ranges skipped, the seconds and the statements per second
+    """
+    started = time.monotonic()
+    ranges = get_id_ranges(get_max_card_id(db_file, output_dir), chunk_size)
+    pending = [(start_id, end_id) for start_id, end_id in ranges if not is_chunk_done(output_dir, start_id, end_id)]
+    statements = 0
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(write_statement_range, db_file, output_dir, start_id, end_id, period_start,
+                                   period_end) for start_id, end_id in pending]
+        for done, future in enumerate(as_completed(futures), start=1):
+            statements += future.result()
+            if report:
+                report(statements, len(ranges) - len(pending) + done, len(ranges))
+    seconds = time.monotonic() - started
+    return {"statements": statements, "ranges": len(ranges), "skipped_ranges": len(ranges) - len(pending),
+            "seconds": round(seconds, 3), "statements_per_second": round(statements / seconds) if seconds else 0}
@@ -0,0 +1,220 @@
+import constants
+from classes.card import is_valid_number
+
+
+class CardVersionConflict(Exception):
+    """Raised when a card record was changed by another writer since it was read."""
+    def __init__(self, card_id, version):
+        super().__init__(f"card {card_id} is no longer at version {version}")
+        self.card_id = card_id
+        self.version = version
+
+
+class StorageBackend:
+    """The operations every storage engine provides to the banking system.
+
+    Card data is exchanged as tuples: (id, number, pin, balance, version) when read,
+    (number, pin, balance) when created. Database is the durable SQLite engine and
+    MemoryDatabase the dict based engine for tests, simulations and benchmarks. Backups,
+    batch jobs (interest), migrations, layouts, reconciliation and statements work on the
+    SQLite file itself: they are Database methods only, and their commands need the
+    sqlite backend.
+    """
+    def connect(self):
+        """Open the storage and create whatever it needs."""
+        raise NotImplementedError
+
+    def disconnect(self):
+        """Close the storage."""
+        raise NotImplementedError
+
+    def create_card_record(self, data):
+        """Create a card record from (number, pin, balance) data."""
+        raise NotImplementedError
+
+    def create_card_records(self, rows):
+        """Create many card records from (number, pin, balance) rows at once."""
+        raise NotImplementedError
+
+    def fill_card_number_pool(self, rows):
+        """Add (number, pin) pairs to the card number pool, skipping numbers in use; return how many were added."""
+        raise NotImplementedError
+
+    def get_card_number_pool_size(self):
+        """Return the number of pooled card numbers left."""
+        raise NotImplementedError
+
+    def issue_pool_cards(self, count=1):
+        """Create up to `count` cards from pooled numbers; return their (id, number, pin, balance) data."""
+        raise NotImplementedError
+
+    def update_card_record(self, data):
+        """Overwrite a card record with (number, pin, balance, id) data."""
+        raise NotImplementedError
+
+    def compare_and_swap_card_record(self, card_id, version, changes, reason=constants.HISTORY_UPDATE, counterparty=None,
+                                     previous_balance=None):
+        """Update the changed columns of a card still at `version`; return the new version or raise CardVersionConflict."""
+        raise NotImplementedError
+
+    def set_card_balance_shards(self, card_id, shards):
+        """Mark an open card as hot with `shards` balance shards (0 makes it regular again); return if it was found."""
+        raise NotImplementedError
+
+    def credit_hot_card(self, card_id, amount, reason=constants.HISTORY_UPDATE, counterparty=None):
+        """Credit a hot card without touching its version; return False without changing anything for other cards."""
+        raise NotImplementedError
+
+    def delete_card_record(self, card_id):
+        """Delete a card record."""
+        raise NotImplementedError
+
+    def close_card_record(self, card_id):
+        """Close (tombstone) a card and deactivate its standing orders."""
+        raise NotImplementedError
+
+    def archive_closed_cards(self, closed_before, batch_size=constants.ARCHIVE_BATCH_SIZE):
+        """Archive one batch of cards closed before the given time; return how many were archived."""
+        raise NotImplementedError
+
+    def enable_incremental_vacuum(self):
+        """Prepare the storage for incremental space reclaiming."""
+        raise NotImplementedError
+
+    def incremental_vacuum(self, pages=constants.VACUUM_PAGES_PER_STEP):
+        """Reclaim at most `pages` free pages; return the number of free pages left."""
+        raise NotImplementedError
+
+    def get_card_data_by_number(self, number):
+        """Return the data of the open card with the given number, or None."""
+        raise NotImplementedError
+
+    def get_card_data_by_id(self, card_id):
+        """Return the data of the open card with the given id, or None."""
+        raise NotImplementedError
+
+    def iter_cards(self, iin_prefix=None, min_balance=None, max_balance=None, closed=None,
+                   chunk_size=constants.LIST_CHUNK_SIZE, page_size=constants.LIST_PAGE_SIZE):
+        """Stream the (id, number, pin, balance) data of the cards matching the filters, ordered by id."""
+        raise NotImplementedError
+
+    def search_cards(self, suffix, prefix=None, closed=None, limit=constants.SEARCH_LIMIT):
+        """Return the (id, number, balance, closed at) data of the cards whose number ends with `suffix` (and starts with `prefix`)."""
+        raise NotImplementedError
+
+    def get_card_ids_by_numbers(self, numbers):
+        """Return a dict mapping each given number of an open card to its id."""
+        raise NotImplementedError
+
+    def get_card_balances(self, card_ids):
+        """Return a dict mapping each given id of an open card to its balance."""
+        raise NotImplementedError
+
+    def apply_net_transfers(self, deltas, entries):
+        """Apply {card id: net change} deltas and (card id, amount, counterparty) history entries at once, or nothing on an overdraft."""
+        raise NotImplementedError
+
+    def add_income(self, card_id, amount, idempotency_key=None):
+        """Add income to a card; return the result message."""
+        raise NotImplementedError
+
+    def do_batch_transfer(self, card_id, legs, idempotency_key=None):
+        """Pay (receiver number, amount) legs from a card at once; return a (number, amount, message) per leg."""
+        raise NotImplementedError
+
+    def get_card_history(self, card_id, before=None, limit=constants.HISTORY_PAGE_SIZE):
+        """Return the (id, created at, amount, reason, counterparty) history entries of a card older than `before`, newest first."""
+        raise NotImplementedError
+
+    def prune_idempotency_keys(self, batch_size=constants.IDEMPOTENCY_PRUNE_BATCH_SIZE,
+                               max_batches=constants.IDEMPOTENCY_PRUNE_MAX_BATCHES):
+        """Delete expired idempotency keys in bounded batches; return how many were deleted."""
+        raise NotImplementedError
+
+    def create_schedule_record(self, data):
+        """Create a standing order from (card id, receiver, amount, interval, next run at); return its id."""
+        raise NotImplementedError
+
+    def get_schedules_due_before(self, until):
+        """Return the active standing orders due before `until`, ordered by next run time."""
+        raise NotImplementedError
+
+    def do_scheduled_transfer(self, card_id, orders):
+        """Pay the due runs of the standing orders of a card one by one and store their next run times in one step."""
+        raise NotImplementedError
+
+
+def check_batch_legs(sender_number, legs, get_card_ids_by_numbers):
+    """Validate the legs of a batch transfer and resolve their receivers.
+
+    Arguments:
+        sender_number -- the sender card number
+        legs -- a list of (receiver card number, amount) pairs
+        get_card_ids_by_numbers -- the storage lookup of open card ids by numbers
+
+    Returns:
+        A (results, credits) tuple: the failure message of each leg (None if payable)
+        and a list of (leg index, amount, receiver card id) for the payable legs
+    """
+    results = [None] * len(legs)
+    candidates = []
+    for index, (number, amount) in enumerate(legs):
+        number, amount = str(number), str(amount)
+        if not amount.isdigit():
+            results[index] = constants.POSITIVE_INTEGER_FAIL
+        elif not is_valid_number(number):
+            results[index] = constants.CARD_TRANSFER_NUMBER_FAIL
+        elif number == sender_number:
+            results[index] = constants.CARD_TRANSFER_NUMBER_OWN
+        else:
+            candidates.append(index)
+
+    receiver_ids = get_card_ids_by_numbers(str(legs[index][0]) for index in candidates)
+    credits = []
+    for index in candidates:
+        receiver_id = receiver_ids.get(str(legs[index][0]))
+        if receiver_id is None:
+            results[index] = constants.CARD_TRANSFER_NUMBER_NONEXISTENT
+        else:
+            credits.append((index, int(legs[index][1]), receiver_id))
+    return results, credits
+
+
+def pay_scheduled_runs(orders, pay):
+    """Pay the due runs of standing orders, each run as a transfer of its own.
+
+    A run rejected for lack of money stops its standing order there: that run and the
+    later ones stay due, to be paid once the money is there. Any other failure (e.g. a
+    closed receiver) can't be fixed by waiting, so the run is skipped.
+
+    Arguments:
+        orders -- a list of (standing order id, receiver card number, amount, due run times, next run at)
+                  tuples, the due run times oldest first
+        pay -- a callable paying one (receiver card number, amount) transfer on its own and
+               returning its result message
+
+    Returns:
+        A (results, next runs) tuple: one (standing order id, receiver card number, amount,
+        result message) tuple per attempted run and the (next run at, standing order id)
+        pairs to store
+    """
+    results = []
+    next_runs = []
+    for schedule_id, receiver, amount, run_times, next_run_at in orders:
+        for run_at in run_times:
+            message = pay(receiver, amount)
+            results.append((schedule_id, receiver, amount, message))
+            if message == constants.CARD_TRANSFER_AMOUNT_FAIL:
+                next_run_at = run_at
+                break
+        next_runs.append((next_run_at, schedule_id))
+    return results, next_runs
+
+
+def get_backend(name=constants.STORAGE_BACKEND):
+    """Return a new, not yet connected, storage engine by name (see constants.STORAGE_BACKENDS)."""
+    if name == 'memory':
+        from classes.memory_database import MemoryDatabase
+        return MemoryDatabase()
+    from classes.database import Database
+    return Database()
@@ -0,0 +1,97 @@
+import time
+from collections import OrderedDict
+import constants
+
+
+class LoginThrottle:
+    """Track failed logins per card number and per client session, with exponential backoff.
+
+    After `threshold` failures a key is locked for `base_lockout` seconds, doubling with every
+    further failure up to `max_lockout`. Checks happen before the card lookup, so a login flood
+    against locked keys never reaches the database. At most `max_entries` keys are kept and
+    keys idle for `expiry` seconds are swept out. A new key takes the place of the least
+    recently failed key that is not locked; when every kept key is locked, new keys are
+    refused and wait like locked ones (failing closed), so a flood of junk keys can't
+    push a lockout out.
+
+    Keyword arguments:
+        threshold -- the failures allowed before the first lockout
+        base_lockout -- the first lockout, in seconds
+        max_lockout -- the longest lockout, in seconds
+        expiry -- the idle time (in seconds) after which a key is forgotten
+        max_entries -- the maximum number of tracked keys
+    """
+    def __init__(self, threshold=constants.LOGIN_THROTTLE_THRESHOLD, base_lockout=constants.LOGIN_THROTTLE_BASE_SECONDS,
+                 max_lockout=constants.LOGIN_THROTTLE_MAX_SECONDS, expiry=constants.LOGIN_THROTTLE_EXPIRY_SECONDS,
+                 max_entries=constants.LOGIN_THROTTLE_MAX_ENTRIES):
+        self.threshold = threshold
+        self.base_lockout = base_lockout
+        self.max_lockout = max_lockout
+        self.expiry = expiry
+        self.max_entries = max_entries
+        # key -> [failures, locked until, last failure]
+        self.entries = OrderedDict()
+        self.next_sweep = 0
+        # while every kept key is locked: when the first lockout ends
+        self.full_until = 0
+
+    def get_wait(self, number, session, now=None):
+        """Return how many seconds the card number or the session must still wait (0 if not locked)."""
+        now = time.monotonic() if now is None else now
+        if now >= self.next_sweep:
+            self.sweep(now)
+        wait = 0
+        full = len(self.entries) >= self.max_entries and now < self.full_until
+        for key in (("card", number), ("session", session)):
+            entry = self.entries.get(key)
+            if entry is not None:
+                wait = max(wait, entry[1] - now)
+            elif full:
+                wait = max(wait, self.full_until - now)
+        return wait
+
+    def record_failure(self, number, session, now=None):
+        """Count a failed login for the card number and the session, locking them when needed."""
+        now = time.monotonic() if now is None else now
+        for key in (("card", number), ("session", session)):
+            entry = self.entries.get(key)
+            if entry is None:
+                if len(self.entries) >= self.max_entries and not self.make_room(now):
+                    continue
+                entry = self.entries[key] = [0, 0, now]
+            else:
+                self.entries.move_to_end(key)
+            entry[0] += 1
+            entry[2] = now
+            if entry[0] >= self.threshold:
+                lockout = self.base_lockout * pow(2, min(entry[0] - self.threshold, 32))
+                entry[1] = now + min(lockout, self.max_lockout)
+
+    def make_room(self, now):
+        """Forget the least recently failed key that is not locked, to make room for a new key.
+
+        Returns:
+            False if every kept key is locked; no key is looked at again before the first lockout ends
+        """
+        if now < self.full_until:
+            return False
+        unlocked = next((key for key, entry in self.entries.items() if entry[1] <= now), None)
+        if unlocked is None:
+            self.full_until = min(entry[1] for entry in self.entries.values())
+            return False
+        del self.entries[unlocked]
+        return True
+
+    def record_success(self, number, session):
+        """Forget the failures of the card number and the session after a successful login."""
+        self.entries.pop(("card", number), None)
+        self.entries.pop(("session", session), None)
+
+    def sweep(self, now):
+        """Forget the keys idle for longer than `expiry` (the oldest are at the front)."""
+        while self.entries:
+            key, entry = next(iter(self.entries.items()))
+            if now - entry[2] < self.expiry or entry[1] > now:
+                break
+            self.entries.popitem(last=False)
+        self.next_sweep = now + constants.LOGIN_THROTTLE_SWEEP_SECONDS
@@ -0,0 +1,98 @@
+import sys
+import time
+import constants
+
+
+class SlidingWindowCounter:
+    """Count events per key over a sliding time window, in O(1) per event.
+
+    The window is approximated by the count of the current fixed window plus the count of
+    the previous one, weighted by how much of it still overlaps the sliding window. The
+    counts of the two windows are kept in two dicts; when a new window starts, the current
+    dict becomes the previous one and the keys idle for two windows go with the old
+    previous dict, so a rollover costs the same however many keys are tracked.
+
+    Arguments:
+        limit -- the maximum number of events per key within the window
+        window -- the window length in seconds
+    """
+    def __init__(self, limit, window):
+        self.limit = limit
+        self.window = window
+        self.current = {}
+        self.previous = {}
+        self.window_number = 0
+
+    def roll(self, window_number):
+        """Start the given window if it is a new one."""
+        if window_number > self.window_number:
+            self.previous = self.current if window_number == self.window_number + 1 else {}
+            self.current = {}
+            self.window_number = window_number
+
+    def is_allowed(self, key, now):
+        """Return if one more event for the key would stay within the limit."""
+        window_number, offset = divmod(now, self.window)
+        self.roll(int(window_number))
+        previous = self.previous.get(key, 0)
+        return previous * (1 - offset / self.window) + self.current.get(key, 0) < self.limit
+
+    def add(self, key, now):
+        """Count one event for the key."""
+        self.roll(int(now // self.window))
+        self.current[key] = self.current.get(key, 0) + 1
+
+    def get_key_count(self):
+        """Return the number of keys with events in the current or the previous window."""
+        return len(self.current.keys() | self.previous.keys())
+
+    def memory_usage(self):
+        """Return the approximate memory used by the counters, in bytes."""
+        counters = (self.current, self.previous)
+        return sum(sys.getsizeof(counts) + sum(sys.getsizeof(count) for count in counts.values()) for counts in counters)
+
+
+class VelocityLimiter:
+    """Limit how many balance operations a single card, and the whole system, can run per window.
+
+    Keyword arguments:
+        card_limit -- the maximum number of operations per card within the window
+        global_limit -- the maximum number of operations of all cards within the window
+        window -- the window length in seconds
+    """
+    GLOBAL_KEY = None
+
+    def __init__(self, card_limit=constants.VELOCITY_CARD_LIMIT, global_limit=constants.VELOCITY_GLOBAL_LIMIT,
+                 window=constants.VELOCITY_WINDOW_SECONDS):
+        self.cards = SlidingWindowCounter(card_limit, window)
+        self.all_cards = SlidingWindowCounter(global_limit, window)
+
+    def check(self, card_number, now=None):
+        """Return if both limits allow one more operation of the given card, without counting it.
+
+        The cards are keyed by number, so an operation can be rejected before the card is read.
+        """
+        now = time.monotonic() if now is None else now
+        return self.all_cards.is_allowed(self.GLOBAL_KEY, now) and self.cards.is_allowed(card_number, now)
+
+    def record(self, card_number, now=None):
+        """Count an operation of the given card, e.g. once its owner has logged in."""
+        now = time.monotonic() if now is None else now
+        self.all_cards.add(self.GLOBAL_KEY, now)
+        self.cards.add(card_number, now)
+
+    def allow(self, card_number, now=None):
+        """Count an operation of the given card if both limits allow it.
+
+        Returns:
+            A boolean that is False if the operation must be rejected
+        """
+        now = time.monotonic() if now is None else now
+        if not self.check(card_number, now):
+            return False
+        self.record(card_number, now)
+        return True
+
+    def memory_usage(self):
+        """Return the approximate memory used by the counters, in bytes."""
+        return self.cards.memory_usage() + self.all_cards.memory_usage()
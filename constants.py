@@ -7,6 +7,7 @@ LOGIN_CARD_INPUT = 'Enter your card number:\n'
 LOGIN_PIN_INPUT = 'Enter your PIN:\n'
 LOGIN_SUCCESS_MSG = '\nYou have successfully logged in!\n'
 LOGIN_FAIL_MSG = '\nWrong card number or PIN!\n'
+LOGIN_THROTTLED_MSG = '\nToo many failed attempts. Please try again in {} seconds.'
 LOGOUT_SUCCESS_MSG = '\nYou have successfully logged out!\n'
 
 # CARD OPERATIONS SECTION
@@ -20,15 +21,167 @@ CARD_ADD_INCOME_FAIL = '\nCould not add the given income. Please try again!\n'
 CARD_TRANSFER_MSG = '\nTransfer\n'
 CARD_TRANSFER_NUMBER_MSG = '\nEnter card number:\n'
 CARD_TRANSFER_NUMBER_FAIL = '\nProbably you made a mistake in the card number. Please try again!\n'
+CARD_TRANSFER_NUMBER_SUGGEST = 'Did you mean:'
 CARD_TRANSFER_NUMBER_OWN = '\nYou can\'t transfer money to the same account!\n'
 CARD_TRANSFER_NUMBER_NONEXISTENT = '\nSuch a card does not exist.\n'
 CARD_TRANSFER_AMOUNT_MSG = '\nEnter how much money you want to transfer:\n'
 CARD_TRANSFER_AMOUNT_FAIL = '\nNot enough money!\n'
 CARD_TRANSFER_AMOUNT_SUCCESS = '\nSuccess!\n'
 CARD_CLOSE_MSG = '\nThe account has been closed!\n'
+CARD_HISTORY_MSG = '\nHistory'
+CARD_HISTORY_EMPTY_MSG = 'No more entries.\n'
+CARD_HISTORY_MORE_MSG = '\nEnter 1 for older entries, anything else to go back:\n'
+CARD_VELOCITY_LIMIT_MSG = '\nToo many operations. Please wait a moment and try again!\n'
 
 # GENERIC
 POSITIVE_INTEGER_FAIL = '\nThe value is not a positive integer. Please try again!\n'
 
 # DATABASE SECTION
 DATABASE_FILE = 'card.s3db'
+STORAGE_BACKEND = 'sqlite'
+STORAGE_BACKENDS = ('sqlite', 'memory')
+SQLITE_ONLY_COMMAND_MSG = 'the {} command needs the sqlite backend, not --backend {}'
+CHECKPOINT_INTERVAL_SECONDS = 5
+CHECKPOINT_RETRY_SECONDS = 0.01
+CHECKPOINT_REPORT_MSG = 'Running in memory: changes from the last {:.1f}s at most can be lost in a crash'
+SQL_MAX_VARIABLES = 500
+# the largest SQLite INTEGER: a balance never grows past it
+MAX_BALANCE = 2 ** 63 - 1
+# text: the original card table; compact: integer numbers and PINs in a table clustered on the number
+CARD_LAYOUT = 'text'
+CARD_LAYOUTS = ('text', 'compact')
+CARD_LAYOUT_BLOCKED_MSG = '{} cards have a number or PIN the {} layout cannot store; nothing was converted'
+CAS_MAX_RETRIES = 5
+
+# ISSUE SECTION
+ISSUE_BATCH_SIZE = 10000
+
+# SUGGESTIONS SECTION
+SUGGESTIONS_LIMIT = 5
+
+# LIST SECTION
+LIST_CHUNK_SIZE = 1000
+LIST_PAGE_SIZE = 50000
+LIST_FORMATS = ('csv', 'jsonl')
+LIST_FIELDS = ('id', 'number', 'balance')
+LIST_IIN_FAIL_MSG = 'The card number prefix can only contain digits.'
+
+# IDEMPOTENCY SECTION
+IDEMPOTENCY_RETENTION_SECONDS = 24 * 60 * 60
+IDEMPOTENCY_PRUNE_EVERY = 1000
+IDEMPOTENCY_PRUNE_BATCH_SIZE = 1000
+IDEMPOTENCY_PRUNE_MAX_BATCHES = 100
+
+# SCHEDULER SECTION
+SCHEDULE_DEFAULT_INTERVAL_SECONDS = 30 * 24 * 60 * 60
+SCHEDULER_HORIZON_SECONDS = 60 * 60
+SCHEDULER_REFRESH_SECONDS = 60
+SCHEDULER_BATCH_SIZE = 1000
+SCHEDULER_MAX_CATCH_UP_RUNS = 12
+
+# ARCHIVE SECTION
+ARCHIVE_AFTER_SECONDS = 30 * 24 * 60 * 60
+ARCHIVE_BATCH_SIZE = 500
+ARCHIVE_PAUSE_SECONDS = 0.05
+ARCHIVE_INTERVAL_SECONDS = 60 * 60
+VACUUM_PAGES_PER_STEP = 256
+
+# BACKUP SECTION
+BACKUP_PAGES_PER_STEP = 256
+BACKUP_SLEEP_SECONDS = 0.005
+BACKUP_MAX_RESTARTS = 3
+BACKUP_PROBE_INTERVAL_SECONDS = 0.002
+
+# BALANCE ADJUSTMENT SECTION
+ADJUSTMENT_CHUNK_SIZE = 5000
+ADJUSTMENT_TIME_BUDGET_SECONDS = 15 * 60
+ADJUSTMENT_PAUSE_SECONDS = 0.001
+
+# RECONCILIATION SECTION
+RECONCILE_CHUNK_SIZE = 100000
+RECONCILE_MAX_ANOMALIES = 100
+RECONCILE_SNAPSHOT_FILE = 'snapshot.s3db'
+
+# VELOCITY SECTION
+VELOCITY_WINDOW_SECONDS = 1
+VELOCITY_CARD_LIMIT = 5
+VELOCITY_GLOBAL_LIMIT = 2000
+
+# LOGIN THROTTLE SECTION
+LOGIN_THROTTLE_THRESHOLD = 3
+LOGIN_THROTTLE_BASE_SECONDS = 1
+LOGIN_THROTTLE_MAX_SECONDS = 15 * 60
+LOGIN_THROTTLE_EXPIRY_SECONDS = 60 * 60
+LOGIN_THROTTLE_MAX_ENTRIES = 1000000
+LOGIN_THROTTLE_SWEEP_SECONDS = 10
+
+# JSON LINES SECTION
+JSONL_FLUSH_LINES = 1000
+JSONL_READ_SIZE = 64 * 1024
+
+# CARD NUMBER POOL SECTION
+CARD_POOL_LOW_WATERMARK = 1000
+CARD_POOL_TARGET_SIZE = 10000
+CARD_POOL_BATCH_SIZE = 5000
+CARD_POOL_CHECK_INTERVAL_SECONDS = 1
+
+# HISTORY SECTION
+HISTORY_PAGE_SIZE = 10
+HISTORY_MAX_PAGE_SIZE = 1000
+HISTORY_INCOME = 'income'
+HISTORY_TRANSFER = 'transfer'
+HISTORY_UPDATE = 'update'
+HISTORY_OPENING = 'opening'
+
+# METRICS SECTION
+METRICS_PREFIX = 'sbs'
+METRICS_EXPORT_INTERVAL_SECONDS = 15
+# latency bucket upper bounds, in seconds (about 2.5 buckets per decade, from 50us to 10s)
+METRICS_LATENCY_BUCKETS = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25,
+                           0.5, 1, 2.5, 5, 10)
+# metrics labels of the outcome messages (without their blank lines)
+METRICS_OUTCOMES = {
+    LOGIN_SUCCESS_MSG.strip(): 'success',
+    LOGIN_FAIL_MSG.strip(): 'wrong_credentials',
+    CREATE_CARD_MSG.strip(): 'success',
+    CARD_ADD_INCOME_SUCCESS.strip(): 'success',
+    CARD_ADD_INCOME_FAIL.strip(): 'failed',
+    CARD_TRANSFER_NUMBER_FAIL.strip(): 'invalid_number',
+    CARD_TRANSFER_NUMBER_OWN.strip(): 'own_card',
+    CARD_TRANSFER_NUMBER_NONEXISTENT.strip(): 'nonexistent_card',
+    CARD_TRANSFER_AMOUNT_FAIL.strip(): 'not_enough_money',
+    CARD_TRANSFER_AMOUNT_SUCCESS.strip(): 'success',
+    CARD_CLOSE_MSG.strip(): 'success',
+    CARD_VELOCITY_LIMIT_MSG.strip(): 'velocity_limited',
+    POSITIVE_INTEGER_FAIL.strip(): 'invalid_amount',
+    MENU_UNSUPPORTED_OPTION_MSG.strip(): 'unsupported',
+}
+
+# MIGRATION SECTION
+MIGRATION_CHUNK_SIZE = 5000
+MIGRATION_PAUSE_SECONDS = 0.01
+
+# HOT CARD SECTION
+HOT_CARD_DEFAULT_SHARDS = 16
+HOT_CARD_MAX_SHARDS = 64
+
+# SETTLEMENT SECTION
+SETTLEMENT_WINDOW_SECONDS = 1
+SETTLEMENT_MAX_TRANSFERS = 10000
+
+# SEARCH SECTION
+SEARCH_SUFFIX_DIGITS = 4
+SEARCH_LIMIT = 20
+SEARCH_MAX_LIMIT = 1000
+SEARCH_FIELDS = ('id', 'number', 'balance', 'status')
+SEARCH_SUFFIX_FAIL_MSG = 'Enter at least the last {} digits of the card number.'
+SEARCH_PREFIX_FAIL_MSG = 'The card number prefix can only contain digits.'
+
+# STATEMENT SECTION
+STATEMENT_CHUNK_SIZE = 10000
+STATEMENT_DONE_FILE = 'done'
+STATEMENT_MAX_ID_FILE = 'max_id'
+STATEMENT_TIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+STATEMENT_MONTH_FAIL_MSG = 'Enter the month as YYYY-MM, e.g. 2026-01.'
+STATEMENT_MIGRATION = 3
+STATEMENT_MIGRATION_FAIL_MSG = 'Statements need migration {}: run the migrate command first.'
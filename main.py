@@ -217,21 +217,51 @@
 # 
 # Bye!
 
+import os
 import sys
+import csv
+import math
+import calendar
+import json
 import random
+import time
+import argparse
+import itertools
+import tempfile
 import constants
-from classes.card import Card
-from classes.database import Database
+from classes.card import Card, get_typo_candidates
+from classes.storage import get_backend
+from classes.archiver import Archiver
+from classes.backup import BackupTask, probe_latency, percentile
+from classes.interest import BalanceAdjustmentJob
+from classes.reconciliation import reconcile
+from classes.card_generator import CardGenerator
+from classes.scheduler import Scheduler
+from classes.velocity import VelocityLimiter
+from classes.throttle import LoginThrottle
+from classes.jsonl import JsonLinesServer
+from classes.card_pool import CardNumberPool
+from classes.metrics import Metrics, get_outcome
+from classes.migrations import Migrator
+from classes.settlement import NettingEngine
+from classes.statements import generate_statements
 
 # MENU OPTIONS SETUP
 guest_options = ['1. Create an account', '2. Log into account', '0. Exit']
-logged_in_options = ['1. Balance', '2. Add income', '3. Do transfer', '4. Close account', '5. Log out', '0. Exit']
+logged_in_options = ['1. Balance', '2. Add income', '3. Do transfer', '4. Close account', '5. Log out', '6. History', '0. Exit']
 
 # AUTHENTICATION SETUP
 logged_in = -1
 selected_option = None
-db=Database()
-db.connect()
+# the storage engine, selected on the command line (see get_argument_parser)
+db = None
+# per card and global limits on balance operations, checked before any query runs
+velocity = VelocityLimiter()
+# failed login tracking, checked before the card lookup; one session per interactive process
+login_throttle = LoginThrottle()
+session_id = f"pid-{os.getpid()}"
+# operation latencies and outcomes, exported with --metrics-file
+metrics = Metrics()
 
 
 def login():
@@ -242,13 +272,34 @@ def login():
     """
     card_number = str(input(constants.LOGIN_CARD_INPUT))
     card_pin = str(input(constants.LOGIN_PIN_INPUT))
+    return authenticate(card_number, card_pin)
+
+
+@metrics.timed("login")
+def authenticate(card_number, card_pin):
+    """Check a card number and PIN, unless the throttle locked them after too many failures.
+
+    Arguments:
+        card_number -- the card number
+        card_pin -- the card PIN
+
+    Returns:
+        The card id if successful, -1 if otherwise.
+    """
+    wait = login_throttle.get_wait(card_number, session_id)
+    if wait > 0:
+        print(constants.LOGIN_THROTTLED_MSG.format(math.ceil(wait)))
+        metrics.count("login", "throttled")
+        return -1
     # if found, the response contains the card data (id, number, pin, balance)
     response = db.get_card_data_by_number(card_number)
 
-    if not response:
-        return -1
-    if response[2] != card_pin:
+    if not response or response[2] != card_pin:
+        login_throttle.record_failure(card_number, session_id)
+        metrics.count("login", get_outcome(constants.LOGIN_FAIL_MSG))
         return -1
+    login_throttle.record_success(card_number, session_id)
+    metrics.count("login", get_outcome(constants.LOGIN_SUCCESS_MSG))
     return response[0]
 
 
@@ -266,9 +317,7 @@ def guest_menu(selected, card_id):
         exit_sbs()
     else:
         if selected_option == 1:
-            current_card = Card(checksum_type="luhn")
-            db.create_card_record(current_card.get_data())
-            current_card.created()
+            issue_card().created()
         elif selected_option == 2:
             card_id = login()
             if card_id != -1:
@@ -307,54 +356,48 @@ def logged_in_menu(selected, card_id):
             do_transfer(current_card)
         # close card option
         elif selected == 4:
-            print(constants.CARD_CLOSE_MSG)
-            db.delete_card_record(current_card.id)
+            close_card(current_card)
             card_id = -1
         # logout option
         elif selected == 5:
             print(constants.LOGOUT_SUCCESS_MSG)
             card_id = -1
+        # history option
+        elif selected == 6:
+            show_history(current_card)
         else:
             print(constants.MENU_UNSUPPORTED_OPTION_MSG)
     return card_id
 
 
-def updated(old, new):
-    """Return if a value was updated.
-    
-    Returns
-        A boolean which is True if the value was updated, or False otherwise
+@metrics.timed("create_card")
+def issue_card():
+    """Create a card, with a number from the card number pool if it is not empty.
+
+    Returns:
+        The card object
     """
-    return (old == new) is False
+    issued = db.issue_pool_cards(1)
+    if issued:
+        metrics.count("create_card", "pool")
+        return Card(data=issued[0])
+    # empty pool: generate the number on the request path
+    card = Card(checksum_type="luhn")
+    db.create_card_record(card.get_data())
+    metrics.count("create_card", "generated")
+    return card
 
 
-def update_balance(card, amount, success_msg="", fail_msg="", quiet=False):
-    """Update the card balance and return the update result.
-    
+@metrics.timed("close_card")
+def close_card(card):
+    """Close own card.
+
     Arguments:
         card -- the card object
-        amount -- the balance amount to update
-        success_msg -- the update success message
-        fail_msg -- the update fail message
-    
-    Keyword arguments:
-        quiet -- a boolean that controls if success / fail messages are shown 
-
-    Returns:
-        A boolean with the update result
     """
-    result = False
-    old_balance = card.balance
-    card.set_balance(int(old_balance) + int(amount))
-    db.update_card_record(card.get_data())
-    if updated(old_balance, card.balance):
-        if not quiet:
-            print(success_msg)
-        result = True
-    else:
-        if not quiet:
-            print(fail_msg)
-    return result
+    print(constants.CARD_CLOSE_MSG)
+    db.close_card_record(card.id)
+    metrics.count("close_card", get_outcome(constants.CARD_CLOSE_MSG))
 
 
 def add_income(card):
@@ -363,11 +406,32 @@ def add_income(card):
     Arguments:
         card -- the card object
     """
+    if not velocity.allow(card.number):
+        print(constants.CARD_VELOCITY_LIMIT_MSG)
+        metrics.count("add_income", get_outcome(constants.CARD_VELOCITY_LIMIT_MSG))
+        return
     income = str(input(constants.CARD_ADD_INCOME_MSG))
     while not income.isdigit():
         print(constants.POSITIVE_INTEGER_FAIL)
         income = str(input(constants.CARD_ADD_INCOME_MSG))
-    update_balance(card, income, constants.CARD_ADD_INCOME_SUCCESS, constants.CARD_ADD_INCOME_FAIL)
+    deposit(card, income)
+
+
+@metrics.timed("add_income")
+def deposit(card, income):
+    """Add a validated income amount to own card.
+
+    Arguments:
+        card -- the card object
+        income -- the income amount
+    """
+    # the storage engine checks the amount against the balance and credits a hot card in a balance shard
+    message = db.add_income(card.id, income)
+    response = db.get_card_data_by_id(card.id)
+    if response:
+        card.load(response)
+    print(message)
+    metrics.count("add_income", get_outcome(message))
 
 
 def valid_number(number, number_length=16, algo="luhn"):
@@ -411,6 +475,26 @@ def check_amount(card, amount):
     return True
 
 
+def suggest_numbers(card, number, existing=None):
+    """Return the existing card numbers one typo away from a mistyped number, found with a single query.
+
+    Arguments:
+        card -- the card object (its own number is never suggested)
+        number -- the mistyped card number
+
+    Keyword arguments:
+        existing -- a set of card numbers to search instead of the database
+    """
+    candidates = [candidate for candidate in get_typo_candidates(number) if candidate != card.number]
+    if existing is not None:
+        found = [candidate for candidate in candidates if candidate in existing]
+    else:
+        found_ids = db.get_card_ids_by_numbers(candidates) if candidates else {}
+        found = [candidate for candidate in candidates if candidate in found_ids]
+    return found[:constants.SUGGESTIONS_LIMIT]
+
+
+@metrics.timed("check_number")
 def check_number(card, number, algo="luhn"):
     """Check given number against a set of checks: algorithm validity, ownership, existance in database.
     
@@ -426,13 +510,21 @@ def check_number(card, number, algo="luhn"):
     """
     if not valid_number(number, algo=algo):
         print(constants.CARD_TRANSFER_NUMBER_FAIL)
+        metrics.count("check_number", get_outcome(constants.CARD_TRANSFER_NUMBER_FAIL))
+        suggestions = suggest_numbers(card, number)
+        if suggestions:
+            print(constants.CARD_TRANSFER_NUMBER_SUGGEST)
+            print('\n'.join(suggestions) + '\n')
         return False
     if card.number == number:
         print(constants.CARD_TRANSFER_NUMBER_OWN)
+        metrics.count("check_number", get_outcome(constants.CARD_TRANSFER_NUMBER_OWN))
         return False
     if not db.get_card_data_by_number(number):
         print(constants.CARD_TRANSFER_NUMBER_NONEXISTENT)
+        metrics.count("check_number", get_outcome(constants.CARD_TRANSFER_NUMBER_NONEXISTENT))
         return False
+    metrics.count("check_number", "success")
     return True
 
 
@@ -442,32 +534,611 @@ def do_transfer(card):
     Arguments:
         card -- the card object
     """
+    if not velocity.allow(card.number):
+        print(constants.CARD_VELOCITY_LIMIT_MSG)
+        metrics.count("do_transfer", get_outcome(constants.CARD_VELOCITY_LIMIT_MSG))
+        return False
     print(constants.CARD_TRANSFER_MSG)
     receiver = str(input(constants.CARD_TRANSFER_NUMBER_MSG))
     if not check_number(card, receiver):
+        metrics.count("do_transfer", "invalid_receiver")
         return False
     amount = str(input(constants.CARD_TRANSFER_AMOUNT_MSG))
+    return transfer(card, receiver, amount)
+
+
+@metrics.timed("do_transfer")
+def transfer(card, receiver, amount):
+    """Transfer an amount from one card to a checked receiver card number.
+
+    Arguments:
+        card -- the card object
+        receiver -- the receiver card number
+        amount -- the amount, as entered
+
+    Returns:
+        A boolean with the transfer result
+    """
     if not check_amount(card, amount):
+        failure = constants.POSITIVE_INTEGER_FAIL if not amount.isdigit() else constants.CARD_TRANSFER_AMOUNT_FAIL
+        metrics.count("do_transfer", get_outcome(failure))
         return False
-    is_successful = update_balance(card, int(amount) * -1, quiet=True)
-    if is_successful:
-        receiver_card = Card(data=db.get_card_data_by_number(receiver))
-        is_successful = update_balance(receiver_card, int(amount), quiet=True)
-    if is_successful:
-        print(constants.CARD_TRANSFER_AMOUNT_SUCCESS)
-    else:
-        print(constants.CARD_TRANSFER_AMOUNT_FAIL)
+    # the debit and the credit are one guarded transaction: a receiver closed since it was checked pays nothing
+    (_, _, message), = db.do_batch_transfer(card.id, [(receiver, amount)])
+    response = db.get_card_data_by_id(card.id)
+    if response:
+        card.load(response)
+    print(message)
+    metrics.count("do_transfer", get_outcome(message))
+    return message == constants.CARD_TRANSFER_AMOUNT_SUCCESS
+
+
+def format_history_entry(entry):
+    """Return a history entry (id, created at, amount, reason, counterparty) as a printable line."""
+    entry_id, created_at, amount, reason, counterparty = entry
+    line = f"{time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(created_at))}  {amount:+d}  {reason}"
+    return f"{line}  {counterparty}" if counterparty else line
+
+
+def show_history(card):
+    """Print the history of own card, newest first, one page at a time.
+
+    Arguments:
+        card -- the card object
+    """
+    print(constants.CARD_HISTORY_MSG)
+    before = None
+    while True:
+        entries = db.get_card_history(card.id, before=before)
+        for entry in entries:
+            print(format_history_entry(entry))
+        if len(entries) < constants.HISTORY_PAGE_SIZE:
+            print(constants.CARD_HISTORY_EMPTY_MSG)
+            return
+        # the next page starts right after the last entry shown (keyset pagination)
+        before = (entries[-1][1], entries[-1][0])
+        if str(input(constants.CARD_HISTORY_MORE_MSG)) != '1':
+            return
+
 
 def exit_sbs(message=constants.MENU_EXIT_MSG):
-    """Exit with message and close database connection.
+    """Exit with message, write the final metrics file and close database connection.
     
     Keyword arguments:
-        message -- string to exit with as message (default MENU_EXIT_MSG)
+        message -- string to exit with as message (default MENU_EXIT_MSG; None exits silently)
     """
+    if args.metrics_file:
+        metrics.stop_export(args.metrics_file)
     db.disconnect()
     sys.exit(message)
 
 
+def list_accounts(args):
+    """Stream the accounts matching the `list` command filters as CSV or JSON lines.
+
+    Arguments:
+        args -- the parsed command line arguments
+    """
+    if args.iin is not None and not args.iin.isdigit():
+        # the prefix is matched with LIKE, where % and _ are wildcards
+        print(constants.LIST_IIN_FAIL_MSG)
+        return
+    rows = db.iter_cards(
+        iin_prefix=args.iin,
+        min_balance=args.min_balance,
+        max_balance=args.max_balance,
+        closed={'open': False, 'closed': True}.get(args.status),
+        chunk_size=args.chunk_size
+    )
+    output = open(args.output, 'w', newline='') if args.output else sys.stdout
+    try:
+        if args.format == 'csv':
+            writer = csv.writer(output)
+            writer.writerow(constants.LIST_FIELDS)
+            writer.writerows((row[0], row[1], row[3]) for row in rows)
+        else:
+            for row in rows:
+                output.write(json.dumps(dict(zip(constants.LIST_FIELDS, (row[0], row[1], row[3])))) + '\n')
+    finally:
+        if output is not sys.stdout:
+            output.close()
+
+
+def search_cards(args):
+    """Find accounts by the last digits of their card number (and optionally the first ones), as CSV.
+
+    Arguments:
+        args -- the parsed command line arguments
+    """
+    if not args.suffix.isdigit() or len(args.suffix) < constants.SEARCH_SUFFIX_DIGITS:
+        print(constants.SEARCH_SUFFIX_FAIL_MSG.format(constants.SEARCH_SUFFIX_DIGITS))
+        return
+    if args.prefix is not None and not args.prefix.isdigit():
+        # the prefix is matched with LIKE, where % and _ are wildcards
+        print(constants.SEARCH_PREFIX_FAIL_MSG)
+        return
+    cards = db.search_cards(args.suffix, prefix=args.prefix, closed={'open': False, 'closed': True}.get(args.status),
+                            limit=args.limit)
+    writer = csv.writer(sys.stdout)
+    writer.writerow(constants.SEARCH_FIELDS)
+    writer.writerows((card_id, number, balance, 'open' if closed_at is None else 'closed')
+                     for card_id, number, balance, closed_at in cards)
+
+
+def batch_transfer(args):
+    """Pay every (receiver card number, amount) row of a CSV file from one card in one transaction.
+
+    Arguments:
+        args -- the parsed command line arguments
+    """
+    response = db.get_card_data_by_number(args.number)
+    if not response or response[2] != args.pin:
+        print(constants.LOGIN_FAIL_MSG)
+        return
+    with open(args.file, newline='') as legs_file:
+        # a short row gets an empty amount, which fails that leg only
+        legs = [tuple(value.strip() for value in (row + [''])[:2]) for row in csv.reader(legs_file) if row]
+    writer = csv.writer(sys.stdout)
+    for number, amount, message in db.do_batch_transfer(response[0], legs, idempotency_key=args.key):
+        writer.writerow((number, amount, message.strip()))
+
+
+def settle_transfers(args):
+    """Settle (sender card number, receiver card number, amount) CSV rows in netting windows.
+
+    Arguments:
+        args -- the parsed command line arguments
+    """
+    engine = NettingEngine(db, window=args.window, max_transfers=args.max_transfers)
+    transfers_file = open(args.file, newline='') if args.file else sys.stdin
+    writer = csv.writer(sys.stdout)
+    started = time.monotonic()
+    for row in csv.reader(transfers_file):
+        if row:
+            # a short row gets empty values, which fail that transfer only
+            engine.submit(*(value.strip() for value in (row + ['', ''])[:3]))
+        if engine.is_due():
+            writer.writerows((*result[:3], result[3].strip()) for result in engine.settle())
+    if engine.pending:
+        writer.writerows((*result[:3], result[3].strip()) for result in engine.settle())
+    if args.file:
+        transfers_file.close()
+    elapsed = time.monotonic() - started
+    print(f"{engine.transfers} transfers settled in {elapsed:.2f}s with {engine.row_writes} card row writes "
+          f"({engine.get_write_reduction():.0%} fewer than one transaction per transfer)", file=sys.stderr)
+
+
+def add_schedule(args):
+    """Create a standing order paying a fixed amount from one card to another at a fixed interval.
+
+    Arguments:
+        args -- the parsed command line arguments
+    """
+    response = db.get_card_data_by_number(args.number)
+    if not response or response[2] != args.pin:
+        print(constants.LOGIN_FAIL_MSG)
+        return
+    if args.amount <= 0 or args.interval <= 0:
+        print(constants.POSITIVE_INTEGER_FAIL)
+        return
+    if not check_number(Card(data=response), args.to):
+        return
+    start = args.start if args.start is not None else int(time.time())
+    schedule_id = db.create_schedule_record((response[0], args.to, args.amount, args.interval, start))
+    print(f"Standing order {schedule_id} created")
+
+
+def run_scheduler(args):
+    """Run the standing order scheduler, or only the currently due jobs with --once.
+
+    Arguments:
+        args -- the parsed command line arguments
+    """
+    def report(result):
+        schedule_id, number, amount, message = result
+        print(f"{schedule_id},{number},{amount},{message.strip()}")
+
+    scheduler = Scheduler(db)
+    if args.once:
+        for result in scheduler.run_pending():
+            report(result)
+    else:
+        scheduler.run(report=report)
+
+
+def archive_cards(args):
+    """Archive closed cards and release the freed space, once or periodically.
+
+    Arguments:
+        args -- the parsed command line arguments
+    """
+    if args.enable_incremental_vacuum:
+        db.enable_incremental_vacuum()
+    archiver = Archiver(db, archive_after=args.after)
+
+    def report(archived):
+        print(f"{archived} closed cards archived")
+
+    if args.once:
+        report(archiver.run_once())
+    else:
+        archiver.run(report=report)
+
+
+def issue_cards(args):
+    """Issue many cards at once, optionally writing their numbers and PINs to a CSV file.
+
+    Arguments:
+        args -- the parsed command line arguments
+    """
+    generator = CardGenerator()
+    output = open(args.output, 'w', newline='') if args.output else None
+    writer = csv.writer(output) if output else None
+    pooled = db.issue_pool_cards(args.count)
+    if writer:
+        writer.writerows(card[1:3] for card in pooled)
+    issued = len(pooled)
+    while issued < args.count:
+        rows = generator.generate_rows(min(constants.ISSUE_BATCH_SIZE, args.count - issued))
+        taken = db.get_card_ids_by_numbers(row[0] for row in rows)
+        rows = [row for row in rows if row[0] not in taken]
+        db.create_card_records(rows)
+        if writer:
+            writer.writerows(row[:2] for row in rows)
+        issued += len(rows)
+    if output:
+        output.close()
+    print(f"{issued} cards issued")
+
+
+def fill_card_pool(args):
+    """Keep the card number pool above its low watermark, reporting the pool metrics as JSON.
+
+    Arguments:
+        args -- the parsed command line arguments
+    """
+    pool = CardNumberPool(db, low_watermark=args.low_watermark, target=args.target)
+
+    def report(metrics):
+        print(json.dumps(metrics), flush=True)
+
+    if args.once:
+        pool.refill()
+        report(pool.get_metrics())
+    else:
+        pool.run(interval=args.interval, report=report)
+
+
+def set_hot_card(args):
+    """Mark a card as hot (its credits are spread over balance shards), or as regular again with --shards 0.
+
+    Arguments:
+        args -- the parsed command line arguments
+    """
+    response = db.get_card_data_by_number(args.number)
+    if not response or not db.set_card_balance_shards(response[0], args.shards):
+        print(constants.CARD_TRANSFER_NUMBER_NONEXISTENT)
+        return
+    print(f"Card {args.number} has {min(args.shards, constants.HOT_CARD_MAX_SHARDS)} balance shards")
+
+
+def convert_layout(args):
+    """Rebuild the card table in the text or the compact layout.
+
+    Arguments:
+        args -- the parsed command line arguments
+    """
+    started = time.monotonic()
+    if not db.convert_card_layout(args.layout):
+        print(constants.CARD_LAYOUT_BLOCKED_MSG.format(db.count_layout_blockers(args.layout), args.layout))
+        return
+    print(f"Card table in the {db.layout} layout ({time.monotonic() - started:.2f}s)")
+
+
+def migrate_database(args):
+    """Apply the pending schema migrations, or only estimate them with --dry-run.
+
+    Arguments:
+        args -- the parsed command line arguments
+    """
+    migrator = Migrator(db, chunk_size=args.chunk_size, pause=args.pause)
+    if args.dry_run:
+        print(f"Schema version {db.get_schema_version()}")
+        for estimate in migrator.estimate():
+            print(f"{estimate['version']}. {estimate['name']}: {estimate['ids']} card ids in {estimate['chunks']} "
+                  f"chunks, about {estimate['seconds']}s")
+        return
+
+    def report(migration, last_id, max_id):
+        if last_id is None:
+            print(f"{migration.version}. {migration.name}: done", flush=True)
+        else:
+            print(f"{migration.version}. {migration.name}: {last_id}/{max_id}", flush=True)
+
+    migrator.run(report=report)
+    db.create_card_number_index()
+    print(f"Schema version {db.get_schema_version()}")
+
+
+def backup_database(args):
+    """Take an online backup in the background, reporting its progress and the lookup latency it adds.
+
+    Arguments:
+        args -- the parsed command line arguments
+    """
+    numbers = [row[1] for row in itertools.islice(db.iter_cards(closed=False), constants.LIST_CHUNK_SIZE)]
+    baseline_until = time.monotonic() + 1
+    baseline = probe_latency(db, numbers, lambda: time.monotonic() < baseline_until) if numbers else []
+
+    task = BackupTask(db, args.target, pages=args.pages, sleep=args.sleep)
+    task.start()
+    next_report = time.monotonic()
+
+    def keep_going():
+        nonlocal next_report
+        if time.monotonic() >= next_report and task.total:
+            print(f"backup: {task.copied}/{task.total} pages", file=sys.stderr)
+            next_report = time.monotonic() + 1
+        return task.is_running()
+
+    during = probe_latency(db, numbers, keep_going) if numbers else []
+    task.join()
+    if task.error is not None:
+        print(f"backup failed: {task.error!r}")
+        return
+    print(f"backup of {task.total} pages written to {args.target} in {task.finished_at - task.started_at:.2f}s "
+          f"({task.restarts} restarts)")
+    for name, share in (('p50', 50), ('p99', 99)):
+        print(f"lookup {name}: {percentile(baseline, share) * 1000:.3f}ms before, "
+              f"{percentile(during, share) * 1000:.3f}ms during the backup")
+
+
+def adjust_balances(args):
+    """Apply interest and fees to every open card, resuming the job if it was interrupted.
+
+    Arguments:
+        args -- the parsed command line arguments
+    """
+    job = BalanceAdjustmentJob(db, args.job_id, rate_bp=args.rate_bp, fee=args.fee, time_budget=args.budget)
+    started = time.monotonic()
+    finished, changed, total = job.run()
+    state = 'finished' if finished else 'stopped at the time budget, run again to resume'
+    print(f"{args.job_id}: {changed} cards changed by {total} in {time.monotonic() - started:.1f}s ({state})")
+
+
+def reconcile_cards(args):
+    """Check every card row and the total balance in parallel, printing a JSON report.
+
+    The workers read at different times, so they all check an online backup taken first:
+    the card rows, the balance shards and the archive come from one consistent snapshot
+    while the live database keeps serving traffic.
+
+    Arguments:
+        args -- the parsed command line arguments
+    """
+    started = time.monotonic()
+    with tempfile.TemporaryDirectory() as directory:
+        snapshot = os.path.join(directory, constants.RECONCILE_SNAPSHOT_FILE)
+        db.backup(snapshot)
+        report = reconcile(snapshot, chunk_size=args.chunk_size, workers=args.workers, expected_total=args.expected)
+    report["seconds"] = round(time.monotonic() - started, 3)
+    print(json.dumps(report, indent=2))
+
+
+def get_month_period(month):
+    """Return the (start, end) UNIX times of a YYYY-MM month in UTC, the previous month if `month` is None."""
+    if month is None:
+        today = time.gmtime()
+        year, number = (today.tm_year, today.tm_mon - 1) if today.tm_mon > 1 else (today.tm_year - 1, 12)
+    else:
+        year, number = (int(part) for part in month.split('-'))
+    next_year, next_number = (year, number + 1) if number < 12 else (year + 1, 1)
+    return calendar.timegm((year, number, 1, 0, 0, 0)), calendar.timegm((next_year, next_number, 1, 0, 0, 0))
+
+
+def write_statements(args):
+    """Write the statement file of every card for a month in parallel, resuming an interrupted run.
+
+    Arguments:
+        args -- the parsed command line arguments
+    """
+    try:
+        period_start, period_end = get_month_period(args.month)
+    except ValueError:
+        print(constants.STATEMENT_MONTH_FAIL_MSG)
+        return
+    if constants.STATEMENT_MIGRATION not in db.get_applied_migrations():
+        # without the opening entries, the history of the older cards doesn't add up to their balance
+        print(constants.STATEMENT_MIGRATION_FAIL_MSG.format(constants.STATEMENT_MIGRATION))
+        return
+    if in_memory:
+        # the workers read the database file
+        db.checkpoint()
+
+    def report(statements, done, ranges):
+        print(f"statements: {done}/{ranges} ranges, {statements} statements", file=sys.stderr, flush=True)
+
+    result = generate_statements(db.db_file, args.output, period_start, period_end, chunk_size=args.chunk_size,
+                                 workers=args.workers, report=report)
+    print(json.dumps(result, indent=2))
+
+
+def get_argument_parser():
+    """Return the command line parser; running without a command starts the interactive menu."""
+    parser = argparse.ArgumentParser(description='Simple banking system')
+    parser.add_argument('--backend', choices=constants.STORAGE_BACKENDS, default=constants.STORAGE_BACKEND,
+                        help='storage engine; memory keeps nothing once the program exits')
+    parser.add_argument('--in-memory', action='store_true',
+                        help='sqlite only: serve everything from RAM and checkpoint to the database file')
+    parser.add_argument('--checkpoint-interval', type=float, default=constants.CHECKPOINT_INTERVAL_SECONDS,
+                        help='seconds between two checkpoints with --in-memory')
+    parser.add_argument('--jsonl', action='store_true',
+                        help='read one JSON command per standard input line, write one JSON result per line')
+    parser.add_argument('--jsonl-card-limit', type=int, default=constants.VELOCITY_CARD_LIMIT,
+                        help='--jsonl: balance operations per card per velocity window, 0 for no limit')
+    parser.add_argument('--jsonl-global-limit', type=int, default=constants.VELOCITY_GLOBAL_LIMIT,
+                        help='--jsonl: balance operations of all cards per velocity window, 0 for no limit')
+    parser.add_argument('--metrics-file',
+                        help='write operation latencies and outcomes to this file, in the Prometheus text format')
+    parser.add_argument('--metrics-interval', type=float, default=constants.METRICS_EXPORT_INTERVAL_SECONDS,
+                        help='seconds between two writes of the metrics file')
+    commands = parser.add_subparsers(dest='command')
+
+    list_parser = commands.add_parser('list', help='list and filter accounts')
+    list_parser.add_argument('--iin', help='only accounts whose card number starts with this prefix')
+    list_parser.add_argument('--min-balance', type=int, help='only accounts with at least this balance')
+    list_parser.add_argument('--max-balance', type=int, help='only accounts with at most this balance')
+    list_parser.add_argument('--status', choices=('open', 'closed', 'all'), default='all')
+    list_parser.add_argument('--format', choices=constants.LIST_FORMATS, default='csv')
+    list_parser.add_argument('--output', help='output file (default: standard output)')
+    list_parser.add_argument('--chunk-size', type=int, default=constants.LIST_CHUNK_SIZE)
+    list_parser.set_defaults(handler=list_accounts)
+
+    search_parser = commands.add_parser('search', help='find accounts by the last digits of their card number')
+    search_parser.add_argument('suffix', help=f'the last digits of the card number, at least {constants.SEARCH_SUFFIX_DIGITS}')
+    search_parser.add_argument('--prefix', help='the first digits of the card number, e.g. the MII and IIN (400000)')
+    search_parser.add_argument('--status', choices=('open', 'closed', 'all'), default='all')
+    search_parser.add_argument('--limit', type=int, default=constants.SEARCH_LIMIT,
+                               help=f'the maximum number of accounts, at most {constants.SEARCH_MAX_LIMIT}')
+    search_parser.set_defaults(handler=search_cards)
+
+    batch_parser = commands.add_parser('transfer-batch', help='pay many receivers from one card at once')
+    batch_parser.add_argument('--number', required=True, help='the sender card number')
+    batch_parser.add_argument('--pin', required=True, help='the sender card PIN')
+    batch_parser.add_argument('--file', required=True, help='CSV file with one receiver,amount row per leg')
+    batch_parser.add_argument('--key', help='idempotency key; retrying with the same key never pays twice')
+    batch_parser.set_defaults(handler=batch_transfer)
+
+    settle_parser = commands.add_parser('settle', help='settle many transfers as net balance changes per window')
+    settle_parser.add_argument('--file', help='CSV file with one sender,receiver,amount row per transfer '
+                                              '(default: standard input)')
+    settle_parser.add_argument('--window', type=float, default=constants.SETTLEMENT_WINDOW_SECONDS,
+                               help='seconds transfers are collected before they are settled')
+    settle_parser.add_argument('--max-transfers', type=int, default=constants.SETTLEMENT_MAX_TRANSFERS,
+                               help='collected transfers that settle the window early')
+    settle_parser.set_defaults(handler=settle_transfers)
+
+    schedule_parser = commands.add_parser('schedule', help='create a standing order')
+    schedule_parser.add_argument('--number', required=True, help='the sender card number')
+    schedule_parser.add_argument('--pin', required=True, help='the sender card PIN')
+    schedule_parser.add_argument('--to', required=True, help='the receiver card number')
+    schedule_parser.add_argument('--amount', required=True, type=int)
+    schedule_parser.add_argument('--interval', type=int, default=constants.SCHEDULE_DEFAULT_INTERVAL_SECONDS,
+                                 help='seconds between two runs')
+    schedule_parser.add_argument('--start', type=int, help='UNIX time of the first run (default: now)')
+    schedule_parser.set_defaults(handler=add_schedule)
+
+    scheduler_parser = commands.add_parser('scheduler', help='run the standing order scheduler')
+    scheduler_parser.add_argument('--once', action='store_true', help='only run the jobs due now, then exit')
+    scheduler_parser.set_defaults(handler=run_scheduler)
+
+    archive_parser = commands.add_parser('archive', help='archive closed cards in the background')
+    archive_parser.add_argument('--after', type=int, default=constants.ARCHIVE_AFTER_SECONDS,
+                                help='seconds a closed card is kept in the card table')
+    archive_parser.add_argument('--once', action='store_true', help='run a single archiving pass, then exit')
+    archive_parser.add_argument('--enable-incremental-vacuum', action='store_true',
+                                help='switch an existing database file to incremental vacuum first (full VACUUM)')
+    archive_parser.set_defaults(handler=archive_cards)
+
+    issue_parser = commands.add_parser('issue', help='issue many cards at once')
+    issue_parser.add_argument('--count', required=True, type=int)
+    issue_parser.add_argument('--output', help='CSV file receiving the number,pin of every issued card')
+    issue_parser.set_defaults(handler=issue_cards)
+
+    pool_parser = commands.add_parser('pool', help='keep the pre-generated card number pool filled')
+    pool_parser.add_argument('--low-watermark', type=int, default=constants.CARD_POOL_LOW_WATERMARK,
+                             help='pool depth under which the pool is refilled')
+    pool_parser.add_argument('--target', type=int, default=constants.CARD_POOL_TARGET_SIZE,
+                             help='pool depth a refill stops at')
+    pool_parser.add_argument('--interval', type=float, default=constants.CARD_POOL_CHECK_INTERVAL_SECONDS,
+                             help='seconds between two pool depth checks')
+    pool_parser.add_argument('--once', action='store_true', help='check and refill the pool once, then exit')
+    pool_parser.set_defaults(handler=fill_card_pool)
+
+    hot_parser = commands.add_parser('hot', help='spread the credits of a busy receiving card over balance shards')
+    hot_parser.add_argument('--number', required=True, help='the card number')
+    hot_parser.add_argument('--shards', type=int, default=constants.HOT_CARD_DEFAULT_SHARDS,
+                            help=f'balance shards, at most {constants.HOT_CARD_MAX_SHARDS}; 0 makes the card regular again')
+    hot_parser.set_defaults(handler=set_hot_card)
+
+    migrate_parser = commands.add_parser('migrate', help='apply the pending schema migrations while traffic goes on')
+    migrate_parser.add_argument('--dry-run', action='store_true',
+                                help='only list the pending migrations with an estimated duration')
+    migrate_parser.add_argument('--chunk-size', type=int, default=constants.MIGRATION_CHUNK_SIZE,
+                                help='card ids backfilled per transaction')
+    migrate_parser.add_argument('--pause', type=float, default=constants.MIGRATION_PAUSE_SECONDS,
+                                help='seconds between two backfill chunks')
+    migrate_parser.set_defaults(handler=migrate_database, sqlite_only=True)
+
+    layout_parser = commands.add_parser('layout', help='rebuild the card table in another storage layout')
+    layout_parser.add_argument('layout', choices=constants.CARD_LAYOUTS,
+                               help='text: the original table; compact: integer numbers and PINs, clustered on the number')
+    layout_parser.set_defaults(handler=convert_layout, sqlite_only=True)
+
+    backup_parser = commands.add_parser('backup', help='take an online backup without stopping traffic')
+    backup_parser.add_argument('target', help='the backup file')
+    backup_parser.add_argument('--pages', type=int, default=constants.BACKUP_PAGES_PER_STEP,
+                               help='pages copied per step')
+    backup_parser.add_argument('--sleep', type=float, default=constants.BACKUP_SLEEP_SECONDS,
+                               help='seconds between two steps')
+    backup_parser.set_defaults(handler=backup_database, sqlite_only=True)
+
+    interest_parser = commands.add_parser('interest', help='apply interest and fees to every open card')
+    interest_parser.add_argument('job_id', help='a unique job id, e.g. interest-2026-10; rerun it to resume')
+    interest_parser.add_argument('--rate-bp', type=int, default=0, help='interest rate in basis points')
+    interest_parser.add_argument('--fee', type=int, default=0, help='flat fee per card')
+    interest_parser.add_argument('--budget', type=float, default=constants.ADJUSTMENT_TIME_BUDGET_SECONDS,
+                                 help='seconds after which the job stops, to be resumed later')
+    interest_parser.set_defaults(handler=adjust_balances, sqlite_only=True)
+
+    reconcile_parser = commands.add_parser('reconcile', help='check balances and card rows for anomalies')
+    reconcile_parser.add_argument('--expected', type=int, help='the total money the bank should hold')
+    reconcile_parser.add_argument('--chunk-size', type=int, default=constants.RECONCILE_CHUNK_SIZE,
+                                  help='card ids checked per worker task')
+    reconcile_parser.add_argument('--workers', type=int, help='worker processes (default: one per core)')
+    reconcile_parser.set_defaults(handler=reconcile_cards, sqlite_only=True)
+
+    statements_parser = commands.add_parser('statements', help='write a statement file per card for a month')
+    statements_parser.add_argument('--month', help='the YYYY-MM month, in UTC (default: the previous month)')
+    statements_parser.add_argument('--output', required=True,
+                                   help='the statements directory; rerun with the same one to resume')
+    statements_parser.add_argument('--chunk-size', type=int, default=constants.STATEMENT_CHUNK_SIZE,
+                                   help='card ids per worker task')
+    statements_parser.add_argument('--workers', type=int, help='worker processes (default: one per core)')
+    statements_parser.set_defaults(handler=write_statements, sqlite_only=True)
+
+    return parser
+
+
+argument_parser = get_argument_parser()
+args = argument_parser.parse_args()
+# these commands work on the SQLite file itself: its schema, its pages or its read-only connections
+if getattr(args, 'sqlite_only', False) and args.backend != 'sqlite':
+    argument_parser.error(constants.SQLITE_ONLY_COMMAND_MSG.format(args.command, args.backend))
+db = get_backend(args.backend)
+in_memory = args.in_memory and args.backend == 'sqlite'
+if in_memory:
+    db.in_memory = True
+    db.checkpoint_interval = args.checkpoint_interval
+# the migrate command applies (or only estimates) the migrations itself
+db.auto_migrate = args.command != 'migrate'
+db.connect()
+if in_memory:
+    print(constants.CHECKPOINT_REPORT_MSG.format(db.get_data_loss_window()), file=sys.stderr)
+if args.metrics_file:
+    metrics.start_export(args.metrics_file, interval=args.metrics_interval)
+if args.command:
+    args.handler(args)
+    exit_sbs(None)
+if args.jsonl:
+    jsonl_velocity = None
+    if args.jsonl_card_limit or args.jsonl_global_limit:
+        jsonl_velocity = VelocityLimiter(card_limit=args.jsonl_card_limit or math.inf,
+                                         global_limit=args.jsonl_global_limit or math.inf)
+    JsonLinesServer(db, jsonl_velocity, login_throttle, metrics=metrics).run(sys.stdin, sys.stdout)
+    exit_sbs(None)
+
+
 while selected_option not in range(0, 3):
     while selected_option != 0:        
         if logged_in == -1:
@@ -0,0 +1,66 @@
+import contextlib
+import io
+import os
+import tempfile
+import unittest
+import constants
+from classes.card import Card
+from classes.database import Database
+
+
+class CardLayoutTest(unittest.TestCase):
+    """Convert the card table between the text and the compact layouts."""
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.db = Database()
+        self.db.db_file = os.path.join(self.directory.name, "card.s3db")
+        self.connect()
+        self.numbers = [Card(checksum_type="luhn").number for _ in range(3)]
+        self.db.create_card_records([(number, pin, 0) for number, pin in zip(self.numbers, ("0042", "1234", "9999"))])
+        self.db.add_income(2, 70)
+        self.db.close_card_record(3)
+
+    def tearDown(self):
+        self.db.disconnect()
+        self.directory.cleanup()
+
+    def connect(self):
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.db.connect()
+
+    def get_cards(self):
+        return [row for row in self.db.iter_cards()]
+
+    def test_round_trip(self):
+        cards = self.get_cards()
+        self.assertTrue(self.db.convert_card_layout("compact"))
+        self.assertEqual(self.db.get_card_layout(), "compact")
+        self.assertEqual(self.get_cards(), cards)
+        self.assertEqual(self.db.get_card_data_by_number(self.numbers[0])[:3], (1, self.numbers[0], "0042"))
+        self.assertEqual([card[1] for card in self.db.search_cards(self.numbers[1][-4:])], [self.numbers[1]])
+
+        # the layout is read back from the schema when connecting again
+        self.db.disconnect()
+        self.connect()
+        self.assertEqual(self.db.layout, "compact")
+        number = Card(checksum_type="luhn").number
+        self.db.create_card_record((number, "0007", 0))
+        self.assertEqual(self.db.get_card_data_by_number(number)[:3], (4, number, "0007"))
+
+        self.assertTrue(self.db.convert_card_layout("text"))
+        self.assertEqual(self.db.get_card_layout(), "text")
+        self.assertEqual(self.get_cards()[:3], cards)
+        self.assertEqual(self.db.do_batch_transfer(2, [(self.numbers[0], 20)])[0][2],
+                         constants.CARD_TRANSFER_AMOUNT_SUCCESS)
+
+    def test_blocked_conversion_changes_nothing(self):
+        self.db.create_card_record(("0123456789012345", "1234", 0))
+        self.assertEqual(self.db.count_layout_blockers("compact"), 1)
+        self.assertFalse(self.db.convert_card_layout("compact"))
+        self.assertEqual(self.db.get_card_layout(), "text")
+        self.assertEqual(len(self.get_cards()), 4)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,74 @@
+import io
+import json
+import unittest
+from classes.jsonl import JsonLinesServer
+from classes.memory_database import MemoryDatabase
+from classes.throttle import LoginThrottle
+from classes.velocity import VelocityLimiter
+
+
+class JsonLinesServerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.db = MemoryDatabase()
+        self.db.connect()
+        self.server = JsonLinesServer(self.db, None, LoginThrottle())
+
+    def serve(self, commands):
+        """Run the server on the given command objects and return its result objects."""
+        output = io.StringIO()
+        self.server.run(io.StringIO(''.join(json.dumps(command) + '\n' for command in commands)), output)
+        return [json.loads(line) for line in output.getvalue().splitlines()]
+
+    def test_bad_op_between_valid_commands(self):
+        results = self.serve([{"op": "create"}, {"op": []}, {"op": {}}, {"op": 1}, {"op": "create"}])
+        self.assertEqual([result["ok"] for result in results], [True, False, False, False, True])
+        self.assertIn("number", results[-1])
+
+    def test_pipelined_commands_are_written_together(self):
+        class CountingOutput(io.StringIO):
+            writes = 0
+
+            def write(self, text):
+                self.writes += 1
+                return super().write(text)
+
+        output = CountingOutput()
+        data = ''.join(json.dumps({"op": "balance", "number": "1", "pin": "1"}) + '\n' for _ in range(200))
+        served = self.server.run(io.TextIOWrapper(io.BytesIO(data.encode())), output)
+        self.assertEqual(served, 200)
+        self.assertEqual(output.writes, 1)
+        self.assertEqual(len(output.getvalue().splitlines()), 200)
+
+    def test_last_line_without_line_break(self):
+        output = io.StringIO()
+        self.server.run(io.StringIO('{"op": "create"}\n{"op": "create"}'), output)
+        self.assertEqual(len(output.getvalue().splitlines()), 2)
+
+    def test_income_and_balance(self):
+        created, = self.serve([{"op": "create"}])
+        card = {"number": created["number"], "pin": created["pin"]}
+        results = self.serve([{"op": "income", "amount": 100, **card}, {"op": "balance", **card},
+                              {"op": "balance", "number": card["number"], "pin": "x"}])
+        self.assertEqual(results[:2], [{"ok": True}, {"ok": True, "balance": 100}])
+        self.assertFalse(results[2]["ok"])
+
+    def test_wrong_pin_does_not_use_the_velocity_budget(self):
+        self.server.velocity = VelocityLimiter(card_limit=2, global_limit=3)
+        self.server.throttle = LoginThrottle(threshold=100)
+        created, = self.serve([{"op": "create"}])
+        card = {"number": created["number"], "pin": created["pin"]}
+        attacks = [{"op": "income", "amount": 1, "number": card["number"], "pin": "x"}] * 5
+        results = self.serve(attacks + [{"op": "income", "amount": 1, **card}] * 3)
+        self.assertEqual([result["ok"] for result in results[5:]], [True, True, False])
+
+    def test_history_limit_is_clamped(self):
+        created, = self.serve([{"op": "create"}])
+        card = {"number": created["number"], "pin": created["pin"]}
+        results = self.serve([{"op": "income", "amount": 1, **card}, {"op": "income", "amount": 2, **card},
+                              {"op": "history", "limit": 0, **card}, {"op": "history", "limit": -1, **card}])
+        self.assertEqual([len(result["entries"]) for result in results[2:]], [1, 1])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,76 @@
+import contextlib
+import glob
+import io
+import os
+import sqlite3
+import tempfile
+import time
+import unittest
+import constants
+from classes.card import Card
+from classes.database import Database
+from classes.migrations import Migrator
+from classes.statements import write_statement_range
+
+
+class MigrationTest(unittest.TestCase):
+    """Migrate a database created by the first version of the banking system."""
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.db_file = os.path.join(self.directory.name, "card.s3db")
+        self.numbers = [Card(checksum_type="luhn").number for _ in range(2)]
+        connection = sqlite3.connect(self.db_file)
+        connection.execute(''' CREATE TABLE card (id integer PRIMARY KEY, number text NOT NULL, pin text NOT NULL,
+                               balance integer default 0) ''')
+        connection.executemany("INSERT INTO card(number, pin, balance) VALUES(?, '1234', ?)",
+                               [(self.numbers[0], 1000), (self.numbers[1], 0)])
+        connection.commit()
+        connection.close()
+        self.db = Database()
+        self.db.db_file = self.db_file
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.db.connect()
+
+    def tearDown(self):
+        self.db.disconnect()
+        self.directory.cleanup()
+
+    def test_backfill_is_left_to_run(self):
+        self.assertEqual(self.db.get_schema_version(), 2)
+        self.assertEqual([migration.version for migration in Migrator(self.db).get_pending()], [3, 4])
+        Migrator(self.db, pause=0).run()
+        self.assertEqual(self.db.get_schema_version(), 4)
+        self.assertEqual(Migrator(self.db).get_pending(), [])
+
+    def test_new_database_is_fully_migrated(self):
+        db = Database()
+        db.db_file = os.path.join(self.directory.name, "new.s3db")
+        with contextlib.redirect_stdout(io.StringIO()):
+            db.connect()
+        self.assertEqual(db.get_schema_version(), 4)
+        db.disconnect()
+
+    def test_statement_after_migration(self):
+        started = int(time.time())
+        self.db.do_batch_transfer(1, [(self.numbers[1], 100)])
+        Migrator(self.db, pause=0).run()
+        history = self.db.get_card_history(1)
+        self.assertEqual([entry[2:4] for entry in reversed(history)],
+                         [(1000, constants.HISTORY_OPENING), (-100, constants.HISTORY_TRANSFER)])
+        self.assertLess(history[1][1], history[0][1])
+
+        output_dir = os.path.join(self.directory.name, "statements")
+        write_statement_range(self.db_file, output_dir, 1, 2, started - 60, started + 60)
+        first, second = (open(path).read() for path in sorted(glob.glob(os.path.join(output_dir, "*", "*.txt"))))
+        self.assertIn("Opening balance: 0\n", first)
+        self.assertIn("Closing balance: 900\n", first)
+        self.assertIn("Closing balance: 100\n", second)
+        # a statement of the time after the migration opens with the migrated balance
+        write_statement_range(self.db_file, output_dir + "-later", 1, 1, started + 60, started + 120)
+        later, = (open(path).read() for path in glob.glob(os.path.join(output_dir + "-later", "*", "*.txt")))
+        self.assertIn("Opening balance: 900\n", later)
+
+
+if __name__ == "__main__":
+    unittest.main()
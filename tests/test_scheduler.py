@@ -0,0 +1,88 @@
+import contextlib
+import io
+import os
+import tempfile
+import unittest
+import constants
+from classes.card import Card
+from classes.database import Database
+from classes.memory_database import MemoryDatabase
+from classes.scheduler import Scheduler
+
+NOW = 1790000000
+INTERVAL = 60
+
+
+class SchedulerTest(unittest.TestCase):
+    """Run the scheduler on both storage engines."""
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        sqlite = Database()
+        sqlite.db_file = os.path.join(self.directory.name, "card.s3db")
+        with contextlib.redirect_stdout(io.StringIO()):
+            sqlite.connect()
+        memory = MemoryDatabase()
+        memory.connect()
+        self.engines = (sqlite, memory)
+        self.numbers = [Card(checksum_type="luhn").number for _ in range(3)]
+        for db in self.engines:
+            db.create_card_records([(number, "1234", 0) for number in self.numbers])
+
+    def tearDown(self):
+        for db in self.engines:
+            db.disconnect()
+        self.directory.cleanup()
+
+    def run_scheduler(self, db, now=NOW):
+        """Run the jobs due at `now` and return the (standing order id, amount, result) of every run."""
+        return [(schedule_id, amount, message) for schedule_id, number, amount, message
+                in Scheduler(db).run_pending(now)]
+
+    def get_next_runs(self, db):
+        return {schedule[1]: schedule[0] for schedule in db.get_schedules_due_before(NOW * 2)}
+
+    def test_affordable_order_is_paid_when_another_is_not(self):
+        for db in self.engines:
+            db.add_income(1, 500)
+            db.create_schedule_record((1, self.numbers[1], 1000, INTERVAL, NOW))
+            db.create_schedule_record((1, self.numbers[2], 10, INTERVAL, NOW))
+            self.assertEqual(sorted(self.run_scheduler(db)), [(1, 1000, constants.CARD_TRANSFER_AMOUNT_FAIL),
+                                                              (2, 10, constants.CARD_TRANSFER_AMOUNT_SUCCESS)])
+            self.assertEqual(db.get_card_balances([1, 2, 3]), {1: 490, 2: 0, 3: 10})
+            # the unpaid run stays due, the paid one moves to the next interval
+            self.assertEqual(self.get_next_runs(db), {1: NOW, 2: NOW + INTERVAL})
+
+    def test_catch_up_runs_are_paid_while_the_money_lasts(self):
+        first_run = NOW - 11 * INTERVAL
+        for db in self.engines:
+            db.add_income(1, 50)
+            db.create_schedule_record((1, self.numbers[1], 10, INTERVAL, first_run))
+            results = self.run_scheduler(db)
+            self.assertEqual([message for schedule_id, amount, message in results],
+                             [constants.CARD_TRANSFER_AMOUNT_SUCCESS] * 5 + [constants.CARD_TRANSFER_AMOUNT_FAIL])
+            self.assertEqual(db.get_card_balances([1, 2]), {1: 0, 2: 50})
+            self.assertEqual(self.get_next_runs(db), {1: first_run + 5 * INTERVAL})
+            # the money came in: the runs left are paid on the next round
+            db.add_income(1, 100)
+            self.assertEqual(len(self.run_scheduler(db, NOW + 1)), 7)
+            self.assertEqual(db.get_card_balances([1, 2]), {1: 30, 2: 120})
+            self.assertEqual(self.get_next_runs(db), {1: NOW + INTERVAL})
+
+    def test_closed_receiver_skips_the_run(self):
+        for db in self.engines:
+            db.add_income(1, 50)
+            db.create_schedule_record((1, self.numbers[1], 10, INTERVAL, NOW))
+            db.close_card_record(2)
+            self.assertEqual(self.run_scheduler(db), [(1, 10, constants.CARD_TRANSFER_NUMBER_NONEXISTENT)])
+            self.assertEqual(self.get_next_runs(db), {1: NOW + INTERVAL})
+
+    def test_order_without_interval_is_never_run(self):
+        for db in self.engines:
+            db.add_income(1, 50)
+            db.create_schedule_record((1, self.numbers[1], 10, 0, NOW))
+            self.assertEqual(self.run_scheduler(db), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,59 @@
+import contextlib
+import glob
+import io
+import os
+import tempfile
+import time
+import unittest
+from classes.card import Card
+from classes.database import Database
+from classes.statements import generate_statements
+
+
+class StatementsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.db = Database()
+        self.db.db_file = os.path.join(self.directory.name, "card.s3db")
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.db.connect()
+        self.output_dir = os.path.join(self.directory.name, "statements")
+        self.period = (int(time.time()) - 60, int(time.time()) + 60)
+
+    def tearDown(self):
+        self.db.disconnect()
+        self.directory.cleanup()
+
+    def add_cards(self, count):
+        self.db.create_card_records([(Card(checksum_type="luhn").number, "1234", 0) for _ in range(count)])
+
+    def get_statement_files(self):
+        return glob.glob(os.path.join(self.output_dir, "*", "*.txt"))
+
+    def test_one_statement_per_card(self):
+        self.add_cards(15)
+        result = generate_statements(self.db.db_file, self.output_dir, *self.period, chunk_size=10, workers=1)
+        self.assertEqual((result["statements"], result["ranges"]), (15, 2))
+        self.assertEqual(len(self.get_statement_files()), 15)
+
+    def test_resume_after_new_cards(self):
+        self.add_cards(15)
+        generate_statements(self.db.db_file, self.output_dir, *self.period, chunk_size=10, workers=1)
+        self.add_cards(3)
+        result = generate_statements(self.db.db_file, self.output_dir, *self.period, chunk_size=10, workers=1)
+        self.assertEqual((result["statements"], result["skipped_ranges"]), (0, 2))
+        self.assertEqual(len(self.get_statement_files()), 15)
+        self.assertEqual(len(os.listdir(self.output_dir)), 3)
+
+    def test_closed_and_reissued_numbers_get_their_own_statement(self):
+        number = Card(checksum_type="luhn").number
+        self.db.create_card_record((number, "1234", 0))
+        self.db.close_card_record(1)
+        self.db.create_card_record((number, "4321", 0))
+        generate_statements(self.db.db_file, self.output_dir, *self.period, workers=1)
+        self.assertEqual(len(self.get_statement_files()), 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,107 @@
+import os
+import tempfile
+import unittest
+import contextlib
+import io
+import constants
+from classes.card import Card
+from classes.database import Database
+from classes.memory_database import MemoryDatabase
+from classes.storage import StorageBackend
+
+
+class StorageParityTest(unittest.TestCase):
+    """Run the same operations on both storage engines and compare what they return."""
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.sqlite = Database()
+        self.sqlite.db_file = os.path.join(self.directory.name, "card.s3db")
+        self.memory = MemoryDatabase()
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.sqlite.connect()
+        self.memory.connect()
+        self.numbers = []
+        for _ in range(3):
+            self.numbers.append(Card(checksum_type="luhn").number)
+        for db in self.engines():
+            db.create_card_records([(number, "1234", 0) for number in self.numbers])
+
+    def tearDown(self):
+        self.sqlite.disconnect()
+        self.memory.disconnect()
+        self.directory.cleanup()
+
+    def engines(self):
+        return self.sqlite, self.memory
+
+    def test_memory_engine_implements_the_interface(self):
+        operations = [name for name, value in vars(StorageBackend).items() if callable(value) and name[0] != "_"]
+        self.assertEqual([name for name in operations if name not in vars(MemoryDatabase)], [])
+
+    def assertSame(self, operation):
+        """Run an operation on both engines and check they return the same result."""
+        expected, actual = (operation(db) for db in self.engines())
+        self.assertEqual(expected, actual)
+        return expected
+
+    def test_income_and_transfers(self):
+        self.assertSame(lambda db: db.add_income(1, 100))
+        self.assertSame(lambda db: db.add_income(1, "-5"))
+        results = self.assertSame(lambda db: db.do_batch_transfer(1, [(self.numbers[1], 30), (self.numbers[2], 20)]))
+        self.assertEqual([result for number, amount, result in results], [constants.CARD_TRANSFER_AMOUNT_SUCCESS] * 2)
+        self.assertSame(lambda db: db.do_batch_transfer(1, [(self.numbers[1], 60)]))
+        self.assertSame(lambda db: db.do_batch_transfer(1, [(self.numbers[0], 1)]))
+        self.assertEqual(self.assertSame(lambda db: db.get_card_balances([1, 2, 3])), {1: 50, 2: 30, 3: 20})
+
+    def test_income_past_the_largest_balance(self):
+        self.assertSame(lambda db: db.add_income(1, 12345678901234567890123))
+        self.assertSame(lambda db: db.add_income(1, constants.MAX_BALANCE - 1))
+        self.assertEqual(self.assertSame(lambda db: db.add_income(1, 2)), constants.CARD_ADD_INCOME_FAIL)
+        self.assertEqual(self.assertSame(lambda db: db.add_income(1, 1)), constants.CARD_ADD_INCOME_SUCCESS)
+        self.assertEqual(self.assertSame(lambda db: db.get_card_balances([1])), {1: constants.MAX_BALANCE})
+
+    def test_history(self):
+        for db in self.engines():
+            db.add_income(1, 100)
+            db.do_batch_transfer(1, [(self.numbers[1], 40)])
+        entries = self.assertSame(lambda db: [entry[2:] for entry in db.get_card_history(1)])
+        self.assertEqual(entries, [(-40, constants.HISTORY_TRANSFER, self.numbers[1]),
+                                   (100, constants.HISTORY_INCOME, None)])
+        self.assertSame(lambda db: [entry[2:] for entry in db.get_card_history(2)])
+
+    def test_close_card_deactivates_its_schedules(self):
+        for db in self.engines():
+            db.create_schedule_record((1, self.numbers[1], 10, 60, 0))
+            db.create_schedule_record((2, self.numbers[0], 10, 60, 0))
+            db.close_card_record(1)
+        due = self.assertSame(lambda db: [schedule[1:] for schedule in db.get_schedules_due_before(1)])
+        self.assertEqual(due, [(2, 2, self.numbers[0], 10, 60)])
+        self.assertSame(lambda db: db.get_card_data_by_id(1))
+
+    def test_transfer_to_closed_card(self):
+        for db in self.engines():
+            db.add_income(1, 100)
+            db.close_card_record(2)
+        results = self.assertSame(lambda db: db.do_batch_transfer(1, [(self.numbers[1], 10)]))
+        self.assertEqual(results[0][2], constants.CARD_TRANSFER_NUMBER_NONEXISTENT)
+        self.assertSame(lambda db: db.get_card_balances([1, 2]))
+
+    def test_pool_skips_numbers_taken_since_pooling(self):
+        pooled = [Card(checksum_type="luhn").number for _ in range(2)]
+        for db in self.engines():
+            db.fill_card_number_pool([(number, "1111") for number in pooled])
+            db.create_card_record((pooled[0], "2222", 0))
+        issued = self.assertSame(lambda db: [card[1:] for card in db.issue_pool_cards(2)])
+        self.assertEqual(issued, [(pooled[1], "1111", 0)])
+        self.assertSame(lambda db: db.get_card_number_pool_size())
+
+    def test_search(self):
+        suffix = self.numbers[0][-4:]
+        self.assertSame(lambda db: [card[1] for card in db.search_cards(suffix)])
+        self.assertSame(lambda db: [card[1] for card in db.search_cards(suffix, closed=True)])
+        self.assertEqual(self.assertSame(lambda db: len(db.search_cards(suffix, limit=-1))), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
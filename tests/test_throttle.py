@@ -0,0 +1,44 @@
+import unittest
+from classes.throttle import LoginThrottle
+
+
+class LoginThrottleTest(unittest.TestCase):
+
+    def test_lockout_doubles(self):
+        throttle = LoginThrottle(threshold=2, base_lockout=1, max_lockout=4)
+        waits = []
+        for _ in range(5):
+            throttle.record_failure("4000", "s", now=0)
+            waits.append(throttle.get_wait("4000", "other", now=0))
+        self.assertEqual(waits, [0, 1, 2, 4, 4])
+        throttle.record_success("4000", "s")
+        self.assertEqual(throttle.get_wait("4000", "s", now=0), 0)
+
+    def test_junk_keys_do_not_push_a_lockout_out(self):
+        throttle = LoginThrottle(threshold=1, base_lockout=60, max_entries=4)
+        throttle.record_failure("victim", "attacker", now=0)
+        for index in range(10):
+            throttle.record_failure(f"junk-{index}", "attacker", now=1)
+        self.assertGreater(throttle.get_wait("victim", "owner", now=2), 0)
+
+    def test_unlocked_keys_are_forgotten_first(self):
+        throttle = LoginThrottle(threshold=2, base_lockout=60, max_entries=4)
+        throttle.record_failure("locked", "a", now=0)
+        throttle.record_failure("locked", "a", now=0)
+        throttle.record_failure("old", "b", now=1)
+        throttle.record_failure("new", "c", now=2)
+        self.assertGreater(throttle.get_wait("locked", "", now=3), 0)
+        self.assertEqual(list(throttle.entries), [("card", "locked"), ("session", "a"), ("card", "new"), ("session", "c")])
+
+    def test_full_of_lockouts_fails_closed(self):
+        throttle = LoginThrottle(threshold=1, base_lockout=60, max_entries=2)
+        throttle.record_failure("a", "s", now=0)
+        throttle.record_failure("b", "s", now=0)
+        self.assertEqual(len(throttle.entries), 2)
+        self.assertGreater(throttle.get_wait("b", "t", now=1), 0)
+        self.assertGreater(throttle.get_wait("unknown", "t", now=1), 0)
+        self.assertEqual(throttle.get_wait("unknown", "t", now=61), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,45 @@
+import unittest
+from classes.velocity import SlidingWindowCounter, VelocityLimiter
+
+
+class SlidingWindowCounterTest(unittest.TestCase):
+
+    def test_limit_within_a_window(self):
+        counter = SlidingWindowCounter(limit=3, window=1)
+        for _ in range(3):
+            self.assertTrue(counter.is_allowed("a", 0.1))
+            counter.add("a", 0.1)
+        self.assertFalse(counter.is_allowed("a", 0.9))
+        self.assertTrue(counter.is_allowed("b", 0.9))
+
+    def test_previous_window_is_weighted(self):
+        counter = SlidingWindowCounter(limit=3, window=1)
+        for _ in range(4):
+            counter.add("a", 0.5)
+        # 4 events weighted by the 75% of the previous window still in the sliding window
+        self.assertFalse(counter.is_allowed("a", 1.25))
+        # 4 events weighted by 50%
+        self.assertTrue(counter.is_allowed("a", 1.5))
+
+    def test_idle_keys_are_dropped(self):
+        counter = SlidingWindowCounter(limit=3, window=1)
+        counter.add("a", 0.5)
+        counter.add("b", 1.5)
+        self.assertEqual(counter.get_key_count(), 2)
+        counter.add("b", 2.5)
+        self.assertEqual(counter.get_key_count(), 1)
+        counter.add("c", 10)
+        self.assertEqual(counter.get_key_count(), 1)
+        self.assertTrue(counter.is_allowed("b", 10))
+
+
+class VelocityLimiterTest(unittest.TestCase):
+
+    def test_card_and_global_limits(self):
+        limiter = VelocityLimiter(card_limit=2, global_limit=3, window=1)
+        self.assertEqual([limiter.allow("1", now=0.1) for _ in range(3)], [True, True, False])
+        self.assertEqual([limiter.allow("2", now=0.1) for _ in range(2)], [True, False])
+
+
+if __name__ == "__main__":
+    unittest.main()